@@ -0,0 +1,96 @@
+"""Bearer tokens for the API: short-lived access tokens and longer-lived refresh tokens.
+
+Both are HS256 JWTs with sub, type ("access" or "refresh"), iat and exp claims.
+Every /api route except login, refresh and member photos (which <img> tags load
+without headers) requires a valid access token in the Authorization header.
+
+Verifying a token means an HMAC over it plus JSON decoding. The same token
+arrives with every request a client makes, so TokenVerifier keeps the claims of
+tokens it has already verified in a small LRU keyed by signature. A hit still
+compares the whole signed part of the token and checks exp, so an expired
+token is refused even when it is cached.
+"""
+import hmac
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import jwt
+
+ACCESS = "access"
+REFRESH = "refresh"
+ALGORITHM = "HS256"
+
+ACCESS_TOKEN_SECONDS = int(os.environ.get('ACCESS_TOKEN_SECONDS', 15 * 60))
+REFRESH_TOKEN_SECONDS = int(os.environ.get('REFRESH_TOKEN_SECONDS', 30 * 86400))
+VERIFY_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 4096))
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class TokenVerifier:
+    """Issues and verifies tokens; max_entries=0 turns the verified-token cache off"""
+
+    def __init__(self, secret: str, max_entries: int = VERIFY_CACHE_SIZE,
+                 access_seconds: int = ACCESS_TOKEN_SECONDS, refresh_seconds: int = REFRESH_TOKEN_SECONDS):
+        self.secret = secret
+        self.max_entries = max_entries
+        self.lifetimes = {ACCESS: access_seconds, REFRESH: refresh_seconds}
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "rejected": 0}
+
+    def issue(self, subject: str, token_type: str = ACCESS) -> str:
+        now = int(time.time())
+        claims = {"sub": subject, "type": token_type, "iat": now, "exp": now + self.lifetimes[token_type]}
+        if token_type == REFRESH:
+            # Two refresh tokens issued in the same second would otherwise be identical
+            claims["jti"] = uuid.uuid4().hex
+        return jwt.encode(claims, self.secret, algorithm=ALGORITHM)
+
+    def issue_pair(self, subject: str) -> dict:
+        return {
+            "token": self.issue(subject, ACCESS),
+            "refresh_token": self.issue(subject, REFRESH),
+            "token_type": "bearer",
+            "expires_in": self.lifetimes[ACCESS],
+        }
+
+    def verify(self, token: str, token_type: str = ACCESS) -> dict:
+        """The token's claims; raises InvalidToken if it is malformed, forged, expired or of another type"""
+        signed, _, signature = token.rpartition(".")
+        entry = self.entries.get(signature)
+        if entry is not None and hmac.compare_digest(entry[0], signed):
+            self.entries.move_to_end(signature)
+            self.stats["hits"] += 1
+            claims = entry[1]
+        else:
+            self.stats["misses"] += 1
+            try:
+                claims = jwt.decode(token, self.secret, algorithms=[ALGORITHM], options={"require": ["exp", "sub", "type"]})
+            except jwt.InvalidTokenError as e:
+                self.stats["rejected"] += 1
+                raise InvalidToken(str(e))
+            if self.max_entries:
+                self.entries[signature] = (signed, claims)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        if claims["exp"] <= time.time():
+            self.entries.pop(signature, None)
+            self.stats["rejected"] += 1
+            raise InvalidToken("Signature has expired")
+        if claims["type"] != token_type:
+            self.stats["rejected"] += 1
+            raise InvalidToken(f"Wrong token type, expected {token_type}")
+        return claims
+
+    def info(self) -> dict:
+        return {"entries": len(self.entries), "max_entries": self.max_entries, **self.stats}
+
+
+def bearer_token(authorization: str):
+    """The token from an "Authorization: Bearer <token>" header, or None"""
+    scheme, _, token = (authorization or "").partition(" ")
+    return (token.strip() or None) if scheme.lower() == "bearer" else None
@@ -0,0 +1,191 @@
+"""Versioned response cache for the read endpoints.
+
+Entries are keyed by (scope, version, endpoint, params), where the scope is a
+family id (or "families" for the family list). Every write handler bumps its
+family's version, so entries cached before the write can no longer be looked up.
+They simply age out. There is no list of keys to delete.
+
+The default backend is an in-process LRU with a TTL, which is exact for a single
+API worker. When several workers or replicas run, set CACHE_URL=redis://... so
+that they share versions. Otherwise another worker may serve an entry for up to
+CACHE_TTL_SECONDS after a write. The redis package is only needed in that case.
+"""
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("cache")
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', 300))
+KEY_PREFIX = "onefam:"
+
+
+class LRUBackend:
+    """In-process entries and scope versions, least recently used of each evicted past max_entries.
+
+    Versions come from one counter shared by every scope, so a scope whose version was
+    evicted gets a version it never had and cannot find the entries cached before.
+    """
+
+    name = "lru"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = OrderedDict()
+        self.last_version = 0
+        self.stats = {"evictions": 0, "expirations": 0, "version_evictions": 0}
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            self.stats["expirations"] += 1
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def version(self, scope: str) -> int:
+        version = self.versions.get(scope)
+        if version is None:
+            return await self.bump(scope)
+        self.versions.move_to_end(scope)
+        return version
+
+    async def bump(self, scope: str) -> int:
+        self.last_version += 1
+        self.versions[scope] = self.last_version
+        self.versions.move_to_end(scope)
+        while len(self.versions) > self.max_entries:
+            self.versions.popitem(last=False)
+            self.stats["version_evictions"] += 1
+        return self.last_version
+
+    def info(self) -> dict:
+        return {"entries": len(self.entries), "versions": len(self.versions), "max_entries": self.max_entries, **self.stats}
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """Entries and versions in Redis (or anything speaking its protocol), shared by every API worker"""
+
+    name = "redis"
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL is a Redis URL but the redis package is not installed (pip install redis)")
+        return cls(redis.from_url(url))
+
+    async def get(self, key: str):
+        return await self.client.get(KEY_PREFIX + key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.client.set(KEY_PREFIX + key, value, ex=ttl)
+
+    async def version(self, scope: str) -> int:
+        return int(await self.client.get(f"{KEY_PREFIX}version:{scope}") or 0)
+
+    async def bump(self, scope: str) -> int:
+        return await self.client.incr(f"{KEY_PREFIX}version:{scope}")
+
+    def info(self) -> dict:
+        return {}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def backend_from_env():
+    url = os.environ.get('CACHE_URL')
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend.from_url(url)
+    return LRUBackend()
+
+
+class ResponseCache:
+    """Cached response bodies (plus the headers that go with them) per family version"""
+
+    def __init__(self, backend=None, ttl: int = CACHE_TTL_SECONDS):
+        self.backend = backend or LRUBackend()
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "sets": 0, "bumps": 0, "errors": 0}
+
+    @staticmethod
+    def key(scope: str, version: int, name: str, params: dict) -> str:
+        return f"{scope}:v{version}:{name}:{json.dumps(params, sort_keys=True, default=str)}"
+
+    async def version(self, scope: str):
+        """The scope's current version, or None when the backend is unreachable (the cache is then bypassed)"""
+        try:
+            return await self.backend.version(scope)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Cache version lookup failed: {str(e)}")
+            return None
+
+    async def get(self, key: str):
+        """(body, headers) for a cached response, or None"""
+        try:
+            raw = await self.backend.get(key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Cache read failed: {str(e)}")
+            raw = None
+        if raw is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        headers, _, body = raw.partition(b"\n")
+        return body, json.loads(headers)
+
+    async def set(self, key: str, body: bytes, headers: dict):
+        try:
+            await self.backend.set(key, json.dumps(headers).encode() + b"\n" + body, self.ttl)
+            self.stats["sets"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Cache write failed: {str(e)}")
+
+    async def bump(self, *scopes: str):
+        """Invalidate everything cached for the scopes; call after every write"""
+        for scope in scopes:
+            try:
+                await self.backend.bump(scope)
+                self.stats["bumps"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Cache invalidation failed for {scope}: {str(e)}")
+
+    async def close(self):
+        await self.backend.close()
+
+    def info(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "backend": self.backend.name,
+            "ttl_seconds": self.ttl,
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            **self.backend.info(),
+        }
@@ -0,0 +1,166 @@
+"""Family deletion and orphan cleanup, run by the worker as jobs.
+
+DELETE /families/{id} only marks the family deleted (deleted_at), which hides it
+from every read, and queues a "family_delete" job. The job removes the family's
+data one collection at a time, in batches of DELETE_BATCH_SIZE with a short pause
+between them, and removes the family document last. After every batch it saves
+its progress on the job (see GET /jobs/{id}) and extends its lease. Each batch
+only deletes what is still there, so a job taken over after its worker died, or
+retried after an error, carries on where the last one stopped.
+
+The "orphan_sweep" job, queued once per SWEEP_INTERVAL_SECONDS by the worker,
+finds what earlier deletes left behind. That covers soft-deleted families whose
+delete job died, members, events and calendar rows whose family document is
+gone, and photos whose member no longer exists. It queues a family_delete job
+for each family and deletes the photos itself.
+"""
+import asyncio
+import logging
+import os
+from datetime import timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+import jobs
+
+logger = logging.getLogger("cleanup")
+
+DELETE_KIND = "family_delete"
+SWEEP_KIND = "orphan_sweep"
+
+DELETE_BATCH_SIZE = int(os.environ.get('DELETE_BATCH_SIZE', 500))
+DELETE_BATCH_PAUSE_SECONDS = float(os.environ.get('DELETE_BATCH_PAUSE_SECONDS', 0.05))
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('SWEEP_INTERVAL_SECONDS', 6 * 3600))
+CHECK_INTERVAL_SECONDS = 60
+# A new member's photo is stored just before the member, so younger photos are never swept
+PHOTO_GRACE_SECONDS = 3600
+
+# What a family delete removes, in order: calendar rows and queued reminders go first,
+# so nothing more is sent for the family
+STAGES = ("occurrences", "jobs", "reminder_log", "custom_events", "photos", "family_members", "family")
+# Collections whose documents belong to a family by family_id
+FAMILY_COLLECTIONS = ("family_members", "custom_events", "occurrences", "reminder_log")
+
+
+async def enqueue_delete(db, family_id: str) -> dict:
+    return await jobs.enqueue(db, DELETE_KIND, {}, family_id=family_id)
+
+
+async def _stage_totals(db, photo_store, family_id: str) -> dict:
+    totals = {}
+    for stage in ("occurrences", "reminder_log", "custom_events", "family_members"):
+        totals[stage] = await db[stage].count_documents({"family_id": family_id})
+    totals["photos"] = await db[f"{photo_store.bucket_name}.files"].count_documents({"metadata.family_id": family_id})
+    return totals
+
+
+async def _delete_batch(db, photo_store, job: dict, stage: str) -> int:
+    """Delete up to DELETE_BATCH_SIZE of the family's documents for stage; returns how many were deleted"""
+    family_id = job["family_id"]
+    if stage == "photos":
+        return await photo_store.delete_family(family_id, limit=DELETE_BATCH_SIZE)
+    if stage == "family":
+        result = await db.families.delete_one({"id": family_id, "deleted_at": {"$exists": True}})
+        return result.deleted_count
+    query = {"family_id": family_id}
+    if stage == "jobs":
+        query.update(status=jobs.QUEUED, id={"$ne": job["id"]})
+    ids = [doc["_id"] async for doc in db[stage].find(query, {"_id": 1}).limit(DELETE_BATCH_SIZE)]
+    if not ids:
+        return 0
+    result = await db[stage].delete_many({"_id": {"$in": ids}})
+    return result.deleted_count
+
+
+async def delete_family(db, photo_store, job: dict) -> dict:
+    """Handler for family_delete jobs; the result counts what each stage deleted, and is saved after every batch"""
+    family_id = job["family_id"]
+    family = await db.families.find_one({"id": family_id}, {"_id": 0, "deleted_at": 1})
+    if family is not None and not family.get("deleted_at"):
+        raise jobs.PermanentJobError("Family is not marked deleted")
+    progress = job.get("result") or {
+        "stage": STAGES[0],
+        "deleted": dict.fromkeys(STAGES, 0),
+        "total": await _stage_totals(db, photo_store, family_id),
+    }
+    # Every stage is run again on a resume; the ones already finished find nothing left
+    for stage in STAGES:
+        progress["stage"] = stage
+        while True:
+            deleted = await _delete_batch(db, photo_store, job, stage)
+            progress["deleted"][stage] += deleted
+            if not await jobs.heartbeat(db, job, progress):
+                raise jobs.RetryableJobError("Another worker took over the job", progress)
+            if deleted < DELETE_BATCH_SIZE:
+                break
+            await asyncio.sleep(DELETE_BATCH_PAUSE_SECONDS)
+    progress["stage"] = jobs.DONE
+    logger.info(f"Family {family_id} deleted: {progress['deleted']}")
+    return progress
+
+
+async def _pending_deletes(db) -> set:
+    cursor = db.jobs.find({"kind": DELETE_KIND, "status": {"$in": [jobs.QUEUED, jobs.RUNNING]}}, {"_id": 0, "family_id": 1})
+    return {job["family_id"] async for job in cursor}
+
+
+async def _missing_families(db, family_ids: list) -> set:
+    """The ids that have no family document at all (soft-deleted ones still have theirs)"""
+    missing = set()
+    for start in range(0, len(family_ids), DELETE_BATCH_SIZE):
+        chunk = family_ids[start:start + DELETE_BATCH_SIZE]
+        found = db.families.find({"id": {"$in": chunk}}, {"_id": 0, "id": 1})
+        missing.update(set(chunk) - {family["id"] async for family in found})
+    return missing
+
+
+async def sweep(db, photo_store, job: dict = None) -> dict:
+    """Handler for orphan_sweep jobs: queue a delete for every family that needs one, and delete orphaned photos"""
+    pending = await _pending_deletes(db)
+    soft_deleted = {family["id"] async for family in db.families.find({"deleted_at": {"$exists": True}}, {"_id": 0, "id": 1})}
+    orphaned = set()
+    for collection in FAMILY_COLLECTIONS:
+        family_ids = [row["_id"] async for row in db[collection].aggregate([{"$group": {"_id": "$family_id"}}]) if row["_id"]]
+        orphaned |= await _missing_families(db, family_ids)
+
+    to_delete = sorted((soft_deleted | orphaned) - pending)
+    await jobs.enqueue_many(db, [jobs.new_job(DELETE_KIND, {"orphaned": family_id in orphaned}, family_id=family_id) for family_id in to_delete])
+    photos = await photo_store.delete_orphans(jobs.utcnow() - timedelta(seconds=PHOTO_GRACE_SECONDS), DELETE_BATCH_SIZE)
+    if to_delete or photos:
+        logger.warning(f"Orphan sweep queued {len(to_delete)} family delete(s) and removed the photos of {photos} missing member(s)")
+    return {"deletes_queued": to_delete, "orphaned_families": sorted(orphaned), "orphaned_photos_deleted": photos}
+
+
+async def queue_sweep(db) -> dict:
+    return await jobs.enqueue(db, SWEEP_KIND, {})
+
+
+class Sweeper:
+    """Queues one orphan_sweep job per SWEEP_INTERVAL_SECONDS window, however many workers are running"""
+
+    def __init__(self, db, interval: int = SWEEP_INTERVAL_SECONDS):
+        self.db = db
+        self.interval = interval
+
+    async def queue_due(self) -> bool:
+        window = int(jobs.utcnow().timestamp() // self.interval)
+        job = jobs.new_job(SWEEP_KIND, {"window": window})
+        # The id is the same on every worker, so the unique index lets only one of them queue the window's sweep
+        job["id"] = f"{SWEEP_KIND}:{window}"
+        try:
+            await self.db.jobs.insert_one(job)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def run(self, stop: asyncio.Event):
+        logger.info(f"Orphan sweeper running every {self.interval} s")
+        while not stop.is_set():
+            try:
+                await self.queue_due()
+            except Exception as e:
+                logger.error(f"Could not queue the orphan sweep: {str(e)}")
+            try:
+                await asyncio.wait_for(stop.wait(), CHECK_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,204 @@
+"""Streaming family export for backups and migrations.
+
+Members and custom events are read from cursors in batches and written out as
+they arrive, so an export never holds the whole family in memory:
+
+- ndjson: one object per line with a "type" of family, member or event. It
+  round-trips through POST /families/{id}/import and is the backup format.
+- json: one document {"family": ..., "members": [...], "events": [...]}, for
+  tools that want a single JSON value.
+- gedcom: GEDCOM 5.5.1 INDI records plus one FAM record per pair of parents,
+  for other genealogy software. Timezones and custom events have no place in
+  it, and an anniversary is only kept as the MARR date of a couple with
+  children.
+
+With photos=True each ndjson or json member carries its original photo as a
+photo_base64 data URL, read from GridFS one member at a time. With
+compress=True the stream is gzipped.
+"""
+import base64
+import hashlib
+import json
+import zlib
+from datetime import datetime
+
+import occurrences
+
+NDJSON = "ndjson"
+JSON = "json"
+GEDCOM = "gedcom"
+FORMATS = (NDJSON, JSON, GEDCOM)
+MEDIA_TYPES = {NDJSON: "application/x-ndjson", JSON: "application/json", GEDCOM: "application/x-gedcom"}
+EXTENSIONS = {NDJSON: "ndjson", JSON: "json", GEDCOM: "ged"}
+FORMAT_VERSION = 1
+
+BATCH_SIZE = 500
+# Records are joined into chunks of about this size before they are sent (and compressed)
+CHUNK_SIZE = 64 * 1024
+
+# The stored date parts are derived from the YYYY-MM-DD fields and rebuilt on import
+MEMBER_PROJECTION = {"_id": 0, "photo_base64": 0, **dict.fromkeys(occurrences.PART_FIELDS, 0)}
+EVENT_PROJECTION = {"_id": 0, **dict.fromkeys(occurrences.PART_FIELDS, 0)}
+GEDCOM_MONTHS = ("JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC")
+
+
+def _default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def dumps(value) -> str:
+    return json.dumps(value, default=_default, ensure_ascii=False)
+
+
+async def members(db, family_id: str, photo_store=None):
+    """The family's members by id, each with its photo as a data URL when photo_store is given"""
+    cursor = db.family_members.find({"family_id": family_id}, MEMBER_PROJECTION).sort("id", 1).batch_size(BATCH_SIZE)
+    async for member in cursor:
+        if photo_store is not None and member.get("photo_hash"):
+            photo = await photo_store.read(member["id"])
+            if photo:
+                data, content_type = photo
+                member["photo_base64"] = f"data:{content_type};base64,{base64.b64encode(data).decode()}"
+        yield member
+
+
+def events(db, family_id: str):
+    return db.custom_events.find({"family_id": family_id}, EVENT_PROJECTION).sort("id", 1).batch_size(BATCH_SIZE)
+
+
+# ============= JSON =============
+
+async def ndjson_lines(db, family: dict, photo_store=None):
+    yield dumps({"type": "family", "format_version": FORMAT_VERSION, **family}) + "\n"
+    async for member in members(db, family["id"], photo_store):
+        yield dumps({"type": "member", **member}) + "\n"
+    async for event in events(db, family["id"]):
+        yield dumps({"type": "event", **event}) + "\n"
+
+
+async def json_parts(db, family: dict, photo_store=None):
+    """One JSON document, written a member or event at a time"""
+    yield f'{{"format_version": {FORMAT_VERSION}, "family": {dumps(family)}, "members": ['
+    separator = ""
+    async for member in members(db, family["id"], photo_store):
+        yield separator + dumps(member)
+        separator = ", "
+    yield '], "events": ['
+    separator = ""
+    async for event in events(db, family["id"]):
+        yield separator + dumps(event)
+        separator = ", "
+    yield "]}\n"
+
+
+# ============= GEDCOM =============
+
+def gedcom_date(value: str):
+    """"12 MAR 1950" for "1950-03-12"; None for anything that is not a valid date"""
+    day = occurrences.parse_date(value)
+    return day and f"{day.day} {GEDCOM_MONTHS[day.month - 1]} {day.year}"
+
+
+def gedcom_text(level: int, tag: str, value: str) -> str:
+    """A GEDCOM line, with CONT lines for any line breaks in value"""
+    first, *rest = str(value).splitlines() or [""]
+    return "".join([f"{level} {tag} {first}\n", *(f"{level + 1} CONT {line}\n" for line in rest)])
+
+
+def xref(member_id: str) -> str:
+    return f"@{member_id}@"
+
+
+def family_xref(father_id, mother_id) -> str:
+    return "@F" + hashlib.sha1(f"{father_id}|{mother_id}".encode()).hexdigest()[:16] + "@"
+
+
+def gedcom_individual(member: dict) -> str:
+    lines = [
+        f"0 {xref(member['id'])} INDI\n",
+        f"1 NAME {member.get('first_name', '')} /{member.get('last_name', '')}/\n",
+        f"2 GIVN {member.get('first_name', '')}\n",
+        f"2 SURN {member.get('last_name', '')}\n",
+    ]
+    birthday = gedcom_date(member.get("birthday"))
+    if birthday:
+        lines.append(f"1 BIRT\n2 DATE {birthday}\n")
+    if member.get("email"):
+        lines.append(f"1 EMAIL {member['email']}\n")
+    if member.get("address"):
+        lines.append("1 RESI\n" + gedcom_text(2, "ADDR", member["address"]))
+    if member.get("comments"):
+        lines.append(gedcom_text(1, "NOTE", member["comments"]))
+    return "".join(lines)
+
+
+async def gedcom_families(db, family_id: str):
+    """FAM records: the children of each (father, mother) pair, grouped by the database"""
+    pipeline = [
+        {"$match": {"family_id": family_id, "$or": [{"father_id": {"$nin": [None, ""]}}, {"mother_id": {"$nin": [None, ""]}}]}},
+        {"$project": {"_id": 0, "id": 1, "father_id": 1, "mother_id": 1}},
+        {"$group": {"_id": {"father": "$father_id", "mother": "$mother_id"}, "children": {"$push": "$id"}}},
+        {"$sort": {"_id.father": 1, "_id.mother": 1}},
+    ]
+    batch = []
+    async for group in db.family_members.aggregate(pipeline, allowDiskUse=True, batchSize=BATCH_SIZE):
+        batch.append(group)
+        if len(batch) >= BATCH_SIZE:
+            yield await _family_records(db, family_id, batch)
+            batch = []
+    if batch:
+        yield await _family_records(db, family_id, batch)
+
+
+async def _family_records(db, family_id: str, groups: list) -> str:
+    parent_ids = {parent for group in groups for parent in group["_id"].values() if parent}
+    cursor = db.family_members.find({"family_id": family_id, "id": {"$in": list(parent_ids)}}, {"_id": 0, "id": 1, "anniversary": 1})
+    anniversaries = {parent["id"]: parent.get("anniversary") async for parent in cursor}
+    records = []
+    for group in groups:
+        father, mother = group["_id"].get("father"), group["_id"].get("mother")
+        lines = [f"0 {family_xref(father, mother)} FAM\n"]
+        # Parents that are not members of the family (deleted since) are left out
+        if father in anniversaries:
+            lines.append(f"1 HUSB {xref(father)}\n")
+        if mother in anniversaries:
+            lines.append(f"1 WIFE {xref(mother)}\n")
+        lines.extend(f"1 CHIL {xref(child)}\n" for child in sorted(group["children"]))
+        marriage = father in anniversaries and mother in anniversaries and anniversaries[father] == anniversaries[mother] and gedcom_date(anniversaries[father])
+        if marriage:
+            lines.append(f"1 MARR\n2 DATE {marriage}\n")
+        records.append("".join(lines))
+    return "".join(records)
+
+
+async def gedcom_records(db, family: dict, photo_store=None):
+    yield (
+        "0 HEAD\n1 SOUR OneFam\n1 GEDC\n2 VERS 5.5.1\n2 FORM LINEAGE-LINKED\n1 CHAR UTF-8\n"
+        + gedcom_text(1, "NOTE", f"Family: {family.get('name', '')}")
+    )
+    async for member in members(db, family["id"]):
+        yield gedcom_individual(member)
+    async for records in gedcom_families(db, family["id"]):
+        yield records
+    yield "0 TRLR\n"
+
+
+WRITERS = {NDJSON: ndjson_lines, JSON: json_parts, GEDCOM: gedcom_records}
+
+
+async def export_family(db, family: dict, file_format: str, photo_store=None, compress: bool = False):
+    """Bytes of the export in chunks of about CHUNK_SIZE, gzipped when compress is set"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer, size = [], 0
+    async for part in WRITERS[file_format](db, family, photo_store):
+        data = part.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = b"".join(buffer)
+    yield compressor.compress(chunk) + compressor.flush() if compressor else chunk
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+GRAPH_PROJECTION = {"_id": 0, "id": 1, "father_id": 1, "mother_id": 1}
+MAX_FAMILIES = int(os.environ.get('GRAPH_MAX_FAMILIES', 64))
+# Other API workers update their own copies, so a graph is rebuilt once it is this old
+GRAPH_TTL_SECONDS = float(os.environ.get('GRAPH_TTL_SECONDS', 300))
+
+ORDINALS = ["zeroth", "first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth"]
+REMOVALS = {1: "once", 2: "twice", 3: "three times"}
+
+
+class FamilyGraph:
+    """Parent/child adjacency for one family"""
+
+    def __init__(self):
+        self.parents = {}
+        self.children = {}
+
+    def upsert(self, member: dict):
+        member_id = member["id"]
+        new_parents = tuple(dict.fromkeys(p for p in (member.get("father_id"), member.get("mother_id")) if p and p != member_id))
+        for parent_id in self.parents.get(member_id, ()):
+            if parent_id not in new_parents:
+                self.children.get(parent_id, set()).discard(member_id)
+        for parent_id in new_parents:
+            self.children.setdefault(parent_id, set()).add(member_id)
+        self.parents[member_id] = new_parents
+        self.children.setdefault(member_id, set())
+
+    def remove(self, member_id: str):
+        for parent_id in self.parents.pop(member_id, ()):
+            self.children.get(parent_id, set()).discard(member_id)
+        # Children keep pointing at the removed member; it just stops being walkable
+        if not self.children.get(member_id):
+            self.children.pop(member_id, None)
+
+    def __contains__(self, member_id):
+        return member_id in self.parents
+
+    def _walk(self, start: str, edges: dict, max_depth: int = None) -> dict:
+        """Breadth-first walk from start; returns {member_id: shortest depth}, start included at 0"""
+        depths = {start: 0}
+        queue = deque([start])
+        while queue:
+            member_id = queue.popleft()
+            depth = depths[member_id]
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for next_id in edges.get(member_id, ()):
+                if next_id not in depths and next_id in self.parents:
+                    depths[next_id] = depth + 1
+                    queue.append(next_id)
+        return depths
+
+    def ancestors(self, member_id: str, max_depth: int = None) -> dict:
+        depths = self._walk(member_id, self.parents, max_depth)
+        del depths[member_id]
+        return depths
+
+    def descendants(self, member_id: str, max_depth: int = None) -> dict:
+        depths = self._walk(member_id, self.children, max_depth)
+        del depths[member_id]
+        return depths
+
+    def common_ancestors(self, a: str, b: str):
+        """(all common ancestors with their depths from a and b, the lowest ones)"""
+        up_a = self._walk(a, self.parents)
+        up_b = self._walk(b, self.parents)
+        common = {member_id: (up_a[member_id], up_b[member_id]) for member_id in up_a.keys() & up_b.keys()}
+        # Lowest: no child of theirs is a common ancestor too
+        lowest = [member_id for member_id in common if not any(child in common for child in self.children.get(member_id, ()))]
+        lowest.sort(key=lambda member_id: (sum(common[member_id]), member_id))
+        return common, lowest
+
+    def relationship(self, a: str, b: str) -> dict:
+        """How a is related to b, e.g. {"label": "first cousin once removed", ...}"""
+        if a == b:
+            return {"label": "self", "lowest_common_ancestors": [a], "a_depth": 0, "b_depth": 0}
+        common, lowest = self.common_ancestors(a, b)
+        if not lowest:
+            shared_children = self.children.get(a, set()) & self.children.get(b, set())
+            return {
+                "label": "co-parent" if shared_children else None,
+                "lowest_common_ancestors": [],
+                "a_depth": None,
+                "b_depth": None,
+            }
+        a_depth, b_depth = common[lowest[0]]
+        label = relationship_label(a_depth, b_depth)
+        # Half only when both parents of each are known; a missing parent may well be the shared one
+        if a_depth == b_depth == 1 and len(self.parents[a]) == len(self.parents[b]) == 2 and set(self.parents[a]) != set(self.parents[b]):
+            label = "half-sibling"
+        result = {
+            "label": label,
+            "lowest_common_ancestors": [member_id for member_id in lowest if common[member_id] == (a_depth, b_depth)],
+            "a_depth": a_depth,
+            "b_depth": b_depth,
+        }
+        if a_depth >= 2 and b_depth >= 2:
+            result["cousin_degree"] = min(a_depth, b_depth) - 1
+            result["removal"] = abs(a_depth - b_depth)
+        return result
+
+
+def _greats(count: int) -> str:
+    if count <= 0:
+        return ""
+    if count == 1:
+        return "great-"
+    return f"{count}x great-"
+
+
+def _ordinal(number: int) -> str:
+    return ORDINALS[number] if number < len(ORDINALS) else f"{number}th"
+
+
+def relationship_label(a_depth: int, b_depth: int) -> str:
+    """Label for member a relative to member b, given how many generations each sits below
+    their lowest common ancestor: (0, 1) is "parent", (1, 0) is "child", (2, 3) is
+    "first cousin once removed".
+    """
+    if a_depth == 0:
+        return "parent" if b_depth == 1 else f"{_greats(b_depth - 2)}grandparent"
+    if b_depth == 0:
+        return "child" if a_depth == 1 else f"{_greats(a_depth - 2)}grandchild"
+    if a_depth == 1 and b_depth == 1:
+        return "sibling"
+    if a_depth == 1:
+        return f"{_greats(b_depth - 2)}aunt/uncle"
+    if b_depth == 1:
+        return f"{_greats(a_depth - 2)}niece/nephew"
+    degree = min(a_depth, b_depth) - 1
+    removal = abs(a_depth - b_depth)
+    label = f"{_ordinal(degree)} cousin"
+    if removal:
+        label += f" {REMOVALS.get(removal, f'{removal} times')} removed"
+    return label
+
+
+class GraphIndex:
+    """Per-family FamilyGraphs, built lazily from family_members and updated on member writes"""
+
+    def __init__(self, db, max_families: int = MAX_FAMILIES, ttl: float = GRAPH_TTL_SECONDS):
+        self.db = db
+        self.max_families = max_families
+        self.ttl = ttl
+        self.graphs = OrderedDict()
+        self.built_at = {}
+        self.locks = {}
+        # Writes that arrive while a graph is being built are replayed onto it afterwards
+        self.pending = {}
+        # Families dropped while their graph was being built; that graph is returned but not cached
+        self.dropped = set()
+
+    async def get(self, family_id: str) -> FamilyGraph:
+        graph = self.graphs.get(family_id)
+        if graph is not None and time.monotonic() - self.built_at[family_id] < self.ttl:
+            self.graphs.move_to_end(family_id)
+            return graph
+        lock = self.locks.setdefault(family_id, asyncio.Lock())
+        async with lock:
+            graph = self.graphs.get(family_id)
+            if graph is not None and time.monotonic() - self.built_at[family_id] < self.ttl:
+                return graph
+            graph = await self._build(family_id)
+        self.locks.pop(family_id, None)
+        return graph
+
+    async def _build(self, family_id: str) -> FamilyGraph:
+        # Left over if the last build failed
+        self.dropped.discard(family_id)
+        self.pending[family_id] = []
+        try:
+            graph = FamilyGraph()
+            async for member in self.db.family_members.find({"family_id": family_id}, GRAPH_PROJECTION):
+                graph.upsert(member)
+            for apply in self.pending[family_id]:
+                apply(graph)
+        finally:
+            del self.pending[family_id]
+        if family_id in self.dropped:
+            self.dropped.discard(family_id)
+            return graph
+        self.graphs[family_id] = graph
+        self.built_at[family_id] = time.monotonic()
+        self.graphs.move_to_end(family_id)
+        while len(self.graphs) > self.max_families:
+            evicted, _ = self.graphs.popitem(last=False)
+            self.built_at.pop(evicted, None)
+        return graph
+
+    def _apply(self, family_id: str, apply):
+        if family_id in self.pending:
+            self.pending[family_id].append(apply)
+        graph = self.graphs.get(family_id)
+        if graph is not None:
+            apply(graph)
+
+    def upsert_member(self, family_id: str, member: dict):
+        member = {field: member.get(field) for field in ("id", "father_id", "mother_id")}
+        self._apply(family_id, lambda graph: graph.upsert(member))
+
+    def remove_member(self, family_id: str, member_id: str):
+        self._apply(family_id, lambda graph: graph.remove(member_id))
+
+    def drop(self, family_id: str):
+        if family_id in self.pending:
+            self.dropped.add(family_id)
+        self.graphs.pop(family_id, None)
+        self.built_at.pop(family_id, None)
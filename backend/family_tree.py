@@ -0,0 +1,95 @@
+from collections import deque
+
+# Fields needed to lay out the tree; everything else comes from the member list
+TREE_PROJECTION = {"_id": 0, "id": 1, "first_name": 1, "last_name": 1, "birthday": 1, "father_id": 1, "mother_id": 1}
+PARENT_FIELDS = ("father_id", "mother_id")
+
+
+def _sibling_order(member: dict):
+    # Oldest first, members without a birthday last
+    return (member.get("birthday") or "9999-99-99", member.get("first_name") or "", member.get("last_name") or "", member["id"])
+
+
+def build_tree(members) -> dict:
+    """Lay out a family from its flat member list in O(n) (plus sorting sibling lists).
+
+    Generations come from a topological pass over parent -> child edges, so a member
+    sits one generation below its deepest parent. Members on a parent cycle (or below
+    one) are reported in "cycles" and left out of the layout, and parent ids that are
+    not in the family are reported in "dangling" and treated as missing.
+    """
+    by_id = {member["id"]: member for member in members}
+    parents = {}
+    children = {member_id: [] for member_id in by_id}
+    dangling = []
+    for member_id, member in by_id.items():
+        member_parents = []
+        for field in PARENT_FIELDS:
+            parent_id = member.get(field)
+            if not parent_id:
+                continue
+            if parent_id not in by_id:
+                dangling.append({"member_id": member_id, "field": field, "parent_id": parent_id})
+            elif parent_id not in member_parents:
+                member_parents.append(parent_id)
+                children[parent_id].append(member_id)
+        parents[member_id] = member_parents
+
+    # Kahn's algorithm: a member is placed once all of its parents are
+    pending = {member_id: len(member_parents) for member_id, member_parents in parents.items()}
+    roots = [member_id for member_id, count in pending.items() if count == 0]
+    generation = {member_id: 0 for member_id in roots}
+    queue = deque(roots)
+    while queue:
+        member_id = queue.popleft()
+        for child_id in children[member_id]:
+            generation[child_id] = max(generation.get(child_id, 0), generation[member_id] + 1)
+            pending[child_id] -= 1
+            if pending[child_id] == 0:
+                queue.append(child_id)
+
+    cycles = sorted(member_id for member_id in by_id if member_id not in generation)
+    order = {member_id: _sibling_order(member) for member_id, member in by_id.items()}
+    nodes = {}
+    generations = []
+    for member_id, level in generation.items():
+        member_children = children[member_id]
+        if cycles:
+            member_children = [child_id for child_id in member_children if child_id in generation]
+        if len(member_children) > 1:
+            member_children.sort(key=order.__getitem__)
+        nodes[member_id] = {
+            "generation": level,
+            "parents": parents[member_id],
+            "children": member_children,
+        }
+        while len(generations) <= level:
+            generations.append([])
+        generations[level].append(member_id)
+    for members_at_level in generations:
+        members_at_level.sort(key=order.__getitem__)
+
+    # Couples are the parent pairs that share at least one child
+    couples = {}
+    for member_id, member_parents in parents.items():
+        if len(member_parents) == 2 and member_id in generation:
+            pair = (by_id[member_id].get("father_id"), by_id[member_id].get("mother_id"))
+            couples.setdefault(pair, []).append(member_id)
+
+    return {
+        "member_count": len(by_id),
+        "roots": sorted(roots, key=order.__getitem__),
+        "generations": generations,
+        "nodes": nodes,
+        "couples": [
+            {
+                "father_id": father_id,
+                "mother_id": mother_id,
+                "children": sorted(couple_children, key=order.__getitem__),
+            }
+            for (father_id, mother_id), couple_children in couples.items()
+        ],
+        "cycles": cycles,
+        "dangling": dangling,
+    }
+
@@ -0,0 +1,82 @@
+import logging
+import time
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from profiling import PROFILE_TTL_SECONDS
+
+logger = logging.getLogger("indexes")
+
+# (collection, keys, options) for every index the API's queries rely on.
+# create_index is a no-op when an identical index already exists.
+INDEXES = [
+    ("families", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("families", [("timezone", ASCENDING)], {"name": "timezone", "sparse": True}),
+    ("families", [("deleted_at", ASCENDING)], {"name": "deleted_at", "sparse": True}),
+
+    ("family_members", [("family_id", ASCENDING), ("id", ASCENDING)], {"name": "family_id_id", "unique": True}),
+    ("family_members", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("family_members", [("family_id", ASCENDING), ("father_id", ASCENDING)], {"name": "family_id_father_id"}),
+    ("family_members", [("family_id", ASCENDING), ("mother_id", ASCENDING)], {"name": "family_id_mother_id"}),
+    ("family_members", [("timezone", ASCENDING)], {"name": "timezone", "sparse": True}),
+
+    ("custom_events", [("family_id", ASCENDING), ("id", ASCENDING)], {"name": "family_id_id", "unique": True}),
+    ("custom_events", [("family_id", ASCENDING), ("event_month", ASCENDING), ("id", ASCENDING)], {"name": "family_id_event_month_id"}),
+    ("custom_events", [("family_id", ASCENDING), ("event_on", ASCENDING)], {"name": "family_id_event_on"}),
+
+    ("occurrences", [("family_id", ASCENDING), ("kind", ASCENDING), ("source_id", ASCENDING)], {"name": "family_id_kind_source_id", "unique": True}),
+    ("occurrences", [("family_id", ASCENDING), ("month", ASCENDING), ("day", ASCENDING)], {"name": "family_id_month_day"}),
+    ("occurrences", [("family_id", ASCENDING), ("source_id", ASCENDING)], {"name": "family_id_source_id"}),
+    # The daily reminder run reads one day across every family
+    ("occurrences", [("month", ASCENDING), ("day", ASCENDING)], {"name": "month_day"}),
+
+    ("jobs", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("jobs", [("status", ASCENDING), ("run_at", ASCENDING)], {"name": "status_run_at"}),
+    ("jobs", [("status", ASCENDING), ("locked_until", ASCENDING)], {"name": "status_locked_until"}),
+    ("jobs", [("finished_at", ASCENDING)], {"name": "finished_at"}),
+    ("jobs", [("family_id", ASCENDING), ("kind", ASCENDING), ("status", ASCENDING)], {"name": "family_id_kind_status"}),
+
+    ("reminder_log", [("family_id", ASCENDING), ("event_key", ASCENDING), ("date", ASCENDING), ("recipient", ASCENDING)], {"name": "family_id_event_key_date_recipient", "unique": True}),
+    ("reminder_log", [("job_id", ASCENDING), ("status", ASCENDING)], {"name": "job_id_status"}),
+
+    ("import_links", [("import_id", ASCENDING), ("row", ASCENDING)], {"name": "import_id_row"}),
+    # Imports delete their links when done; this clears those of a process that died mid-import
+    ("import_links", [("created_at", ASCENDING)], {"name": "created_at_ttl", "expireAfterSeconds": 86400}),
+
+    ("member_photos.files", [("metadata.family_id", ASCENDING)], {"name": "metadata_family_id"}),
+
+    ("request_profiles", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("request_profiles", [("created_at", ASCENDING)], {"name": "created_at_ttl", "expireAfterSeconds": PROFILE_TTL_SECONDS}),
+]
+
+
+async def ensure_indexes(db):
+    """Create every index in INDEXES. Raises on the first failure so the app does not start half-indexed."""
+    total_start = time.perf_counter()
+    for collection, keys, options in INDEXES:
+        start = time.perf_counter()
+        try:
+            await db[collection].create_index(keys, **options)
+        except PyMongoError as e:
+            logger.error(f"Index build failed for {collection}.{options['name']}: {str(e)}")
+            raise
+        logger.info(f"Index {collection}.{options['name']} ready in {(time.perf_counter() - start) * 1000:.1f} ms")
+    logger.info(f"{len(INDEXES)} indexes ready in {(time.perf_counter() - total_start) * 1000:.1f} ms")
+
+
+async def index_stats(db) -> dict:
+    """Per-collection $indexStats: how often each index has been used since the server started"""
+    stats = {}
+    for collection in dict.fromkeys(collection for collection, _, _ in INDEXES):
+        rows = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+        stats[collection] = [
+            {
+                "name": row["name"],
+                "key": row["key"],
+                "ops": row["accesses"]["ops"],
+                "since": row["accesses"]["since"],
+            }
+            for row in sorted(rows, key=lambda row: row["name"])
+        ]
+    return stats
@@ -0,0 +1,290 @@
+"""Durable job queue in the `jobs` collection.
+
+The API enqueues jobs and a separate worker process (worker.py) runs them. A
+worker claims a job with a single find_one_and_update and holds it for a lease.
+If the worker dies, the job becomes claimable again once the lease expires,
+unless that was its last attempt.
+Failed jobs are retried with exponential backoff. After MAX_ATTEMPTS failures,
+or on a PermanentJobError, the job is moved to the "dead" state and kept for
+inspection.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ReturnDocument
+
+import metrics
+
+logger = logging.getLogger("jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+STATUSES = (QUEUED, RUNNING, DONE, DEAD)
+
+MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+BACKOFF_BASE_SECONDS = float(os.environ.get('JOB_BACKOFF_SECONDS', 30))
+BACKOFF_MAX_SECONDS = 3600
+LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+POLL_INTERVAL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 1))
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help; the job is dead-lettered right away"""
+
+    def __init__(self, message: str, result: dict = None):
+        super().__init__(message)
+        self.result = result
+
+
+class RetryableJobError(Exception):
+    """Raised by a handler to retry, keeping the partial result on the job"""
+
+    def __init__(self, message: str, result: dict = None):
+        super().__init__(message)
+        self.result = result
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def as_utc(value: datetime) -> datetime:
+    # Motor hands back naive datetimes that are in UTC
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * (0.5 + random.random() / 2)
+
+
+def new_job(kind: str, payload: dict, family_id: str = None, run_at: datetime = None,
+            max_attempts: int = MAX_ATTEMPTS) -> dict:
+    now = utcnow()
+    return {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "family_id": family_id,
+        "payload": payload,
+        "status": QUEUED,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "run_at": run_at or now,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "locked_by": None,
+        "locked_until": None,
+        "last_error": None,
+        "result": None,
+    }
+
+
+async def enqueue(db, kind: str, payload: dict, family_id: str = None, run_at: datetime = None,
+                  max_attempts: int = MAX_ATTEMPTS) -> dict:
+    job = new_job(kind, payload, family_id, run_at, max_attempts)
+    await db.jobs.insert_one(job)
+    job.pop("_id", None)
+    return job
+
+
+async def enqueue_many(db, new_jobs: list) -> int:
+    """Insert jobs built with new_job in one round trip"""
+    if new_jobs:
+        await db.jobs.insert_many(new_jobs, ordered=False)
+    return len(new_jobs)
+
+
+async def claim(db, worker_id: str, kinds=None, lease_seconds: int = LEASE_SECONDS):
+    """Atomically take the next runnable job, or None. Jobs whose lease ran out are taken over,
+    or dead-lettered if the attempt that lost the lease was their last."""
+    now = utcnow()
+    query = {"$or": [
+        {"status": QUEUED, "run_at": {"$lte": now}},
+        {"status": RUNNING, "locked_until": {"$lt": now}},
+    ]}
+    if kinds:
+        query["kind"] = {"$in": list(kinds)}
+    while True:
+        job = await db.jobs.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "locked_by": worker_id,
+                    "locked_until": now + timedelta(seconds=lease_seconds),
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        # fail() dead-letters a queued job at max_attempts, so only a takeover can go past it
+        if job is None or job["attempts"] <= job["max_attempts"]:
+            break
+        attempts = job["attempts"] - 1
+        await db.jobs.update_one(
+            {"id": job["id"], "locked_by": worker_id},
+            {
+                "$set": {
+                    "status": DEAD,
+                    "attempts": attempts,
+                    "finished_at": now,
+                    "locked_until": None,
+                    "last_error": "Lease expired on the last attempt",
+                },
+            },
+        )
+        logger.error(f"Job {job['id']} ({job['kind']}) dead-lettered after {attempts} attempt(s): its lease expired")
+    if job is not None:
+        job.pop("_id", None)
+    return job
+
+
+async def complete(db, job: dict, result: dict = None):
+    await db.jobs.update_one(
+        {"id": job["id"], "locked_by": job["locked_by"]},
+        {"$set": {"status": DONE, "result": result, "finished_at": utcnow(), "locked_until": None}},
+    )
+
+
+async def heartbeat(db, job: dict, result: dict = None, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Extend a long job's lease and save its progress; False when another worker has taken the job over"""
+    update = {"locked_until": utcnow() + timedelta(seconds=lease_seconds)}
+    if result is not None:
+        update["result"] = result
+    outcome = await db.jobs.update_one({"id": job["id"], "locked_by": job["locked_by"], "status": RUNNING}, {"$set": update})
+    return outcome.matched_count == 1
+
+
+async def fail(db, job: dict, error: str, result: dict = None, permanent: bool = False) -> str:
+    """Schedule a retry with backoff, or dead-letter the job; returns the new status"""
+    now = utcnow()
+    update = {"last_error": error, "locked_until": None}
+    if result is not None:
+        update["result"] = result
+    if permanent or job["attempts"] >= job["max_attempts"]:
+        update.update(status=DEAD, finished_at=now)
+    else:
+        update.update(status=QUEUED, run_at=now + timedelta(seconds=backoff_seconds(job["attempts"])))
+    await db.jobs.update_one({"id": job["id"], "locked_by": job["locked_by"]}, {"$set": update})
+    return update["status"]
+
+
+async def queue_stats(db, window_seconds: int = 3600) -> dict:
+    """Backlog, lag and throughput/failure counts over the last window_seconds"""
+    now = utcnow()
+    counts = dict.fromkeys(STATUSES, 0)
+    async for row in db.jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    ready = await db.jobs.count_documents({"status": QUEUED, "run_at": {"$lte": now}})
+    oldest = await db.jobs.find_one({"status": QUEUED, "run_at": {"$lte": now}}, {"_id": 0, "run_at": 1}, sort=[("run_at", 1)])
+
+    since = now - timedelta(seconds=window_seconds)
+    recent = {status: {"jobs": 0, "retries": 0, "wait_ms": 0.0, "run_ms": 0.0} for status in (DONE, DEAD)}
+    async for job in db.jobs.find({"finished_at": {"$gte": since}}, {"_id": 0, "status": 1, "attempts": 1, "run_at": 1, "started_at": 1, "finished_at": 1}):
+        bucket = recent.get(job["status"])
+        if bucket is None:
+            continue
+        bucket["jobs"] += 1
+        bucket["retries"] += max(0, job["attempts"] - 1)
+        bucket["wait_ms"] += (as_utc(job["started_at"]) - as_utc(job["run_at"])).total_seconds() * 1000
+        bucket["run_ms"] += (as_utc(job["finished_at"]) - as_utc(job["started_at"])).total_seconds() * 1000
+    finished = recent[DONE]["jobs"] + recent[DEAD]["jobs"]
+    return {
+        "counts": counts,
+        "ready": ready,
+        "lag_seconds": round((now - as_utc(oldest["run_at"])).total_seconds(), 3) if oldest else 0.0,
+        "window_seconds": window_seconds,
+        "completed": recent[DONE]["jobs"],
+        "dead_lettered": recent[DEAD]["jobs"],
+        "retries": recent[DONE]["retries"] + recent[DEAD]["retries"],
+        "throughput_per_minute": round(finished / (window_seconds / 60), 3),
+        "avg_wait_ms": round((recent[DONE]["wait_ms"] + recent[DEAD]["wait_ms"]) / finished, 1) if finished else 0.0,
+        "avg_run_ms": round((recent[DONE]["run_ms"] + recent[DEAD]["run_ms"]) / finished, 1) if finished else 0.0,
+    }
+
+
+async def queue_depth(db) -> dict:
+    """Jobs per (kind, status), plus ready jobs and the lag of the oldest one; cheaper than queue_stats"""
+    now = utcnow()
+    counts = {}
+    async for row in db.jobs.aggregate([{"$group": {"_id": {"kind": "$kind", "status": "$status"}, "count": {"$sum": 1}}}]):
+        counts[(row["_id"]["kind"], row["_id"]["status"])] = row["count"]
+    ready = {"status": QUEUED, "run_at": {"$lte": now}}
+    oldest = await db.jobs.find_one(ready, {"_id": 0, "run_at": 1}, sort=[("run_at", 1)])
+    return {
+        "counts": counts,
+        "ready": await db.jobs.count_documents(ready),
+        "lag_seconds": (now - as_utc(oldest["run_at"])).total_seconds() if oldest else 0.0,
+    }
+
+
+class Worker:
+    """Claims and runs jobs with up to `concurrency` in flight; handlers map kind -> async fn(job) -> result"""
+
+    def __init__(self, db, handlers: dict, concurrency: int = 4, poll_interval: float = POLL_INTERVAL_SECONDS,
+                 lease_seconds: int = LEASE_SECONDS, worker_id: str = None):
+        self.db = db
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.stats = {"completed": 0, "retried": 0, "dead": 0}
+
+    async def run_once(self) -> bool:
+        """Run one job if there is a runnable one; returns whether a job was run"""
+        job = await claim(self.db, self.worker_id, self.handlers.keys(), self.lease_seconds)
+        if job is None:
+            return False
+        start = time.perf_counter()
+        try:
+            result = await self.handlers[job["kind"]](job)
+        except PermanentJobError as e:
+            status = await fail(self.db, job, str(e), e.result, permanent=True)
+        except Exception as e:
+            status = await fail(self.db, job, str(e) or type(e).__name__, getattr(e, "result", None))
+        else:
+            await complete(self.db, job, result)
+            status = DONE
+        elapsed = time.perf_counter() - start
+        elapsed_ms = elapsed * 1000
+        metrics.job_finished(job["kind"], status, elapsed)
+        if status == DONE:
+            self.stats["completed"] += 1
+            logger.info(f"Job {job['id']} ({job['kind']}) done in {elapsed_ms:.0f} ms")
+        elif status == DEAD:
+            self.stats["dead"] += 1
+            logger.error(f"Job {job['id']} ({job['kind']}) dead-lettered after {job['attempts']} attempt(s)")
+        else:
+            self.stats["retried"] += 1
+            logger.warning(f"Job {job['id']} ({job['kind']}) failed attempt {job['attempts']}, retrying")
+        return True
+
+    async def _loop(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                ran = await self.run_once()
+            except Exception as e:
+                logger.error(f"Worker {self.worker_id} could not claim a job: {str(e)}")
+                ran = False
+            if not ran:
+                try:
+                    await asyncio.wait_for(stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run(self, stop: asyncio.Event):
+        logger.info(f"Worker {self.worker_id} running {', '.join(self.handlers)} with concurrency {self.concurrency}")
+        await asyncio.gather(*(self._loop(stop) for _ in range(self.concurrency)))
+        logger.info(f"Worker {self.worker_id} stopped: {self.stats}")
@@ -0,0 +1,148 @@
+"""Outbound email through the SendGrid v3 mail/send API.
+
+Every send goes through one pooled httpx.AsyncClient, so nothing blocks the event
+loop. At most MAIL_CONCURRENCY API calls are in flight, a token bucket paces them
+to MAIL_RATE_PER_SECOND, and recipients are batched into SendGrid personalizations
+so one call delivers a separate copy to each of up to MAIL_BATCH_SIZE addresses.
+Point SENDGRID_API_URL at a fake server to exercise it locally.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger("mailer")
+
+DEFAULT_API_URL = "https://api.sendgrid.com"
+SEND_PATH = "/v3/mail/send"
+# SendGrid accepts up to 1000 personalizations per request
+MAX_BATCH_SIZE = 1000
+MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 0.5
+
+SENT = "sent"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _retry_after(response: httpx.Response, attempt: int) -> float:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return RETRY_BASE_SECONDS * 2 ** attempt * (1 + random.random())
+
+
+class Mailer:
+    """Shared SendGrid client; configuration is read from the environment when it is created"""
+
+    def __init__(self, api_key: str = None, sender: str = None, api_url: str = None,
+                 concurrency: int = None, rate: float = None, batch_size: int = None, transport=None):
+        self.api_key = api_key or os.environ.get('SENDGRID_API_KEY')
+        self.sender = sender or os.environ.get('SENDER_EMAIL', 'noreply@onefam.com')
+        self.api_url = api_url or os.environ.get('SENDGRID_API_URL', DEFAULT_API_URL)
+        self.concurrency = concurrency or int(os.environ.get('MAIL_CONCURRENCY', 8))
+        self.batch_size = min(batch_size or int(os.environ.get('MAIL_BATCH_SIZE', 500)), MAX_BATCH_SIZE)
+        self.bucket = TokenBucket(rate or float(os.environ.get('MAIL_RATE_PER_SECOND', 10)))
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.transport = transport
+        self.client = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.api_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(10.0, connect=5.0),
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                transport=self.transport,
+            )
+        return self.client
+
+    def _payload(self, recipients: list, subject: str, html_content: str) -> dict:
+        return {
+            # One personalization per address, so recipients do not see each other
+            "personalizations": [{"to": [{"email": email}]} for email in recipients],
+            "from": {"email": self.sender},
+            "subject": subject,
+            "content": [{"type": "text/html", "value": html_content}],
+        }
+
+    async def send(self, recipients, subject: str, html_content: str) -> list:
+        """Send one message to every recipient; returns one result dict per API call (batch)"""
+        recipients = list(dict.fromkeys(email for email in recipients if email))
+        batches = [recipients[i:i + self.batch_size] for i in range(0, len(recipients), self.batch_size)]
+        if not self.configured:
+            logger.warning("SendGrid API key not configured")
+            results = [
+                {"recipients": batch, "status": SKIPPED, "status_code": None, "message_id": None,
+                 "error": "SendGrid API key not configured", "attempts": 0}
+                for batch in batches
+            ]
+        else:
+            results = list(await asyncio.gather(*(self._send_batch(batch, subject, html_content) for batch in batches)))
+        for result in results:
+            metrics.EMAIL_CALLS.labels(result["status"]).inc()
+            metrics.EMAIL_RECIPIENTS.labels(result["status"]).inc(len(result["recipients"]))
+        return results
+
+    async def _send_batch(self, recipients: list, subject: str, html_content: str) -> dict:
+        payload = self._payload(recipients, subject, html_content)
+        result = {"recipients": recipients, "status": FAILED, "status_code": None, "message_id": None, "error": None, "attempts": 0}
+        async with self.semaphore:
+            for attempt in range(MAX_ATTEMPTS):
+                await self.bucket.acquire()
+                result["attempts"] = attempt + 1
+                try:
+                    response = await self._client().post(SEND_PATH, json=payload)
+                except httpx.HTTPError as e:
+                    result["error"] = str(e) or type(e).__name__
+                    delay = RETRY_BASE_SECONDS * 2 ** attempt
+                else:
+                    result["status_code"] = response.status_code
+                    if response.status_code in (200, 202):
+                        result.update(status=SENT, error=None, message_id=response.headers.get("X-Message-Id"))
+                        return result
+                    result["error"] = response.text[:500]
+                    if response.status_code != 429 and response.status_code < 500:
+                        break
+                    delay = _retry_after(response, attempt)
+                if attempt + 1 < MAX_ATTEMPTS:
+                    await asyncio.sleep(delay)
+        logger.error(f"Failed to send email to {len(recipients)} recipient(s): {result['error']}")
+        return result
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
@@ -0,0 +1,517 @@
+"""Bulk member import from CSV, GEDCOM or NDJSON uploads.
+
+The upload is read as it arrives and parsed one record at a time, so memory
+depends on the batch size and not on the file size:
+
+1. Each CSV row or GEDCOM INDI record becomes a member document. Documents are
+   written in batches with insert_many(ordered=False), so one bad row does not
+   stop the rest. Parent references (CSV father_ref/mother_ref columns, GEDCOM
+   FAM records) are written to import_links as they are read, because the
+   parent may appear later in the file.
+2. Once the file is read, import_links is walked in batches and each reference
+   is resolved to father_id/mother_id with bulk_write.
+
+Member ids are derived from (import id, reference), so a reference resolves
+to its id without keeping a map of the file in memory. A reference that is not
+in the file may be the id of a member the family already has.
+
+CSV columns: ref (defaults to the row number), first_name, last_name, email,
+timezone, address, birthday, anniversary (YYYY-MM-DD), comments, father_ref,
+mother_ref. father_id/mother_id are accepted as aliases of the *_ref columns.
+
+NDJSON is the format of family_export.py (or of the list endpoints'
+?format=ndjson): member lines, plus event lines that restore custom events
+and a family line whose name and timezone are applied to the family imported
+into. Photos and created_at are kept. Any upload may be gzipped.
+"""
+import codecs
+import csv
+import json
+import logging
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import occurrences
+
+logger = logging.getLogger("member_import")
+
+CSV = "csv"
+GEDCOM = "gedcom"
+NDJSON = "ndjson"
+FORMATS = (CSV, GEDCOM, NDJSON)
+GZIP_MAGIC = b"\x1f\x8b"
+
+BATCH_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+# One CSV record or GEDCOM line; anything longer is a broken file, not a family
+MAX_RECORD_BYTES = 64 * 1024
+MAX_RECORD_LINES = 10000
+# NDJSON member lines may carry a photo
+MAX_NDJSON_LINE_BYTES = 32 * 1024 * 1024
+# The report lists this many row errors; error_count has the total
+MAX_REPORTED_ERRORS = 1000
+
+MEMBER_FIELDS = ("first_name", "last_name", "email", "timezone", "address", "birthday", "anniversary", "comments")
+EVENT_FIELDS = ("event_name", "event_date", "created_at")
+FAMILY_FIELDS = ("name", "timezone")
+COLUMN_ALIASES = {"father_id": "father_ref", "mother_id": "mother_ref", "id": "ref"}
+GEDCOM_MONTHS = {name: number for number, name in enumerate(
+    ("JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"), start=1
+)}
+
+
+class InvalidImport(ValueError):
+    """The upload cannot be read any further (no usable header, a runaway line)"""
+
+
+# Parsers yield (kind, row, ref, data) tuples:
+#   MEMBER: data is the member's fields
+#   LINK:   data is {"father": ref, "mother": ref, "anniversary": date}, applied once the whole file is in
+#   EVENT:  data is the custom event's fields, plus the reference of its member as member_ref
+#   ERROR:  data is the message reported against the row
+MEMBER = "member"
+LINK = "link"
+EVENT = "event"
+FAMILY = "family"
+ERROR = "error"
+
+
+def detect_format(content_type: str = None, head: bytes = b"") -> str:
+    """csv, gedcom or ndjson from the Content-Type, else from the first bytes of the upload"""
+    content_type = (content_type or "").lower()
+    if "gedcom" in content_type:
+        return GEDCOM
+    if "csv" in content_type:
+        return CSV
+    if "json" in content_type:
+        return NDJSON
+    head = head.lstrip(b"\xef\xbb\xbf \r\n\t")
+    if head.startswith(b"0 HEAD"):
+        return GEDCOM
+    return NDJSON if head.startswith(b"{") else CSV
+
+
+async def peek(chunks):
+    """(first non-empty chunk, the same chunks including it)"""
+    chunks = chunks.__aiter__()
+    head = b""
+    async for head in chunks:
+        if head:
+            break
+
+    async def rejoined():
+        yield head
+        async for chunk in chunks:
+            yield chunk
+
+    return head, rejoined()
+
+
+async def gunzip(chunks):
+    """Decompressed chunks of a gzipped upload, never more than CHUNK_SIZE at a time"""
+    decompressor = zlib.decompressobj(wbits=31)
+    async for chunk in chunks:
+        try:
+            data = decompressor.decompress(chunk, CHUNK_SIZE)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, CHUNK_SIZE)
+        except zlib.error as e:
+            raise InvalidImport(f"The upload is not valid gzip: {str(e)}")
+
+
+async def open_upload(chunks, content_type: str = None, file_format: str = None):
+    """(format, chunks) for an upload: gunzipped if it is gzip, its format detected unless given"""
+    head, chunks = await peek(chunks)
+    if head.startswith(GZIP_MAGIC):
+        head, chunks = await peek(gunzip(chunks))
+        # The Content-Type of a gzipped upload describes the archive, not its contents
+        content_type = None
+    return file_format or detect_format(content_type, head), chunks
+
+
+def record_id(import_id: str, ref: str) -> str:
+    return str(uuid.uuid5(uuid.UUID(import_id), ref))
+
+
+async def iter_lines(chunks, max_length: int = MAX_RECORD_BYTES):
+    """(line number, text) for each line of an async iterator of byte chunks"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    # The start of a line whose end has not arrived yet, in pieces
+    pending, pending_length = [], 0
+    number = 0
+    async for chunk in chunks:
+        # Split on \n only: \r\n may straddle two chunks, and quoted CSV fields may hold other line breaks
+        *lines, rest = decoder.decode(chunk).split("\n")
+        if lines:
+            lines[0] = "".join(pending) + lines[0]
+            pending, pending_length = [], 0
+        for line in lines:
+            number += 1
+            yield number, line + "\n"
+        pending.append(rest)
+        pending_length += len(rest)
+        if pending_length > max_length:
+            raise InvalidImport(f"Line {number + 1} is longer than {max_length} characters")
+    pending.append(decoder.decode(b"", final=True))
+    if any(pending):
+        yield number + 1, "".join(pending)
+
+
+# ============= CSV =============
+
+async def parse_csv(chunks):
+    """MEMBER (and LINK when it has parents) per data row; raises InvalidImport without a usable header"""
+    header = None
+    record, start = "", None
+    async for number, line in iter_lines(chunks):
+        record += line
+        start = start or number
+        # A quoted field may span lines; the record is complete once its quotes are balanced
+        if record.count('"') % 2:
+            if len(record) > MAX_RECORD_BYTES:
+                raise InvalidImport(f"Row {start} has an unterminated quoted field")
+            continue
+        values, row = next(csv.reader([record]), []), start
+        record, start = "", None
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [COLUMN_ALIASES.get(name, name) for name in (value.strip().lower() for value in values)]
+            if "first_name" not in header or "last_name" not in header:
+                raise InvalidImport("The CSV header must have first_name and last_name columns")
+            continue
+        fields = {name: value.strip() for name, value in zip(header, values) if value.strip()}
+        ref = fields.pop("ref", None) or str(row)
+        if len(values) > len(header):
+            yield ERROR, row, ref, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield MEMBER, row, ref, {name: fields[name] for name in MEMBER_FIELDS if name in fields}
+        if fields.get("father_ref") or fields.get("mother_ref"):
+            yield LINK, row, ref, {"father": fields.get("father_ref"), "mother": fields.get("mother_ref")}
+    if record:
+        yield ERROR, start, str(start), "Unterminated quoted field at the end of the file"
+
+
+# ============= GEDCOM =============
+
+def gedcom_date(value: str) -> str:
+    """YYYY-MM-DD for a full GEDCOM date such as "12 MAR 1950"; raises ValueError for partial or approximate ones"""
+    parts = value.upper().split()
+    try:
+        if len(parts) == 3 and parts[1] in GEDCOM_MONTHS:
+            return datetime(int(parts[2]), GEDCOM_MONTHS[parts[1]], int(parts[0])).strftime("%Y-%m-%d")
+    except ValueError:
+        pass
+    raise ValueError(f"Date '{value}' is not a full day/month/year date and was left out")
+
+
+def gedcom_name(value: str):
+    """("John", "Smith") for "John /Smith/" """
+    given, _, rest = value.partition("/")
+    return given.strip(), rest.partition("/")[0].strip()
+
+
+async def gedcom_records(chunks):
+    """(line number, [(level, xref, tag, value), ...]) per level-0 record"""
+    record, start = [], None
+    async for number, line in iter_lines(chunks):
+        level, _, rest = line.strip().partition(" ")
+        if not level.isdigit():
+            continue
+        xref = None
+        if rest.startswith("@"):
+            xref, _, rest = rest.partition(" ")
+        tag, _, value = rest.partition(" ")
+        if level == "0":
+            if record:
+                yield start, record
+            record, start = [], number
+        elif len(record) >= MAX_RECORD_LINES:
+            raise InvalidImport(f"The record at line {start} has more than {MAX_RECORD_LINES} lines")
+        record.append((int(level), xref, tag.upper(), value.strip()))
+    if record:
+        yield start, record
+
+
+def gedcom_events(record):
+    """(level, event, tag, value) for each line below the record, event being the level-1 tag it sits under"""
+    event = None
+    for level, _, tag, value in record[1:]:
+        if level == 1:
+            event = tag
+        yield level, event, tag, value
+
+
+async def parse_gedcom(chunks):
+    """MEMBER per INDI record; LINK per FAM child (to HUSB and WIFE) and per spouse (the MARR date)"""
+    async for row, record in gedcom_records(chunks):
+        _, xref, record_type, _ = record[0]
+        if record_type == "INDI" and xref:
+            fields, notes, addresses = {}, [], []
+            # The NOTE or ADDR value that CONT/CONC lines right after it continue
+            continued = None
+            for level, event, tag, value in gedcom_events(record):
+                if tag in ("CONT", "CONC"):
+                    if continued:
+                        continued[-1] += ("\n" if tag == "CONT" else "") + value
+                    continue
+                continued = None
+                if level == 1 and tag == "NAME" and "first_name" not in fields:
+                    fields["first_name"], fields["last_name"] = gedcom_name(value)
+                elif level == 2 and event == "NAME" and tag in ("GIVN", "SURN") and value:
+                    fields["first_name" if tag == "GIVN" else "last_name"] = value
+                elif level == 2 and event == "BIRT" and tag == "DATE":
+                    try:
+                        fields["birthday"] = gedcom_date(value)
+                    except ValueError as e:
+                        yield ERROR, row, xref, str(e)
+                elif tag == "EMAIL" and value:
+                    fields.setdefault("email", value)
+                elif tag == "ADDR" and not addresses:
+                    addresses.append(value)
+                    continued = addresses
+                elif level == 1 and tag == "NOTE" and not value.startswith("@"):
+                    notes.append(value)
+                    continued = notes
+            if addresses and addresses[0]:
+                fields["address"] = addresses[0]
+            if notes:
+                fields["comments"] = "\n".join(notes)
+            yield MEMBER, row, xref, fields
+        elif record_type == "FAM":
+            spouses = {tag: value for level, _, tag, value in record if level == 1 and tag in ("HUSB", "WIFE") and value}
+            marriage = next((value for level, event, tag, value in gedcom_events(record) if level == 2 and event == "MARR" and tag == "DATE"), None)
+            for level, _, tag, value in record:
+                if level == 1 and tag == "CHIL" and value:
+                    yield LINK, row, value, {"father": spouses.get("HUSB"), "mother": spouses.get("WIFE")}
+            if marriage:
+                try:
+                    anniversary = gedcom_date(marriage)
+                except ValueError as e:
+                    yield ERROR, row, xref, str(e)
+                    continue
+                for spouse in spouses.values():
+                    yield LINK, row, spouse, {"anniversary": anniversary}
+
+
+# ============= NDJSON =============
+
+async def parse_ndjson(chunks):
+    """MEMBER (and LINK) per member line, EVENT per event line, FAMILY for the family line; lines without a type are members"""
+    async for row, line in iter_lines(chunks, MAX_NDJSON_LINE_BYTES):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            yield ERROR, row, str(row), "Not a JSON object"
+            continue
+        record_type = record.get("type", MEMBER)
+        ref = str(record.get("id") or row)
+        if record_type == MEMBER:
+            yield MEMBER, row, ref, {
+                name: record[name] for name in (*MEMBER_FIELDS, "photo_base64", "created_at") if record.get(name) is not None
+            }
+            if record.get("father_id") or record.get("mother_id"):
+                yield LINK, row, ref, {"father": record.get("father_id"), "mother": record.get("mother_id")}
+        elif record_type == EVENT:
+            yield EVENT, row, ref, {
+                **{name: record[name] for name in EVENT_FIELDS if record.get(name) is not None},
+                "member_ref": record.get("member_id"),
+            }
+        elif record_type == FAMILY:
+            yield FAMILY, row, ref, {name: record[name] for name in FAMILY_FIELDS if name in record}
+        else:
+            yield ERROR, row, ref, f"Unknown record type '{record_type}'"
+
+
+PARSERS = {CSV: parse_csv, GEDCOM: parse_gedcom, NDJSON: parse_ndjson}
+
+
+# ============= WRITING =============
+
+class Report:
+    """Counts and row errors for one import; the errors list is capped at MAX_REPORTED_ERRORS"""
+
+    def __init__(self, import_id: str, file_format: str):
+        self.import_id = import_id
+        self.format = file_format
+        self.rows = 0
+        self.imported = 0
+        self.events = 0
+        self.events_imported = 0
+        self.parents_linked = 0
+        self.family_updated = False
+        self.error_count = 0
+        self.errors = []
+        self.stopped = None
+
+    def error(self, row, ref, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "ref": ref, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "import_id": self.import_id,
+            "format": self.format,
+            "rows": self.rows,
+            "imported": self.imported,
+            "failed": self.rows - self.imported,
+            "parents_linked": self.parents_linked,
+            "events": self.events,
+            "events_imported": self.events_imported,
+            "family_updated": self.family_updated,
+            "stopped": self.stopped,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "errors_truncated": self.error_count > len(self.errors),
+        }
+
+
+async def _insert(collection, batch: list, report: Report) -> int:
+    """insert_many(ordered=False) a batch of (row, ref, doc); documents that fail are reported against their rows.
+    Returns the number inserted."""
+    if not batch:
+        return 0
+    try:
+        result = await collection.insert_many([doc for _, _, doc in batch], ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        for error in errors:
+            row, ref, _ = batch[error["index"]]
+            report.error(row, ref, "Duplicate reference in the file" if error.get("code") == 11000 else error.get("errmsg", "Insert failed"))
+        return e.details.get("nInserted", len(batch) - len(errors))
+
+
+async def _existing_members(db, family_id: str, import_id: str, refs) -> dict:
+    """{ref: member id} for the refs that name a member of this import, or else one the family already has"""
+    candidates = {ref: (record_id(import_id, ref), ref) for ref in refs if ref}
+    wanted = [candidate for pair in candidates.values() for candidate in pair]
+    cursor = db.family_members.find({"family_id": family_id, "id": {"$in": wanted}}, {"_id": 0, "id": 1})
+    existing = {member["id"] async for member in cursor}
+    return {ref: next(candidate for candidate in pair if candidate in existing) for ref, pair in candidates.items() if existing.intersection(pair)}
+
+
+async def _insert_events(db, family_id: str, import_id: str, batch: list, report: Report):
+    """Insert a batch of (row, ref, doc, member ref), pointing each event at its member's new id"""
+    members = await _existing_members(db, family_id, import_id, {member_ref for *_, member_ref in batch})
+    docs = []
+    for row, ref, doc, member_ref in batch:
+        if member_ref and member_ref not in members:
+            report.error(row, ref, f"Unknown member reference '{member_ref}'; the event was imported without it")
+        docs.append((row, ref, {**doc, "member_id": members.get(member_ref)}))
+    report.events_imported += await _insert(db.custom_events, docs, report)
+
+
+async def _resolve_links(db, family_id: str, import_id: str, links: list, report: Report):
+    """Set father_id/mother_id/anniversary for one batch of links in one bulk_write"""
+    members = await _existing_members(db, family_id, import_id, {ref for link in links for ref in (link["ref"], link.get("father"), link.get("mother"))})
+    ops = []
+    for link in links:
+        target = record_id(import_id, link["ref"])
+        if members.get(link["ref"]) != target:
+            # Either the member's own row failed (already reported) or the link names a reference not in the file
+            report.error(link["row"], link["ref"], f"Reference '{link['ref']}' is not a member of this import")
+            continue
+        update = {}
+        if link.get("anniversary"):
+            # With its date parts, which the calendar and alert queries read
+            update["anniversary"] = link["anniversary"]
+            update.update(occurrences.date_parts(update)[0])
+        for field, ref in (("father_id", link.get("father")), ("mother_id", link.get("mother"))):
+            if not ref:
+                continue
+            parent = members.get(ref)
+            if parent is None:
+                report.error(link["row"], link["ref"], f"Unknown {field[:-3]} reference '{ref}'")
+            elif parent == target:
+                report.error(link["row"], link["ref"], f"A member cannot be their own {field[:-3]}")
+            else:
+                update[field] = parent
+                report.parents_linked += 1
+        if update:
+            ops.append(UpdateOne({"family_id": family_id, "id": target}, {"$set": update}))
+    if ops:
+        await db.family_members.bulk_write(ops, ordered=False)
+
+
+async def import_members(db, family_id: str, chunks, file_format: str, make_member, make_event=None, apply_family=None,
+                         batch_size: int = BATCH_SIZE) -> dict:
+    """Import members (and NDJSON events) from an async iterator of byte chunks and return the report.
+
+    make_member(id, fields) and make_event(id, fields) are coroutines that validate a row into a
+    document, raising ValueError if it is invalid. apply_family(fields) is a coroutine that writes
+    the NDJSON family line's fields to the family, raising ValueError if they are invalid.
+    """
+    import_id = str(uuid.uuid4())
+    report = Report(import_id, file_format)
+    created_at = datetime.now(timezone.utc)
+    docs, events, links = [], [], []
+    try:
+        try:
+            async for kind, row, ref, data in PARSERS[file_format](chunks):
+                if kind == MEMBER:
+                    report.rows += 1
+                    try:
+                        docs.append((row, ref, await make_member(record_id(import_id, ref), data)))
+                    except ValueError as e:
+                        report.error(row, ref, str(e))
+                elif kind == EVENT and make_event is not None:
+                    report.events += 1
+                    member_ref = data.pop("member_ref", None)
+                    try:
+                        events.append((row, ref, await make_event(record_id(import_id, ref), data), member_ref))
+                    except ValueError as e:
+                        report.error(row, ref, str(e))
+                elif kind == FAMILY and apply_family is not None:
+                    try:
+                        await apply_family(data)
+                        report.family_updated = True
+                    except ValueError as e:
+                        report.error(row, ref, str(e))
+                elif kind == LINK:
+                    links.append({"import_id": import_id, "row": row, "ref": ref, **data, "created_at": created_at})
+                elif kind == ERROR:
+                    report.error(row, ref, data)
+                if len(docs) >= batch_size:
+                    report.imported += await _insert(db.family_members, docs, report)
+                    docs = []
+                if len(events) >= batch_size:
+                    # Members read so far go in first, so the events can find theirs
+                    report.imported += await _insert(db.family_members, docs, report)
+                    docs = []
+                    await _insert_events(db, family_id, import_id, events, report)
+                    events = []
+                if len(links) >= batch_size:
+                    await db.import_links.insert_many(links, ordered=False)
+                    links = []
+        except InvalidImport as e:
+            # Rows read before the problem are still imported and linked
+            report.stopped = str(e)
+        report.imported += await _insert(db.family_members, docs, report)
+        if events:
+            await _insert_events(db, family_id, import_id, events, report)
+        if links:
+            await db.import_links.insert_many(links, ordered=False)
+
+        batch = []
+        async for link in db.import_links.find({"import_id": import_id}, {"_id": 0}).sort("row", 1).batch_size(batch_size):
+            batch.append(link)
+            if len(batch) >= batch_size:
+                await _resolve_links(db, family_id, import_id, batch, report)
+                batch = []
+        if batch:
+            await _resolve_links(db, family_id, import_id, batch, report)
+    finally:
+        await db.import_links.delete_many({"import_id": import_id})
+    logger.info(f"Import {import_id} into {family_id}: {report.imported} of {report.rows} member(s), {report.error_count} error(s)")
+    return report.as_dict()
@@ -0,0 +1,222 @@
+"""Prometheus metrics for the API and the worker.
+
+The API serves them at GET /metrics and the worker at METRICS_PORT. Each
+process exports only its own counters, so Prometheus should scrape every API
+and worker process and sum across them.
+
+- HTTP: requests and latency per route template (/api/families/{family_id},
+  not the raw path) and status, plus requests in flight per route.
+- Handler phases: time spent in db, compute, serialize and cache steps inside
+  a handler. Code marks a step with `with metrics.phase("db"):` and it is
+  recorded under the route that is running.
+- MongoDB: count, failures and duration of every command, per command and
+  collection, from a PyMongo command listener on the shared client.
+- Jobs: queued/running/done/dead jobs per kind, ready jobs and lag (read from
+  the jobs collection when /metrics is scraped), and finished jobs per kind
+  and outcome in the worker.
+- Email: SendGrid API calls and recipients per outcome.
+- Response cache, verified-token cache and admission control: their stats
+  counters, read at scrape time.
+"""
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from fastapi.routing import APIRoute
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pymongo import monitoring
+
+import profiling
+
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+UNMATCHED = "unmatched"
+# Seconds; from a cache hit to a large export
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUESTS = Counter("onefam_http_requests", "HTTP requests by route and status", ["method", "route", "status"])
+REQUEST_SECONDS = Histogram(
+    "onefam_http_request_duration_seconds", "Time to answer an HTTP request, until the last body byte is sent",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge("onefam_http_requests_in_flight", "HTTP requests being handled", ["method", "route"])
+PHASE_SECONDS = Histogram(
+    "onefam_handler_phase_duration_seconds", "Time spent in one phase of a request handler",
+    ["route", "phase"], buckets=LATENCY_BUCKETS,
+)
+MONGO_COMMANDS = Counter("onefam_mongo_commands", "MongoDB commands by outcome", ["command", "collection", "outcome"])
+MONGO_SECONDS = Histogram(
+    "onefam_mongo_command_duration_seconds", "MongoDB command round trip time",
+    ["command", "collection"], buckets=LATENCY_BUCKETS,
+)
+EMAIL_CALLS = Counter("onefam_email_api_calls", "SendGrid API calls (batches) by outcome", ["status"])
+EMAIL_RECIPIENTS = Counter("onefam_email_recipients", "Email recipients by outcome", ["status"])
+JOBS_FINISHED = Counter("onefam_jobs_finished", "Job attempts finished by this worker, by outcome", ["kind", "status"])
+JOB_SECONDS = Histogram("onefam_job_duration_seconds", "Time to run one job attempt", ["kind"], buckets=LATENCY_BUCKETS)
+JOBS = Gauge("onefam_jobs", "Jobs in the queue by kind and status", ["kind", "status"])
+JOBS_READY = Gauge("onefam_jobs_ready", "Queued jobs whose run_at has passed")
+JOBS_LAG = Gauge("onefam_jobs_lag_seconds", "How long the oldest ready job has been waiting")
+
+_route = contextvars.ContextVar("metrics_route", default="")
+
+
+# ============= HTTP =============
+
+class InstrumentedRoute(APIRoute):
+    """Counts the route's requests in flight and makes its path the route label of phase()"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def instrumented(request):
+            in_flight = IN_FLIGHT.labels(request.method, self.path)
+            in_flight.inc()
+            token = _route.set(self.path)
+            try:
+                return await handler(request)
+            finally:
+                _route.reset(token)
+                in_flight.dec()
+
+        return instrumented
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the count and latency of every HTTP request, labelled with its route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = scope.get("route")
+            path = getattr(route, "path", None) or UNMATCHED
+            REQUESTS.labels(scope["method"], path, str(status)).inc()
+            REQUEST_SECONDS.labels(scope["method"], path).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def phase(name: str):
+    """Time a step of the running request handler: db, compute, serialize or cache"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PHASE_SECONDS.labels(_route.get(), name).observe(elapsed)
+        trace = profiling.current_trace()
+        if trace is not None:
+            trace.phase(name, elapsed)
+
+
+# ============= MONGODB =============
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts and times every command the client sends, and adds it to the running request's trace;
+    pass it in the client's event_listeners"""
+
+    def __init__(self):
+        # Only the started event carries the command document, so its collection is kept until the reply
+        self.collections = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            # getMore names its collection separately; hello, ping and the like have none
+            target = event.command.get("collection", "")
+        self.collections[(event.connection_id, event.request_id)] = target
+
+    def succeeded(self, event):
+        self._record(event, "ok", profiling.reply_documents(event.reply))
+
+    def failed(self, event):
+        self._record(event, "failed")
+
+    def _record(self, event, outcome: str, documents=None):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMANDS.labels(event.command_name, collection, outcome).inc()
+        MONGO_SECONDS.labels(event.command_name, collection).observe(seconds)
+        # Motor runs commands with a copy of the caller's context, so this is the request that issued it
+        trace = profiling.current_trace()
+        if trace is not None:
+            trace.command(event.command_name, collection, seconds, documents, outcome == "ok")
+
+
+# ============= JOBS =============
+
+def set_job_gauges(depth: dict):
+    """Set the job queue gauges from jobs.queue_depth(), which the API reads on every scrape"""
+    JOBS.clear()
+    for (kind, status), count in depth["counts"].items():
+        JOBS.labels(kind, status).set(count)
+    JOBS_READY.set(depth["ready"])
+    JOBS_LAG.set(depth["lag_seconds"])
+
+
+def job_finished(kind: str, status: str, seconds: float):
+    JOBS_FINISHED.labels(kind, status).inc()
+    JOB_SECONDS.labels(kind).observe(seconds)
+
+
+# ============= STATS COLLECTORS =============
+
+class StatsCollector:
+    """Exports the stats counters the API's caches and admission control keep, read at scrape time"""
+
+    def __init__(self, response_cache, token_verifier, rate_limiter, request_gate):
+        self.response_cache = response_cache
+        self.token_verifier = token_verifier
+        self.rate_limiter = rate_limiter
+        self.request_gate = request_gate
+
+    def describe(self):
+        # Nothing to check up front; collect() only reads dicts
+        return []
+
+    def collect(self):
+        cache = CounterMetricFamily("onefam_response_cache", "Response cache lookups and writes by result", labels=["result"])
+        for result, count in self.response_cache.stats.items():
+            cache.add_metric([result], count)
+        yield cache
+
+        tokens = CounterMetricFamily("onefam_token_verifications", "Access token verifications by result", labels=["result"])
+        for result, count in self.token_verifier.stats.items():
+            tokens.add_metric([result], count)
+        yield tokens
+        yield GaugeMetricFamily("onefam_token_cache_entries", "Verified tokens cached", value=len(self.token_verifier.entries))
+
+        limited = CounterMetricFamily("onefam_rate_limited", "Requests answered 429, by rate limit rule", labels=["rule"])
+        for rule, count in self.rate_limiter.stats["limited"].items():
+            limited.add_metric([rule], count)
+        yield limited
+        yield CounterMetricFamily("onefam_rate_limit_errors", "Rate limit store failures (requests let through)", value=self.rate_limiter.stats["errors"])
+
+        gate = self.request_gate
+        rejected = CounterMetricFamily("onefam_admission_rejected", "Requests answered 503 by the concurrency gate", labels=["reason"])
+        rejected.add_metric(["queue_full"], gate.stats["queue_full"])
+        rejected.add_metric(["queue_timeout"], gate.stats["queue_timeouts"])
+        yield rejected
+        yield CounterMetricFamily("onefam_admission_admitted", "Requests let through the concurrency gate", value=gate.stats["admitted"])
+        yield GaugeMetricFamily("onefam_admission_in_flight", "Requests holding a concurrency slot", value=gate.in_flight)
+        yield GaugeMetricFamily("onefam_admission_queued", "Requests waiting for a concurrency slot", value=gate.queued)
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
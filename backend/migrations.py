@@ -0,0 +1,169 @@
+"""One-time data migrations.
+
+Run from the backend directory, e.g.:
+
+    python migrations.py photos
+"""
+import asyncio
+import logging
+import sys
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+import occurrences
+from photo_store import InvalidPhoto, shutdown_executor
+from server import db, photo_store, client
+
+logger = logging.getLogger("migrations")
+
+
+async def migrate_inline_photos(batch_size: int = 100):
+    """Move inline photo_base64 values out of family_members into the photo store"""
+    moved = 0
+    failed = []
+    query = {"photo_base64": {"$exists": True}}
+    # Only the ids are read up front so the cursor never holds photos in memory
+    cursor = db.family_members.find(query, {"_id": 0, "id": 1}, batch_size=batch_size)
+    async for ref in cursor:
+        member = await db.family_members.find_one({"id": ref["id"]}, {"_id": 0, "id": 1, "family_id": 1, "photo_base64": 1})
+        if not member:
+            continue
+        update = {"$unset": {"photo_base64": ""}}
+        if member.get("photo_base64"):
+            try:
+                fields = await photo_store.save_base64(member["id"], member["family_id"], member["photo_base64"])
+            except InvalidPhoto as e:
+                failed.append({"id": member["id"], "error": str(e)})
+                continue
+            update["$set"] = fields
+        await db.family_members.update_one({"id": member["id"]}, update)
+        moved += 1
+    logger.info(f"Moved {moved} inline photo(s) to the photo store, {len(failed)} failed")
+    for failure in failed:
+        logger.warning(f"Member {failure['id']}: {failure['error']}")
+    return {"moved": moved, "failed": failed}
+
+
+async def render_missing_thumbnails():
+    """Render thumbnails for photos that were stored before the thumbnail pipeline existed"""
+    rendered = 0
+    failed = []
+    query = {"photo_hash": {"$ne": None}, "photo_sizes": {"$in": [None, []]}}
+    cursor = db.family_members.find(query, {"_id": 0, "id": 1, "family_id": 1})
+    async for member in cursor:
+        original = await photo_store.read(member["id"])
+        if original is None:
+            continue
+        try:
+            fields = await photo_store.save(member["id"], member["family_id"], original[0])
+        except InvalidPhoto as e:
+            # Stored before uploads were checked; left as it is
+            failed.append({"id": member["id"], "error": str(e)})
+            continue
+        await db.family_members.update_one({"id": member["id"]}, {"$set": fields})
+        rendered += 1
+    logger.info(f"Rendered thumbnails for {rendered} photo(s), {len(failed)} failed")
+    for failure in failed:
+        logger.warning(f"Member {failure['id']}: {failure['error']}")
+    return {"rendered": rendered, "failed": failed}
+
+
+async def rebuild_occurrences():
+    """Build the occurrences index from existing members and custom events"""
+    count = await occurrences.rebuild(db)
+    logger.info(f"Indexed {count} occurrence(s)")
+    return {"indexed": count}
+
+
+async def convert_created_at(batch_size: int = 1000):
+    """Store created_at as a BSON date where older documents hold an ISO string"""
+    converted = 0
+    invalid = []
+    for collection in (db.families, db.family_members, db.custom_events):
+        writes = []
+        cursor = collection.find({"created_at": {"$type": "string"}}, {"_id": 1, "id": 1, "created_at": 1}, batch_size=batch_size)
+        async for doc in cursor:
+            try:
+                created_at = datetime.fromisoformat(doc["created_at"])
+            except ValueError:
+                invalid.append({"collection": collection.name, "id": doc.get("id"), "created_at": doc["created_at"]})
+                continue
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            writes.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"created_at": created_at}}))
+            if len(writes) >= batch_size:
+                converted += (await collection.bulk_write(writes, ordered=False)).modified_count
+                writes = []
+        if writes:
+            converted += (await collection.bulk_write(writes, ordered=False)).modified_count
+    logger.info(f"Converted {converted} created_at value(s) to dates, {len(invalid)} could not be parsed")
+    for failure in invalid:
+        logger.warning(f"{failure['collection']} {failure['id']}: created_at {failure['created_at']!r}")
+    return {"converted": converted, "invalid": invalid}
+
+
+async def structure_dates(batch_size: int = 1000):
+    """Store the date parts of birthday, anniversary and event_date, and report values that are not YYYY-MM-DD dates.
+
+    Occurrences are rebuilt afterwards if any document changed.
+    """
+    updated = 0
+    invalid = []
+    for collection, fields in ((db.family_members, (occurrences.BIRTHDAY, occurrences.ANNIVERSARY)), (db.custom_events, ("event_date",))):
+        writes = []
+        query = {"$or": [{field: {"$nin": [None, ""]}} for field in fields]}
+        cursor = collection.find(query, {"_id": 1, "id": 1, **dict.fromkeys(fields, 1)}, batch_size=batch_size)
+        async for doc in cursor:
+            values = {}
+            for field in fields:
+                try:
+                    values[field] = occurrences.validate_date(doc.get(field))
+                except ValueError:
+                    invalid.append({"collection": collection.name, "id": doc.get("id"), "field": field, "value": doc[field]})
+            # Dates are rewritten in their canonical form (1990-5-7 becomes 1990-05-07)
+            changes = {field: value for field, value in values.items() if value}
+            changes.update(occurrences.date_parts(changes)[0])
+            if changes:
+                writes.append(UpdateOne({"_id": doc["_id"]}, {"$set": changes}))
+            if len(writes) >= batch_size:
+                updated += (await collection.bulk_write(writes, ordered=False)).modified_count
+                writes = []
+        if writes:
+            updated += (await collection.bulk_write(writes, ordered=False)).modified_count
+    logger.info(f"Stored date parts on {updated} document(s), {len(invalid)} invalid date(s) left as they are")
+    for failure in invalid:
+        logger.warning(f"{failure['collection']} {failure['id']}: {failure['field']} {failure['value']!r} is not a YYYY-MM-DD date")
+    indexed = 0
+    if updated:
+        # Occurrence rows copy the date values, which may have just been rewritten in their canonical form
+        indexed = await occurrences.rebuild(db)
+        logger.info(f"Indexed {indexed} occurrence(s)")
+    return {"updated": updated, "invalid": invalid, "indexed": indexed}
+
+
+MIGRATIONS = {
+    "photos": migrate_inline_photos,
+    "thumbnails": render_missing_thumbnails,
+    "occurrences": rebuild_occurrences,
+    "created_at": convert_created_at,
+    "dates": structure_dates,
+}
+
+
+async def main(names):
+    try:
+        for name in names:
+            await MIGRATIONS[name]()
+    finally:
+        client.close()
+        shutdown_executor()
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:]
+    unknown = [name for name in names if name not in MIGRATIONS]
+    if not names or unknown:
+        print(f"usage: python migrations.py {{{'|'.join(MIGRATIONS)}}} ...")
+        sys.exit(2)
+    asyncio.run(main(names))
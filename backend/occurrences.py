@@ -0,0 +1,243 @@
+"""Normalized index of dated things (birthdays, anniversaries, custom events).
+
+One row per (family_id, kind, source_id) with the date split into month/day/year,
+kept in sync by the member and event write handlers. Alert, calendar and reminder
+lookups are range queries on (month, day) instead of scans over every member.
+"""
+import calendar
+from datetime import date, datetime, timedelta, timezone
+
+from pymongo import DeleteOne, ReplaceOne
+
+BIRTHDAY = "birthday"
+ANNIVERSARY = "anniversary"
+CUSTOM = "custom"
+# Birthdays and anniversaries repeat every year; custom events happen once
+RECURRING_KINDS = (BIRTHDAY, ANNIVERSARY)
+
+# YYYY-MM-DD fields of members and events. Next to each, documents store the date as
+# <prefix>_on (a BSON date at midnight UTC), <prefix>_month and <prefix>_day, so list
+# queries can filter on them
+DATE_FIELDS = {BIRTHDAY: BIRTHDAY, ANNIVERSARY: ANNIVERSARY, "event_date": "event"}
+DATE_PARTS = ("on", "month", "day")
+
+PROJECTION = {"_id": 0}
+# The member fields occurrence rows are built from
+MEMBER_FIELDS = {"_id": 0, "id": 1, "family_id": 1, "first_name": 1, "last_name": 1, BIRTHDAY: 1, ANNIVERSARY: 1}
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def validate_date(value):
+    """value as YYYY-MM-DD if it is a date, None for empty; raises ValueError otherwise"""
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(f"'{value}' is not a YYYY-MM-DD date")
+    return day.isoformat()
+
+
+def part_fields(field: str) -> list:
+    return [f"{DATE_FIELDS[field]}_{part}" for part in DATE_PARTS]
+
+
+# Every stored date part; not part of any API model
+PART_FIELDS = tuple(name for field in DATE_FIELDS for name in part_fields(field))
+
+
+def date_parts(data: dict):
+    """For the date fields present in data: the date parts to set, and the ones to unset for dates that are empty"""
+    parts, cleared = {}, []
+    for field, prefix in DATE_FIELDS.items():
+        if field not in data:
+            continue
+        day = parse_date(data[field])
+        if day:
+            parts[f"{prefix}_on"] = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+            parts[f"{prefix}_month"] = day.month
+            parts[f"{prefix}_day"] = day.day
+        else:
+            cleared.extend(part_fields(field))
+    return parts, cleared
+
+
+def member_name(member: dict) -> str:
+    return f"{member.get('first_name', '')} {member.get('last_name', '')}"
+
+
+def _row(family_id, kind, source_id, day: date, value: str, title: str, **extra) -> dict:
+    return {
+        "family_id": family_id,
+        "kind": kind,
+        "source_id": source_id,
+        "month": day.month,
+        "day": day.day,
+        "year": day.year,
+        "date": value,
+        "title": title,
+        **extra,
+    }
+
+
+def member_rows(member: dict) -> dict:
+    """Occurrence rows for a member keyed by kind; None for kinds the member has no valid date for"""
+    name = member_name(member)
+    rows = {}
+    for kind, label in ((BIRTHDAY, "Birthday"), (ANNIVERSARY, "Anniversary")):
+        value = member.get(kind)
+        day = parse_date(value)
+        rows[kind] = day and _row(
+            member["family_id"], kind, member["id"], day, value, f"{name}'s {label}",
+            member_id=member["id"], member_name=name,
+        )
+    return rows
+
+
+def event_row(event: dict):
+    day = parse_date(event.get("event_date"))
+    return day and _row(
+        event["family_id"], CUSTOM, event["id"], day, event["event_date"], event["event_name"],
+        member_id=event.get("member_id"),
+    )
+
+
+def _key(family_id, kind, source_id) -> dict:
+    return {"family_id": family_id, "kind": kind, "source_id": source_id}
+
+
+def _member_ops(member: dict) -> list:
+    ops = []
+    for kind, row in member_rows(member).items():
+        key = _key(member["family_id"], kind, member["id"])
+        ops.append(ReplaceOne(key, row, upsert=True) if row else DeleteOne(key))
+    return ops
+
+
+def _event_op(event: dict):
+    key = _key(event["family_id"], CUSTOM, event["id"])
+    row = event_row(event)
+    return ReplaceOne(key, row, upsert=True) if row else DeleteOne(key)
+
+
+async def sync_member(db, member: dict):
+    """Upsert or remove the member's birthday/anniversary rows in one round trip"""
+    await db.occurrences.bulk_write(_member_ops(member), ordered=False)
+
+
+async def sync_event(db, event: dict):
+    key = _key(event["family_id"], CUSTOM, event["id"])
+    row = event_row(event)
+    if row:
+        await db.occurrences.replace_one(key, row, upsert=True)
+    else:
+        await db.occurrences.delete_one(key)
+
+
+async def sync_many(db, members=(), events=()):
+    """sync_member and sync_event for many documents in one round trip"""
+    ops = [op for member in members for op in _member_ops(member)]
+    ops.extend(_event_op(event) for event in events)
+    if ops:
+        await db.occurrences.bulk_write(ops, ordered=False)
+
+
+async def remove_source(db, family_id: str, source_id: str):
+    await db.occurrences.delete_many({"family_id": family_id, "source_id": source_id})
+
+
+async def remove_sources(db, family_id: str, source_ids):
+    await db.occurrences.delete_many({"family_id": family_id, "source_id": {"$in": list(source_ids)}})
+
+
+async def remove_family(db, family_id: str):
+    await db.occurrences.delete_many({"family_id": family_id})
+
+
+async def rebuild(db, family_id: str = None) -> int:
+    """Recreate rows from family_members and custom_events (all families, or one)"""
+    query = {"family_id": family_id} if family_id else {}
+    await db.occurrences.delete_many(query)
+    count = 0
+    batch = []
+    async for member in db.family_members.find(query, MEMBER_FIELDS):
+        batch.extend(row for row in member_rows(member).values() if row)
+        if len(batch) >= 1000:
+            await db.occurrences.insert_many(batch, ordered=False)
+            count += len(batch)
+            batch = []
+    async for event in db.custom_events.find(query, {"_id": 0}):
+        row = event_row(event)
+        if row:
+            batch.append(row)
+        if len(batch) >= 1000:
+            await db.occurrences.insert_many(batch, ordered=False)
+            count += len(batch)
+            batch = []
+    if batch:
+        await db.occurrences.insert_many(batch, ordered=False)
+        count += len(batch)
+    return count
+
+
+# ============= DATE WINDOWS =============
+
+def window_filter(start: date, days: int) -> dict:
+    """Mongo filter matching every month/day from start through start + days.
+
+    The window may wrap into the next year. Feb 29 rows match Feb 28 in
+    non-leap years, which is when those birthdays are celebrated.
+    """
+    end = start + timedelta(days=days)
+    clauses = []
+    current = start
+    while current <= end:
+        last_of_month = date(current.year, current.month, calendar.monthrange(current.year, current.month)[1])
+        last = min(end, last_of_month)
+        last_day = last.day
+        if current.month == 2 and last_day == 28 and not calendar.isleap(current.year):
+            last_day = 29
+        if current.day == 1 and last == last_of_month:
+            clauses.append({"month": current.month})
+        else:
+            clauses.append({"month": current.month, "day": {"$gte": current.day, "$lte": last_day}})
+        current = last + timedelta(days=1)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def anniversary_in_year(row: dict, year: int) -> date:
+    month, day = row["month"], row["day"]
+    if month == 2 and day == 29 and not calendar.isleap(year):
+        day = 28
+    return date(year, month, day)
+
+
+def next_occurrence(row: dict, start: date):
+    """The first date on or after start that the row happens on, or None for past one-off events"""
+    if row["kind"] not in RECURRING_KINDS:
+        occurrence = date(row["year"], row["month"], row["day"])
+        return occurrence if occurrence >= start else None
+    occurrence = anniversary_in_year(row, start.year)
+    if occurrence < start:
+        occurrence = anniversary_in_year(row, start.year + 1)
+    return occurrence
+
+
+async def upcoming(db, family_id: str, start: date, days: int):
+    """(row, occurrence date) pairs within [start, start + days], sorted by date"""
+    query = {"family_id": family_id, **window_filter(start, days)}
+    end = start + timedelta(days=days)
+    matches = []
+    async for row in db.occurrences.find(query, PROJECTION):
+        occurrence = next_occurrence(row, start)
+        if occurrence is not None and occurrence <= end:
+            matches.append((row, occurrence))
+    matches.sort(key=lambda match: match[1])
+    return matches
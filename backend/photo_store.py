@@ -0,0 +1,263 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+DATA_URL_RE = re.compile(r'^data:(?P<content_type>[\w/+.-]+)?(;[\w=-]+)*;base64,', re.IGNORECASE)
+DEFAULT_CONTENT_TYPE = "image/jpeg"
+# The image formats accepted as photos (as PIL names them) and the type each is served with.
+# Photos are served to anyone, so nothing else may be stored under a type a browser would render.
+IMAGE_CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+PHOTO_CONTENT_TYPES = frozenset(IMAGE_CONTENT_TYPES.values())
+STREAM_CHUNK_SIZE = 255 * 1024
+
+# Square variants rendered for every upload. Lists and the tree draw avatars at
+# 64-96 CSS pixels, so LIST_THUMBNAIL_SIZE covers them on 1x and most 2x screens.
+THUMBNAIL_SIZES = (48, 128, 512)
+LIST_THUMBNAIL_SIZE = 128
+THUMBNAIL_FORMAT = "WEBP"
+THUMBNAIL_CONTENT_TYPE = "image/webp"
+THUMBNAIL_QUALITY = 80
+
+_executor = None
+
+
+class InvalidPhoto(ValueError):
+    pass
+
+
+def decode_photo(photo_base64: str) -> bytes:
+    """Decode a base64 string or data URL of an image; the type a data URL declares must be an accepted one"""
+    match = DATA_URL_RE.match(photo_base64)
+    if match:
+        content_type = (match.group('content_type') or DEFAULT_CONTENT_TYPE).lower()
+        if content_type not in PHOTO_CONTENT_TYPES:
+            raise InvalidPhoto(f"photo must be a JPEG, PNG, WebP or GIF image, not {content_type}")
+        photo_base64 = photo_base64[match.end():]
+    try:
+        data = base64.b64decode(photo_base64, validate=True)
+    except (binascii.Error, ValueError):
+        raise InvalidPhoto("photo_base64 is not valid base64")
+    if not data:
+        raise InvalidPhoto("photo_base64 is empty")
+    return data
+
+
+def image_content_type(data: bytes) -> str:
+    """The content type of the image in data; raises InvalidPhoto unless PIL opens it as an accepted format"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+    except Image.DecompressionBombError:
+        raise InvalidPhoto("photo has too many pixels")
+    except (UnidentifiedImageError, OSError):
+        raise InvalidPhoto("photo is not an image")
+    if image_format not in IMAGE_CONTENT_TYPES:
+        raise InvalidPhoto(f"photo must be a JPEG, PNG, WebP or GIF image, not {image_format}")
+    return IMAGE_CONTENT_TYPES[image_format]
+
+
+def photo_url(member_id: str, photo_hash: str, size: int = None) -> str:
+    # The hash in the query string makes the URL change whenever the photo does,
+    # so clients can cache it forever.
+    url = f"/api/members/{member_id}/photo?v={photo_hash[:16]}"
+    if size:
+        url += f"&size={size}"
+    return url
+
+
+def variant_id(member_id: str, size: int) -> str:
+    return f"{member_id}@{size}"
+
+
+def render_thumbnails(data: bytes, sizes=THUMBNAIL_SIZES) -> dict:
+    """Decode an image and re-encode it as square thumbnails, keyed by size.
+
+    CPU bound - runs in the photo process pool, never on the event loop.
+    Images smaller than a requested size are not upscaled.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        thumbnails = {}
+        for size in sizes:
+            edge = min(size, image.width, image.height)
+            thumbnail = ImageOps.fit(image, (edge, edge), Image.LANCZOS)
+            out = io.BytesIO()
+            thumbnail.save(out, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY, method=4)
+            thumbnails[size] = out.getvalue()
+        return thumbnails
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=int(os.environ.get('PHOTO_WORKERS', 2)))
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class PhotoStore:
+    """Member photos kept as raw bytes in GridFS.
+
+    The original is stored under the member id and each thumbnail under "<member id>@<size>".
+    """
+
+    def __init__(self, db, bucket_name: str = "member_photos"):
+        self.db = db
+        self.bucket_name = bucket_name
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+
+    async def save(self, member_id: str, family_id: str, data: bytes) -> dict:
+        """Store the original and its thumbnails. Returns the fields to set on the member document.
+        The original is stored with the type of the image PIL detects, whatever the client said it was."""
+        content_type = image_content_type(data)
+        photo_hash = hashlib.sha256(data).hexdigest()
+        try:
+            loop = asyncio.get_running_loop()
+            thumbnails = await loop.run_in_executor(get_executor(), render_thumbnails, data)
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+            # PIL opened the image but could not render it; keep it, clients fall back to the original
+            logging.warning(f"Could not render thumbnails for member {member_id}: {str(e)}")
+            thumbnails = {}
+        
+        await self.delete(member_id)
+        await self._upload(member_id, family_id, data, content_type, photo_hash)
+        for size, thumbnail in thumbnails.items():
+            await self._upload(variant_id(member_id, size), family_id, thumbnail, THUMBNAIL_CONTENT_TYPE, photo_hash, size)
+        
+        thumbnail_size = LIST_THUMBNAIL_SIZE if LIST_THUMBNAIL_SIZE in thumbnails else None
+        return {
+            "photo_hash": photo_hash,
+            "photo_url": photo_url(member_id, photo_hash),
+            "photo_thumbnail_url": photo_url(member_id, photo_hash, thumbnail_size),
+            "photo_sizes": sorted(thumbnails),
+        }
+
+    async def _upload(self, file_id: str, family_id: str, data: bytes, content_type: str, photo_hash: str, size: int = None):
+        metadata = {
+            "family_id": family_id,
+            "content_type": content_type,
+            # The ETag of every variant derives from the original upload
+            "sha256": photo_hash if size is None else f"{photo_hash}-{size}",
+        }
+        if size is not None:
+            metadata["size"] = size
+        await self.bucket.upload_from_stream_with_id(file_id, file_id, data, metadata=metadata)
+
+    async def save_base64(self, member_id: str, family_id: str, photo_base64: str) -> dict:
+        """Store a base64 photo and return the fields to set on the member document"""
+        return await self.save(member_id, family_id, decode_photo(photo_base64))
+
+    async def open(self, member_id: str, size: int = None):
+        """Return a GridOut for the member's photo (or a thumbnail of it), or None if there is none"""
+        if size is not None:
+            try:
+                return await self.bucket.open_download_stream(variant_id(member_id, size))
+            except NoFile:
+                # Photos stored before thumbnails existed only have the original
+                pass
+        try:
+            return await self.bucket.open_download_stream(member_id)
+        except NoFile:
+            return None
+
+    async def delete(self, member_id: str) -> bool:
+        deleted = False
+        for file_id in (member_id, *(variant_id(member_id, size) for size in THUMBNAIL_SIZES)):
+            try:
+                await self.bucket.delete(file_id)
+                deleted = True
+            except NoFile:
+                pass
+        return deleted
+
+    async def read(self, member_id: str):
+        """Return (bytes, content_type) of the original photo, or None"""
+        grid_out = await self.open(member_id)
+        if grid_out is None:
+            return None
+        return await grid_out.read(), (grid_out.metadata or {}).get("content_type", DEFAULT_CONTENT_TYPE)
+
+    async def delete_family(self, family_id: str, limit: int = 0) -> int:
+        """Delete the family's photo files, at most limit of them (0: all); returns how many were deleted"""
+        deleted = 0
+        # Only the ids are needed, so read the files collection like delete_orphans rather than open each file
+        files = self.db[f"{self.bucket_name}.files"]
+        async for grid_file in files.find({"metadata.family_id": family_id}, {"_id": 1}, no_cursor_timeout=True, limit=limit):
+            await self.bucket.delete(grid_file["_id"])
+            deleted += 1
+        return deleted
+
+    async def delete_orphans(self, uploaded_before, batch_size: int = 500) -> int:
+        """Delete the photos of members that no longer exist; returns how many members' photos were deleted.
+        Only files uploaded before uploaded_before are considered, as a new member's photo is stored just before the member."""
+        # A member's files can fall in different batches; the ones already deleted are not counted again
+        deleted = set()
+        cursor = self.db[f"{self.bucket_name}.files"].find({"uploadDate": {"$lt": uploaded_before}}, {"_id": 1}).batch_size(batch_size)
+        member_ids = set()
+        async for grid_file in cursor:
+            member_id = str(grid_file["_id"]).split("@")[0]
+            if member_id not in deleted:
+                member_ids.add(member_id)
+            if len(member_ids) >= batch_size:
+                deleted |= await self._delete_missing(member_ids)
+                member_ids = set()
+        if member_ids:
+            deleted |= await self._delete_missing(member_ids)
+        return len(deleted)
+
+    async def _delete_missing(self, member_ids: set) -> set:
+        existing = self.db.family_members.find({"id": {"$in": list(member_ids)}}, {"_id": 0, "id": 1})
+        missing = member_ids - {member["id"] async for member in existing}
+        for member_id in missing:
+            await self.delete(member_id)
+        return missing
+
+
+def parse_range(range_header: str, length: int):
+    """Parse a single 'bytes=start-end' range. Returns (start, end) inclusive, or None if unsatisfiable."""
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', range_header or '')
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    start, end = match.group(1), match.group(2)
+    if not start:
+        # Suffix range: the last N bytes
+        suffix = int(end)
+        if suffix == 0:
+            return None
+        return max(length - suffix, 0), length - 1
+    start = int(start)
+    end = int(end) if end else length - 1
+    if start >= length or end < start:
+        return None
+    return start, min(end, length - 1)
+
+
+async def iter_grid_out(grid_out, start: int = 0, end: int = None):
+    """Yield the bytes of a GridOut between start and end (inclusive) in chunks"""
+    if end is None:
+        end = grid_out.length - 1
+    grid_out.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await grid_out.read(min(STREAM_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
@@ -0,0 +1,275 @@
+"""Opt-in request profiling and the slow-request log.
+
+Every /api request gets a RequestTrace for as long as it runs. The MongoDB
+command listener (see metrics.py) adds each command the request issues to it,
+with its duration and how many documents came back, and metrics.phase() adds
+the time of each handler phase. Handlers need no changes.
+
+- Slow requests: a request that takes SLOW_REQUEST_MS or longer is logged as
+  one JSON line: route, status, duration, time per phase, and its MongoDB
+  commands (count, total time, documents, the slowest few).
+- Profiles: a request sent with "X-Profile: <PROFILE_TOKEN>", or picked at
+  random at PROFILE_SAMPLE_RATE, also runs under a profiler. The call tree, the
+  full command list and the breakdown above are saved in the request_profiles
+  collection for PROFILE_TTL_SECONDS, and the response carries X-Profile-Id.
+  GET /api/admin/profiles lists them and /api/admin/profiles/{id}/download
+  returns the raw profile: a .prof file for pstats or snakeviz, or with
+  PROFILER=pyinstrument (pip install pyinstrument) an HTML call tree.
+
+cProfile sees everything the event loop runs while it is on, including other
+requests' coroutines, and a thread can only run one profiler at a time. So at
+most one request per process is profiled at once; others go unprofiled.
+pyinstrument follows the profiled request's own task across awaits.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+logger = logging.getLogger("profiling")
+
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+# Requests carrying this value in X-Profile are profiled; unset, the header is ignored
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+PROFILE_TTL_SECONDS = int(os.environ.get('PROFILE_TTL_SECONDS', 7 * 86400))
+PROFILE_HEADER = b"x-profile"
+# Commands kept per request; the rest are only counted
+MAX_COMMANDS = 1000
+SLOWEST_COMMANDS = 5
+REPORT_LINES = 60
+
+_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+def current_trace():
+    """The running request's RequestTrace, or None outside a traced request"""
+    return _trace.get()
+
+
+def reply_documents(reply: dict):
+    """How many documents a command returned or wrote, when its reply says"""
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    if "n" in reply:
+        return reply["n"]
+    if "value" in reply:
+        return int(reply["value"] is not None)
+    return None
+
+
+class RequestTrace:
+    """What one request spent its time on: handler phases and MongoDB commands"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.commands = []
+        self.dropped = 0
+
+    def phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def command(self, name: str, collection: str, seconds: float, documents=None, ok: bool = True):
+        # Called from Motor's executor threads; list.append is atomic
+        if len(self.commands) >= MAX_COMMANDS:
+            self.dropped += 1
+            return
+        self.commands.append({
+            "command": name,
+            "collection": collection,
+            "ms": round(seconds * 1000, 3),
+            "documents": documents,
+            "ok": ok,
+        })
+
+    def breakdown(self, scope, status: int) -> dict:
+        commands = list(self.commands)
+        route = scope.get("route")
+        return {
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": getattr(route, "path", None),
+            "path_params": scope.get("path_params", {}),
+            "status": status,
+            "duration_ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "mongo": {
+                "commands": len(commands) + self.dropped,
+                "ms": round(sum(command["ms"] for command in commands), 1),
+                "documents": sum(command["documents"] or 0 for command in commands),
+                "slowest": sorted(commands, key=lambda command: command["ms"], reverse=True)[:SLOWEST_COMMANDS],
+            },
+        }
+
+
+# ============= PROFILERS =============
+
+class CProfiler:
+    name = "cprofile"
+    extension = "prof"
+    media_type = "application/octet-stream"
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self) -> str:
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(REPORT_LINES)
+        return out.getvalue()
+
+    def data(self) -> bytes:
+        """The stats in the format pstats.Stats(path) and snakeviz load"""
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+
+class PyinstrumentProfiler:
+    name = "pyinstrument"
+    extension = "html"
+    media_type = "text/html"
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise RuntimeError("PROFILER is pyinstrument but the pyinstrument package is not installed (pip install pyinstrument)")
+        self.profiler = Profiler(async_mode="enabled")
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    def report(self) -> str:
+        return self.profiler.output_text()
+
+    def data(self) -> bytes:
+        return self.profiler.output_html().encode()
+
+
+PROFILERS = {CProfiler.name: CProfiler, PyinstrumentProfiler.name: PyinstrumentProfiler}
+
+
+# ============= MIDDLEWARE =============
+
+class RequestProfiler:
+    """Settings and counters for ProfilingMiddleware; save(document) stores a finished profile"""
+
+    def __init__(self, save, slow_ms: float = SLOW_REQUEST_MS, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 token: str = PROFILE_TOKEN, profiler: str = PROFILER):
+        self.save = save
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.token = token.encode() if token else None
+        self.profiler_class = PROFILERS[profiler]
+        # Fails at startup rather than on the first profiled request when pyinstrument is missing
+        self.profiler_class()
+        self.busy = False
+        self.stats = {"profiled": 0, "skipped_busy": 0, "slow": 0, "save_errors": 0}
+
+    def reason(self, scope):
+        """Why the request should be profiled ("header" or "sampled"), or None"""
+        if self.token is not None:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER and value == self.token:
+                    return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def finished(self, scope, trace: RequestTrace, status: int) -> dict:
+        breakdown = trace.breakdown(scope, status)
+        if breakdown["duration_ms"] >= self.slow_ms:
+            self.stats["slow"] += 1
+            logger.warning(f"Slow request {scope['method']} {scope['path']}: {json.dumps(breakdown, default=str)}")
+        return breakdown
+
+    async def save_profile(self, profile_id: str, reason: str, profiler, trace: RequestTrace, breakdown: dict):
+        self.stats["profiled"] += 1
+        document = {
+            "id": profile_id,
+            "created_at": datetime.now(timezone.utc),
+            "reason": reason,
+            "profiler": profiler.name,
+            **breakdown,
+            "commands": trace.commands,
+            "report": profiler.report(),
+            "data": profiler.data(),
+        }
+        try:
+            await self.save(document)
+        except Exception as e:
+            self.stats["save_errors"] += 1
+            logger.error(f"Could not save profile {profile_id} of {breakdown['method']} {breakdown['path']}: {str(e)}")
+
+    def info(self) -> dict:
+        return {
+            "slow_request_ms": self.slow_ms,
+            "sample_rate": self.sample_rate,
+            "header_enabled": self.token is not None,
+            "profiler": self.profiler_class.name,
+            **self.stats,
+        }
+
+
+class ProfilingMiddleware:
+    """ASGI middleware tracing every /api request, logging slow ones and profiling the ones asked for"""
+
+    def __init__(self, app, request_profiler: RequestProfiler):
+        self.app = app
+        self.request_profiler = request_profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        trace = RequestTrace()
+        token = _trace.set(trace)
+        reason = self.request_profiler.reason(scope)
+        profiler = None
+        if reason and self.request_profiler.busy:
+            self.request_profiler.stats["skipped_busy"] += 1
+        elif reason:
+            profiler = self.request_profiler.profiler_class()
+        profile_id = str(uuid.uuid4()) if profiler else None
+        status = 500
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile_id:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        if profiler:
+            self.request_profiler.busy = True
+            profiler.start()
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            if profiler:
+                profiler.stop()
+                self.request_profiler.busy = False
+            _trace.reset(token)
+            breakdown = self.request_profiler.finished(scope, trace, status)
+            if profiler:
+                await self.request_profiler.save_profile(profile_id, reason, profiler, trace, breakdown)
@@ -0,0 +1,264 @@
+"""Per-client rate limits and a global concurrency limit for the API.
+
+AdmissionMiddleware runs in front of every /api request and does two checks:
+
+1. Rate limit. The first RULES entry whose method and path pattern match the
+   request picks a token bucket of `burst` requests, refilled at rate/per
+   seconds. There is one bucket per rule and client. A client is its access
+   token when it sends a valid one, or else its IP address. An empty bucket
+   answers 429 with Retry-After set to when the next token arrives. Buckets
+   live in this process by default. With RATE_LIMIT_URL=redis://... every API
+   process shares them (atomically, via a Lua script). If that store cannot
+   be reached, requests are let through.
+2. Admission. At most MAX_CONCURRENT_REQUESTS requests run at once. Up to
+   MAX_QUEUED_REQUESTS more wait for a slot, each for at most
+   QUEUE_TIMEOUT_SECONDS. Anything beyond that answers 503 with Retry-After
+   right away, so a burst cannot pile up unbounded work on the event loop
+   and the Motor pool.
+
+RATE_LIMIT_RULES (a JSON list shaped like RULES) replaces the defaults; "[]"
+turns rate limiting off.
+"""
+import asyncio
+import fnmatch
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("ratelimit")
+
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', 64))
+MAX_QUEUED_REQUESTS = int(os.environ.get('MAX_QUEUED_REQUESTS', 256))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get('QUEUE_TIMEOUT_SECONDS', 5))
+# Use the first X-Forwarded-For address as the client IP (only behind a proxy that sets it)
+TRUST_FORWARDED_FOR = os.environ.get('TRUST_FORWARDED_FOR', '').lower() in ('1', 'true', 'yes')
+MAX_BUCKETS = 100000
+KEY_PREFIX = "onefam:rl:"
+
+# First match wins: (name, method, path pattern, rate, per seconds, burst)
+RULES = [
+    {"name": "login", "method": "POST", "path": "/api/auth/login", "rate": 10, "per": 60, "burst": 10},
+    {"name": "refresh", "method": "POST", "path": "/api/auth/refresh", "rate": 30, "per": 60, "burst": 10},
+    {"name": "send_alerts", "method": "POST", "path": "/api/families/*/send-alerts", "rate": 3, "per": 300, "burst": 3},
+    {"name": "import", "method": "POST", "path": "/api/families/*/import", "rate": 10, "per": 600, "burst": 3},
+    {"name": "export", "method": "GET", "path": "/api/families/*/export", "rate": 10, "per": 600, "burst": 3},
+    {"name": "photos", "method": "GET", "path": "/api/members/*/photo", "rate": 50, "per": 1, "burst": 200},
+    {"name": "reads", "method": "GET", "path": "/api/*", "rate": 20, "per": 1, "burst": 60},
+    {"name": "writes", "method": "*", "path": "/api/*", "rate": 10, "per": 1, "burst": 30},
+]
+
+
+def rules_from_env() -> list:
+    raw = os.environ.get('RATE_LIMIT_RULES')
+    return json.loads(raw) if raw else RULES
+
+
+class MemoryStore:
+    """Buckets in this process, the least recently used dropped past max_buckets"""
+
+    name = "memory"
+
+    def __init__(self, max_buckets: int = MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int):
+        """(allowed, seconds until the next token) after taking one token from the bucket"""
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_buckets:
+            self.buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def info(self) -> dict:
+        return {"buckets": len(self.buckets)}
+
+    async def close(self):
+        pass
+
+
+# Same bucket arithmetic as MemoryStore, on Redis' clock so every API process agrees
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(wait)}
+"""
+
+
+class RedisStore:
+    """Buckets in Redis, shared by every API process"""
+
+    name = "redis"
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(TAKE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_URL is a Redis URL but the redis package is not installed (pip install redis)")
+        return cls(redis.from_url(url))
+
+    async def take(self, key: str, rate: float, burst: int):
+        allowed, wait = await self.script(keys=[KEY_PREFIX + key], args=[rate, burst])
+        return bool(allowed), float(wait)
+
+    def info(self) -> dict:
+        return {}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def store_from_env():
+    url = os.environ.get('RATE_LIMIT_URL')
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore.from_url(url)
+    return MemoryStore()
+
+
+class RateLimiter:
+    def __init__(self, rules: list = None, store=None):
+        self.rules = RULES if rules is None else rules
+        self.store = store or MemoryStore()
+        self.stats = {"limited": {rule["name"]: 0 for rule in self.rules}, "errors": 0}
+
+    def match(self, method: str, path: str):
+        for rule in self.rules:
+            if rule["method"] in ("*", method) and fnmatch.fnmatchcase(path, rule["path"]):
+                return rule
+        return None
+
+    async def check(self, rule: dict, client: str):
+        """(allowed, Retry-After seconds) for one request of client under rule"""
+        try:
+            allowed, wait = await self.store.take(f"{rule['name']}:{client}", rule["rate"] / rule["per"], rule["burst"])
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Rate limit store failed, letting the request through: {str(e)}")
+            return True, 0
+        if not allowed:
+            self.stats["limited"][rule["name"]] += 1
+        return allowed, max(1, math.ceil(wait))
+
+    def info(self) -> dict:
+        return {"store": self.store.name, **self.stats, **self.store.info()}
+
+
+class ConcurrencyGate:
+    """At most `limit` requests in flight; up to max_queued more wait for a slot, for at most timeout seconds"""
+
+    def __init__(self, limit: int = MAX_CONCURRENT_REQUESTS, max_queued: int = MAX_QUEUED_REQUESTS,
+                 timeout: float = QUEUE_TIMEOUT_SECONDS):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.queued = 0
+        self.stats = {"admitted": 0, "queue_full": 0, "queue_timeouts": 0, "max_queued_seen": 0}
+
+    async def acquire(self) -> bool:
+        if self.semaphore.locked():
+            if self.queued >= self.max_queued:
+                self.stats["queue_full"] += 1
+                return False
+            self.queued += 1
+            self.stats["max_queued_seen"] = max(self.stats["max_queued_seen"], self.queued)
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.stats["queue_timeouts"] += 1
+                return False
+            finally:
+                self.queued -= 1
+        else:
+            await self.semaphore.acquire()
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def info(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "queued": self.queued, "max_queued": self.max_queued, **self.stats}
+
+
+def client_ip(scope) -> str:
+    if TRUST_FORWARDED_FOR:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    return scope["client"][0] if scope.get("client") else "unknown"
+
+
+async def send_rejection(send, status: int, detail: str, retry_after: int):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the rate limiter and then the concurrency gate to /api requests.
+    client_key(scope) names the client a request counts against."""
+
+    def __init__(self, app, limiter: RateLimiter, gate: ConcurrencyGate, client_key):
+        self.app = app
+        self.limiter = limiter
+        self.gate = gate
+        self.client_key = client_key
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        rule = self.limiter.match(scope["method"], scope["path"])
+        if rule is not None:
+            allowed, retry_after = await self.limiter.check(rule, self.client_key(scope))
+            if not allowed:
+                await send_rejection(send, 429, "Too many requests", retry_after)
+                return
+        if not await self.gate.acquire():
+            await send_rejection(send, 503, "Server busy, try again shortly", 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.gate.release()
@@ -0,0 +1,118 @@
+"""Reminder emails: built by the API, delivered by the worker as "reminder_email" jobs.
+
+Every (family, event, date, recipient) that is sent is recorded in reminder_log
+under a unique index, so the same reminder never goes out twice even when a job
+is retried or a family's alerts are queued more than once. Before sending, a job
+reserves its rows with status "sending" and only mails the rows it owns. After
+the send it marks them "sent", or releases them if the send failed.
+"""
+from datetime import datetime, timezone
+
+from pymongo.errors import BulkWriteError
+
+import jobs
+import mailer
+import occurrences
+
+KIND = "reminder_email"
+SUBJECT = "OneFam - Upcoming Events Reminder"
+ALERT_TYPES = {occurrences.BIRTHDAY: 'Birthday', occurrences.ANNIVERSARY: 'Anniversary', occurrences.CUSTOM: 'Event'}
+SENDING = "sending"
+SENT = "sent"
+DUPLICATE_KEY = 11000
+
+
+def alert(row: dict, occurrence) -> dict:
+    return {
+        'key': f"{row['kind']}:{row['source_id']}",
+        'type': ALERT_TYPES[row['kind']],
+        'name': row.get('member_name') or row['title'],
+        'date': occurrence.strftime('%B %d, %Y'),
+    }
+
+
+def render_email(alerts) -> str:
+    email_content = "<html><body style='font-family: Arial, sans-serif;'><h2 style='color: #2C4F42;'>Upcoming Events Reminder</h2><p>The following events are happening tomorrow:</p><ul style='list-style-type: none; padding: 0;'>"
+    for alert in alerts:
+        email_content += f"<li style='margin: 10px 0; padding: 10px; background: #F5F2EB; border-left: 4px solid #C86B53;'><strong style='color: #2C4F42;'>{alert['type']}</strong>: {alert['name']} on {alert['date']}</li>"
+    email_content += "</ul><p style='color: #78716C;'>Don't forget to celebrate!</p><p style='font-size: 12px; color: #78716C;'>- OneFam Family Tree</p></body></html>"
+    return email_content
+
+
+def digest_job(family_id: str, day, alerts: list, recipients: list) -> dict:
+    """A job sending one digest of alerts to the family's recipients, for events happening on day"""
+    return jobs.new_job(KIND, {
+        "date": day.isoformat(),
+        "alerts": alerts,
+        "recipients": recipients,
+    }, family_id=family_id)
+
+
+async def enqueue(db, family_id: str, day, alerts: list, recipients: list) -> dict:
+    job = digest_job(family_id, day, alerts, recipients)
+    await db.jobs.insert_one(job)
+    job.pop("_id", None)
+    return job
+
+
+async def _reserve(db, job: dict, keys: list, recipients: list) -> set:
+    """Claim the unsent (event, recipient) pairs for this job; returns the pairs it owns"""
+    family_id, day = job["family_id"], job["payload"]["date"]
+    now = datetime.now(timezone.utc)
+    rows = [
+        {"family_id": family_id, "event_key": key, "date": day, "recipient": recipient,
+         "job_id": job["id"], "status": SENDING, "created_at": now}
+        for key in keys for recipient in recipients
+    ]
+    if rows:
+        try:
+            await db.reminder_log.insert_many(rows, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+    # A retry of this job also picks up the rows an earlier attempt reserved but did not send
+    owned = db.reminder_log.find(
+        {"family_id": family_id, "date": day, "job_id": job["id"], "status": SENDING},
+        {"_id": 0, "event_key": 1, "recipient": 1},
+    )
+    return {(row["event_key"], row["recipient"]) async for row in owned}
+
+
+async def deliver(db, sender: mailer.Mailer, job: dict) -> dict:
+    """Job handler: send the digest to every recipient that has not had these reminders yet"""
+    payload = job["payload"]
+    alerts, recipients = payload["alerts"], payload["recipients"]
+    owned = await _reserve(db, job, [alert["key"] for alert in alerts], recipients)
+
+    # Recipients usually all get the same digest; group them by the events still unsent to them
+    groups = {}
+    for recipient in recipients:
+        keys = tuple(alert["key"] for alert in alerts if (alert["key"], recipient) in owned)
+        if keys:
+            groups.setdefault(keys, []).append(recipient)
+
+    results = []
+    for keys, group in groups.items():
+        content = render_email([alert for alert in alerts if alert["key"] in keys])
+        for result in await sender.send(group, SUBJECT, content):
+            rows = {"job_id": job["id"], "event_key": {"$in": list(keys)}, "recipient": {"$in": result["recipients"]}}
+            if result["status"] == mailer.SENT:
+                await db.reminder_log.update_many(rows, {"$set": {"status": SENT, "sent_at": datetime.now(timezone.utc)}})
+            else:
+                await db.reminder_log.delete_many(rows)
+            results.append(result)
+
+    summary = {
+        "results": results,
+        "duplicates": len(alerts) * len(recipients) - len(owned),
+        **{status: sum(len(r["recipients"]) for r in results if r["status"] == status)
+           for status in (mailer.SENT, mailer.FAILED, mailer.SKIPPED)},
+    }
+    failed = [r for r in results if r["status"] == mailer.FAILED]
+    if failed:
+        message = f"{summary[mailer.FAILED]} recipient(s) failed: {failed[0]['error']}"
+        # 4xx other than 429 (bad key, rejected payload) will fail the same way on every retry
+        if all(r["status_code"] and r["status_code"] < 500 and r["status_code"] != 429 for r in failed):
+            raise jobs.PermanentJobError(message, summary)
+        raise jobs.RetryableJobError(message, summary)
+    return summary
@@ -0,0 +1,192 @@
+"""Daily reminder runs across every family, so nobody has to call send-alerts.
+
+Reminders go out at REMINDER_HOUR local time for each recipient (see
+timezones.py), so the work is split into timezone buckets that come due one
+after another through the day rather than all at 00:00 UTC. When a bucket comes
+due, its local tomorrow is read for all families with one aggregation on the
+global (month, day) index, grouped by family. Recipients in that bucket are then
+read in batches, and one digest job per live family is queued for the worker;
+deleted families are skipped even while their calendar rows are still there. The
+cost follows the number of events that day, not the number of families.
+
+Each (timezone, date) run has a document in scheduler_runs. Only the replica
+that claims it does the run; the claim expires after LOCK_TTL_SECONDS, so a
+crashed run is picked up by another replica. Digests it queues twice are
+harmless, because reminder_log stops a reminder going out a second time.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import date, datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+import jobs
+import occurrences
+import reminders
+import timezones
+
+logger = logging.getLogger("scheduler")
+
+# Local hour of the day after which tomorrow's reminders are queued
+REMINDER_HOUR = int(os.environ.get('REMINDER_HOUR', 8))
+CHECK_INTERVAL_SECONDS = 60
+# How often the set of timezones in use is re-read
+TIMEZONE_REFRESH_SECONDS = 600
+LOCK_TTL_SECONDS = 600
+FAMILY_BATCH_SIZE = 500
+
+RUNNING = "running"
+DONE = "done"
+
+
+async def acquire_run(db, run_id: str, owner: str) -> bool:
+    """Claim a run unless it is done or another replica holds a live claim on it"""
+    now = jobs.utcnow()
+    try:
+        await db.scheduler_runs.update_one(
+            {"_id": run_id, "status": {"$ne": DONE}, "locked_until": {"$lt": now}},
+            {"$set": {
+                "status": RUNNING,
+                "owner": owner,
+                "locked_until": now + timedelta(seconds=LOCK_TTL_SECONDS),
+                "started_at": now,
+            }},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def finish_run(db, run_id: str, owner: str, summary: dict = None, failed: bool = False):
+    update = {"locked_until": jobs.utcnow()} if failed else {"status": DONE, "finished_at": jobs.utcnow(), "summary": summary}
+    await db.scheduler_runs.update_one({"_id": run_id, "owner": owner}, {"$set": update})
+
+
+def occurrences_on(day: date) -> list:
+    """Pipeline grouping every family's occurrences that fall on day"""
+    return [
+        {"$match": occurrences.window_filter(day, 0)},
+        {"$project": {"_id": 0, "family_id": 1, "kind": 1, "source_id": 1, "title": 1, "member_name": 1, "month": 1, "day": 1, "year": 1}},
+        {"$group": {"_id": "$family_id", "rows": {"$push": "$$ROOT"}}},
+    ]
+
+
+async def _queue_digests(db, day: date, families: dict, summary: dict, zones=None):
+    """families: {family_id: alerts}; queues one digest per live family that has recipients in zones (None: all)
+    and adds the families, events and jobs to summary"""
+    # Deleted families keep their calendar rows until their delete job has run
+    cursor = db.families.find({"id": {"$in": list(families)}, "deleted_at": None}, {"_id": 0, "id": 1, "timezone": 1})
+    family_zones = {family["id"]: family.get("timezone") async for family in cursor}
+    families = {family_id: alerts for family_id, alerts in families.items() if family_id in family_zones}
+    summary["families"] += len(families)
+    summary["events"] += sum(map(len, families.values()))
+    recipients = {}
+    cursor = db.family_members.find(
+        {"family_id": {"$in": list(families)}, "email": {"$nin": [None, ""]}},
+        {"_id": 0, "family_id": 1, "email": 1, "timezone": 1},
+    )
+    async for member in cursor:
+        if zones is None or timezones.resolve(member.get("timezone"), family_zones.get(member["family_id"])) in zones:
+            recipients.setdefault(member["family_id"], {})[member["email"]] = None
+    summary["jobs"] += await jobs.enqueue_many(db, [
+        reminders.digest_job(family_id, day, alerts, list(recipients[family_id]))
+        for family_id, alerts in families.items()
+        if family_id in recipients
+    ])
+
+
+async def queue_reminders(db, day: date, zones=None) -> dict:
+    """Queue a digest for every live family with something happening on day, for recipients in zones (None: all)"""
+    summary = {"date": day.isoformat(), "zones": sorted(zones) if zones is not None else None, "families": 0, "events": 0, "jobs": 0}
+    batch = {}
+    async for group in db.occurrences.aggregate(occurrences_on(day)):
+        alerts = []
+        for row in group["rows"]:
+            # Past one-off events and Feb 29 rows in leap years also match the day filter
+            if occurrences.next_occurrence(row, day) == day:
+                alerts.append(reminders.alert(row, day))
+        if not alerts:
+            continue
+        batch[group["_id"]] = alerts
+        if len(batch) >= FAMILY_BATCH_SIZE:
+            await _queue_digests(db, day, batch, summary, zones)
+            batch = {}
+    if batch:
+        await _queue_digests(db, day, batch, summary, zones)
+    return summary
+
+
+async def timezones_in_use(db) -> set:
+    zones = {timezones.DEFAULT_TIMEZONE}
+    for collection in (db.families, db.family_members):
+        zones.update(await collection.distinct("timezone"))
+    return {timezones.resolve(zone) for zone in zones if zone}
+
+
+def due_buckets(now: datetime, zones, hour: int = REMINDER_HOUR) -> dict:
+    """{local tomorrow: zones} for the zones where it is already past hour today"""
+    buckets = {}
+    for zone in zones:
+        local = timezones.local_now(zone, now)
+        if local.hour >= hour:
+            buckets.setdefault(local.date() + timedelta(days=1), set()).add(zone)
+    return buckets
+
+
+def run_id(zone: str, day: date) -> str:
+    return f"reminders:{zone}:{day.isoformat()}"
+
+
+class Scheduler:
+    """Queues each timezone's reminders for its tomorrow once a day, after REMINDER_HOUR local time"""
+
+    def __init__(self, db, hour: int = REMINDER_HOUR, check_interval: float = CHECK_INTERVAL_SECONDS, owner: str = None):
+        self.db = db
+        self.hour = hour
+        self.check_interval = check_interval
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.zones = None
+        self.zones_read_at = None
+
+    async def _zones(self, now: datetime) -> set:
+        if self.zones is None or (now - self.zones_read_at).total_seconds() >= TIMEZONE_REFRESH_SECONDS:
+            self.zones = await timezones_in_use(self.db)
+            self.zones_read_at = now
+        return self.zones
+
+    async def run_due(self, now: datetime = None) -> list:
+        """Do every due bucket that no replica has done yet, one at a time; returns their summaries"""
+        now = now or jobs.utcnow()
+        summaries = []
+        for day, zones in sorted(due_buckets(now, await self._zones(now), self.hour).items()):
+            ids = {zone: run_id(zone, day) for zone in zones}
+            done = {run["_id"] async for run in self.db.scheduler_runs.find({"_id": {"$in": list(ids.values())}, "status": DONE}, {"_id": 1})}
+            claimed = {zone for zone, id_ in ids.items() if id_ not in done and await acquire_run(self.db, id_, self.owner)}
+            if not claimed:
+                continue
+            try:
+                summary = await queue_reminders(self.db, day, claimed)
+            except Exception:
+                for zone in claimed:
+                    await finish_run(self.db, ids[zone], self.owner, failed=True)
+                raise
+            for zone in claimed:
+                await finish_run(self.db, ids[zone], self.owner, summary)
+            logger.info(f"Queued {summary['jobs']} reminder digest(s) for {summary['events']} event(s) on {day} in {', '.join(sorted(claimed))}")
+            summaries.append(summary)
+        return summaries
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                await self.run_due()
+            except Exception as e:
+                logger.error(f"Reminder run failed: {str(e)}")
+            try:
+                await asyncio.wait_for(stop.wait(), self.check_interval)
+            except asyncio.TimeoutError:
+                pass
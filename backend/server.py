@@ -1,65 +1,121 @@
-from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Request, Query, Depends, Header
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 import os
 import logging
+import orjson
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, AfterValidator, TypeAdapter, ValidationError
+from typing import Annotated, Any, Dict, List, Literal, Optional
 import uuid
+import asyncio
+import hashlib
+import hmac
 from datetime import datetime, timezone, timedelta
 import base64
+from urllib.parse import quote
 from passlib.context import CryptContext
-import jwt
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+import auth
+import cache
+import cleanup
+import family_export
+import family_graph
+import family_tree
+import indexes
+import jobs
+import member_import
+import metrics
+import occurrences
+import profiling
+import ratelimit
+import reminders
+import timezones
+from photo_store import PhotoStore, InvalidPhoto, PHOTO_CONTENT_TYPES, THUMBNAIL_SIZES, parse_range, iter_grid_out, shutdown_executor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: datetimes (created_at and the like) come back in UTC rather than naive
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[metrics.MongoCommandListener()])
 db = client[os.environ['DB_NAME']]
+photo_store = PhotoStore(db)
+response_cache = cache.ResponseCache(cache.backend_from_env())
+graph_index = family_graph.GraphIndex(db)
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # JWT settings
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
-ALGORITHM = "HS256"
+token_verifier = auth.TokenVerifier(SECRET_KEY)
+
+async def require_auth(request: Request) -> dict:
+    """Claims of the request's access token; 401 when it is missing, invalid or expired"""
+    token = auth.bearer_token(request.headers.get("Authorization"))
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return token_verifier.verify(token)
+    except auth.InvalidToken as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
 
 # Create the main app
 app = FastAPI()
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", dependencies=[Depends(require_auth)], route_class=metrics.InstrumentedRoute)
+# Routes that work without a token: logging in, refreshing, and photos (loaded by <img> tags)
+public_router = APIRouter(prefix="/api", route_class=metrics.InstrumentedRoute)
 
 # ============= MODELS =============
 
+# IANA timezone name such as "Europe/Paris"; members without one use their family's, families without one UTC
+TimezoneName = Annotated[Optional[str], AfterValidator(timezones.validate)]
+# YYYY-MM-DD, checked on write and stored with its date parts (see occurrences.date_parts); empty is None
+DateString = Annotated[Optional[str], AfterValidator(occurrences.validate_date)]
+EventDate = Annotated[str, Field(min_length=1), AfterValidator(occurrences.validate_date)]
+
 class LoginRequest(BaseModel):
     username: str
     password: str
 
 class LoginResponse(BaseModel):
-    token: str
+    token: str  # Access token
+    refresh_token: str
+    token_type: str = "bearer"
+    expires_in: int  # Seconds the access token is valid for
     message: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class FamilyCreate(BaseModel):
     name: str
+    timezone: TimezoneName = None
+
+class FamilyUpdate(BaseModel):
+    name: Optional[str] = None
+    timezone: TimezoneName = None
 
 class Family(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
+    timezone: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class FamilyMemberCreate(BaseModel):
     first_name: str
     last_name: str
     email: Optional[str] = None
+    timezone: TimezoneName = None
     address: Optional[str] = None
-    birthday: Optional[str] = None  # Format: YYYY-MM-DD
-    anniversary: Optional[str] = None  # Format: YYYY-MM-DD
+    birthday: DateString = None
+    anniversary: DateString = None
     comments: Optional[str] = None
     father_id: Optional[str] = None  # Parent 1
     mother_id: Optional[str] = None  # Parent 2
@@ -69,13 +125,15 @@ class FamilyMemberUpdate(BaseModel):
     first_name: Optional[str] = None
     last_name: Optional[str] = None
     email: Optional[str] = None
+    timezone: TimezoneName = None
     address: Optional[str] = None
-    birthday: Optional[str] = None
-    anniversary: Optional[str] = None
+    birthday: DateString = None
+    anniversary: DateString = None
     comments: Optional[str] = None
     father_id: Optional[str] = None
     mother_id: Optional[str] = None
-    photo_base64: Optional[str] = None
+    photo_base64: Optional[str] = None  # null removes the photo, "" keeps it
+    version: Optional[int] = None  # Apply only if the member is still at this version
 
 class FamilyMember(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -84,18 +142,42 @@ class FamilyMember(BaseModel):
     first_name: str
     last_name: str
     email: Optional[str] = None
+    timezone: Optional[str] = None
     address: Optional[str] = None
-    photo_base64: Optional[str] = None
+    photo_url: Optional[str] = None
+    photo_thumbnail_url: Optional[str] = None
+    photo_sizes: List[int] = []
+    photo_hash: Optional[str] = None
     birthday: Optional[str] = None
     anniversary: Optional[str] = None
     comments: Optional[str] = None
     father_id: Optional[str] = None
     mother_id: Optional[str] = None
+    version: int = 0  # Incremented by every update; documents written before it existed count as 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class FamilyMemberSummary(BaseModel):
+    """The member fields the family views draw; excludes bookkeeping fields"""
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    first_name: str
+    last_name: str
+    email: Optional[str] = None
+    timezone: Optional[str] = None
+    address: Optional[str] = None
+    photo_url: Optional[str] = None
+    photo_thumbnail_url: Optional[str] = None
+    photo_sizes: List[int] = []
+    birthday: Optional[str] = None
+    anniversary: Optional[str] = None
+    comments: Optional[str] = None
+    father_id: Optional[str] = None
+    mother_id: Optional[str] = None
+    version: int = 0  # Sent back with an edit so it cannot overwrite a newer one
+
 class CustomEventCreate(BaseModel):
     event_name: str
-    event_date: str  # Format: YYYY-MM-DD
+    event_date: EventDate
     member_id: Optional[str] = None
 
 class CustomEvent(BaseModel):
@@ -107,6 +189,22 @@ class CustomEvent(BaseModel):
     event_date: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class CustomEventUpdate(BaseModel):
+    event_name: Optional[str] = None
+    event_date: Optional[EventDate] = None
+    member_id: Optional[str] = None
+
+class BatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    type: Literal["member", "event"]
+    id: Optional[str] = None  # The member or event to update or delete
+    ref: Optional[str] = None  # On create: a name later operations can use instead of the new id
+    data: Dict[str, Any] = {}
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(min_length=1, max_length=1000)
+    transaction: bool = False
+
 class Alert(BaseModel):
     type: str  # 'birthday', 'anniversary', 'custom'
     title: str
@@ -114,384 +212,1178 @@ class Alert(BaseModel):
     member_name: Optional[str] = None
     days_until: int
 
+class FamilySnapshot(BaseModel):
+    family: Family
+    members: List[FamilyMemberSummary]
+    alerts: List[Alert]
+
+# ============= PAGINATION =============
+
+# List endpoints return pages ordered by id. Pass the last id of a page as ?after=
+# to get the next one; X-Next-After is set when there is more. With
+# Accept: application/x-ndjson (or ?format=ndjson) documents are streamed
+# straight from the cursor instead, one JSON object per line.
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 5000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_BATCH_SIZE = 500
+
+class PageParams:
+    def __init__(
+        self,
+        request: Request,
+        after: Optional[str] = None,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        output_format: Optional[str] = Query(None, alias="format", pattern="^(json|ndjson)$"),
+    ):
+        self.after = after
+        self.limit = limit
+        self.stream = output_format == "ndjson" or (
+            output_format is None and NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+        )
+
+async def iter_ndjson(cursor):
+    async for doc in cursor:
+        yield orjson.dumps(doc, default=str, option=JSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+
+async def list_page(collection, query: dict, projection: dict, page: PageParams, response: Response):
+    """One keyset page of documents (or a streaming response in NDJSON mode)"""
+    if page.after:
+        query = {**query, "id": {"$gt": page.after}}
+    cursor = collection.find(query, projection).sort("id", 1)
+    
+    if page.stream:
+        if page.limit:
+            cursor = cursor.limit(page.limit)
+        return StreamingResponse(iter_ndjson(cursor.batch_size(NDJSON_BATCH_SIZE)), media_type=NDJSON_MEDIA_TYPE)
+    
+    page_size = page.limit or DEFAULT_PAGE_SIZE
+    with metrics.phase("db"):
+        docs = await cursor.limit(page_size + 1).to_list(None)
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        response.headers["X-Next-After"] = docs[-1]["id"]
+    return docs
+
+# ============= RESPONSE CACHE =============
+
+# Read endpoints answer from response_cache while their family's version is
+# unchanged. Every write handler bumps the family (and FAMILIES_SCOPE when the
+# family list changes), so a cached response never outlives the data it came from.
+FAMILIES_SCOPE = "families"
+# Datetimes as FastAPI writes them: UTC with a Z. Naive ones (mongomock in tests) are UTC too
+JSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+_type_adapters = {}
+
+class DocumentShape:
+    """A response model's fields as a find() projection, for documents encoded without validation.
+    
+    Documents read with .projection already hold only the model's fields, so
+    serialize() fills in the defaults of missing ones and encodes them with
+    orjson; validating each one through the model first would only copy it.
+    """
+    def __init__(self, model):
+        self.projection = {"_id": 0, **{field: 1 for field in model.model_fields}}
+        self.defaults = {
+            name: field.default for name, field in model.model_fields.items()
+            if not field.is_required() and field.default_factory is None
+        }
+    
+    def fill(self, value):
+        """value (one document or a list of them) with the model's defaults for missing fields"""
+        if isinstance(value, dict):
+            return {**self.defaults, **value}
+        return [{**self.defaults, **doc} for doc in value]
+
+def serialize(value, model=None) -> bytes:
+    """JSON body for value: documents read with a DocumentShape's projection, plain data when model
+    is None, or anything else validated and dumped through model like response_model would"""
+    if isinstance(model, DocumentShape):
+        value, model = model.fill(value), None
+    if model is None:
+        return orjson.dumps(value, default=str, option=JSON_OPTIONS)
+    adapter = _type_adapters.get(model)
+    if adapter is None:
+        adapter = _type_adapters[model] = TypeAdapter(model)
+    return adapter.dump_json(adapter.validate_python(value))
+
+def alert_clock() -> str:
+    """Changes every 15 minutes, the finest step at which "today" changes in some timezone"""
+    now = datetime.now(timezone.utc)
+    return f"{now:%Y-%m-%dT%H}:{now.minute // 15 * 15:02d}"
+
+async def cached_response(request: Request, scope: str, name: str, params: dict, compute, model=None) -> Response:
+    """Cached JSON response, built by compute(response) on a miss; If-None-Match is answered with 304"""
+    with metrics.phase("cache"):
+        version = await response_cache.version(scope)
+        key = response_cache.key(scope, version, name, params) if version is not None else None
+        entry = await response_cache.get(key) if key else None
+    if entry:
+        body, headers = entry
+    else:
+        collected = Response()
+        value = await compute(collected)
+        with metrics.phase("serialize"):
+            body = serialize(value, model)
+        # Keep the X- headers compute set (X-Next-After) so hits return them too
+        headers = {header: value for header, value in collected.headers.items() if header.startswith("x-")}
+        headers["ETag"] = f'"{hashlib.sha1(body).hexdigest()}"'
+        if key:
+            with metrics.phase("cache"):
+                await response_cache.set(key, body, headers)
+    headers = {**headers, "Cache-Control": "no-cache"}
+    if headers["ETag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def page_key(page: PageParams) -> dict:
+    return {"after": page.after, "limit": page.limit}
+
 # ============= AUTH =============
 
-@api_router.post("/auth/login", response_model=LoginResponse)
+@public_router.post("/auth/login", response_model=LoginResponse)
 async def login(request: LoginRequest):
     # Universal login credentials
     if request.username == "onefam" and request.password == "Welcome1":
-        token = jwt.encode({"username": request.username}, SECRET_KEY, algorithm=ALGORITHM)
-        return LoginResponse(token=token, message="Login successful")
+        return LoginResponse(**token_verifier.issue_pair(request.username), message="Login successful")
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
+@public_router.post("/auth/refresh", response_model=LoginResponse)
+async def refresh_tokens(request: RefreshRequest):
+    """A new access token (and refresh token) for a valid refresh token"""
+    try:
+        claims = token_verifier.verify(request.refresh_token, auth.REFRESH)
+    except auth.InvalidToken as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    return LoginResponse(**token_verifier.issue_pair(claims["sub"]), message="Token refreshed")
+
 # ============= FAMILIES =============
 
+# A deleted family keeps its document, marked with deleted_at, until its delete job has run
+LIVE_FAMILIES = {"deleted_at": None}
+FAMILY_SHAPE = DocumentShape(Family)
+
+def live_family(family_id: str) -> dict:
+    return {"id": family_id, **LIVE_FAMILIES}
+
 @api_router.get("/families", response_model=List[Family])
-async def get_families():
-    families = await db.families.find({}, {"_id": 0}).to_list(1000)
-    for family in families:
-        if isinstance(family.get('created_at'), str):
-            family['created_at'] = datetime.fromisoformat(family['created_at'])
-    return families
+async def get_families(request: Request, page: PageParams = Depends()):
+    if page.stream:
+        return await list_page(db.families, LIVE_FAMILIES, FAMILY_SHAPE.projection, page, None)
+    return await cached_response(
+        request, FAMILIES_SCOPE, "families", page_key(page),
+        lambda response: list_page(db.families, LIVE_FAMILIES, FAMILY_SHAPE.projection, page, response), FAMILY_SHAPE
+    )
+
+async def find_family(family_id: str) -> dict:
+    family = await db.families.find_one(live_family(family_id), FAMILY_SHAPE.projection)
+    if not family:
+        raise HTTPException(status_code=404, detail="Family not found")
+    return family
+
+async def require_live_family(family_id: str, *reads) -> list:
+    """Results of reads, awaited alongside a check that the family exists and is not deleted (404 otherwise)"""
+    family, *results = await asyncio.gather(db.families.find_one(live_family(family_id), {"_id": 1}), *reads)
+    if not family:
+        raise HTTPException(status_code=404, detail="Family not found")
+    return results
+
+@api_router.get("/families/{family_id}", response_model=Family)
+async def get_family(family_id: str, request: Request):
+    return await cached_response(request, family_id, "family", {}, lambda response: find_family(family_id), FAMILY_SHAPE)
+
+@api_router.get("/families/{family_id}/snapshot", response_model=FamilySnapshot)
+async def get_family_snapshot(family_id: str, request: Request, tz: Optional[str] = None):
+    """Family, members and upcoming alerts in one response, for the family page"""
+    tz = query_timezone(tz)
+    
+    async def snapshot(response):
+        family, members, alerts = await asyncio.gather(
+            db.families.find_one(live_family(family_id), FAMILY_SHAPE.projection),
+            db.family_members.find({"family_id": family_id}, MEMBER_SUMMARY_SHAPE.projection).to_list(None),
+            compute_alerts(family_id, tz),
+        )
+        if not family:
+            raise HTTPException(status_code=404, detail="Family not found")
+        with metrics.phase("compute"):
+            return {
+                "family": FAMILY_SHAPE.fill(family),
+                "members": MEMBER_SUMMARY_SHAPE.fill(members),
+                "alerts": [alert.model_dump() for alert in alerts],
+            }
+    
+    return await cached_response(request, family_id, "snapshot", {"tz": tz, "clock": alert_clock()}, snapshot)
 
 @api_router.post("/families", response_model=Family)
 async def create_family(family_data: FamilyCreate):
     family = Family(**family_data.model_dump())
     doc = family.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.families.insert_one(doc)
+    await response_cache.bump(FAMILIES_SCOPE)
     return family
 
-@api_router.delete("/families/{family_id}")
+@api_router.put("/families/{family_id}", response_model=Family)
+async def update_family(family_id: str, family_data: FamilyUpdate):
+    # Fields sent as null are cleared (e.g. the timezone); omitted fields are left alone
+    update_data = family_data.model_dump(exclude_unset=True)
+    if update_data.get("name") is None:
+        update_data.pop("name", None)
+    if update_data:
+        await db.families.update_one(live_family(family_id), {"$set": update_data})
+        await response_cache.bump(family_id, FAMILIES_SCOPE)
+    return await find_family(family_id)
+
+@api_router.delete("/families/{family_id}", status_code=202)
 async def delete_family(family_id: str):
-    # Delete all members and events of the family first
-    await db.family_members.delete_many({"family_id": family_id})
-    await db.custom_events.delete_many({"family_id": family_id})
-    result = await db.families.delete_one({"id": family_id})
-    if result.deleted_count == 0:
+    """Hide the family at once and queue a job deleting its members, events and photos; poll GET /jobs/{job_id}"""
+    result = await db.families.update_one(live_family(family_id), {"$set": {"deleted_at": datetime.now(timezone.utc)}})
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Family not found")
-    return {"message": "Family deleted successfully"}
+    await response_cache.bump(family_id, FAMILIES_SCOPE)
+    graph_index.drop(family_id)
+    # If this fails the family stays hidden, and the orphan sweep queues the delete
+    job = await cleanup.enqueue_delete(db, family_id)
+    return {"message": "Family deletion started", "job_id": job["id"]}
 
 # ============= FAMILY MEMBERS =============
 
+# Listing the fields also leaves out the inline photo legacy documents may carry until the photo migration has run
+MEMBER_SHAPE = DocumentShape(FamilyMember)
+MEMBER_PROJECTION = MEMBER_SHAPE.projection
+MEMBER_SUMMARY_SHAPE = DocumentShape(FamilyMemberSummary)
+
+async def store_member_photo(member_id: str, family_id: str, photo_base64: str) -> dict:
+    try:
+        return await photo_store.save_base64(member_id, family_id, photo_base64)
+    except InvalidPhoto as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @api_router.get("/families/{family_id}/members", response_model=List[FamilyMember])
-async def get_family_members(family_id: str):
-    members = await db.family_members.find({"family_id": family_id}, {"_id": 0}).to_list(1000)
-    for member in members:
-        if isinstance(member.get('created_at'), str):
-            member['created_at'] = datetime.fromisoformat(member['created_at'])
-    return members
+async def get_family_members(family_id: str, request: Request, page: PageParams = Depends()):
+    query = {"family_id": family_id}
+    
+    async def members(response):
+        [body] = await require_live_family(family_id, list_page(db.family_members, query, MEMBER_PROJECTION, page, response))
+        return body
+    
+    if page.stream:
+        return await members(None)
+    return await cached_response(request, family_id, "members", page_key(page), members, MEMBER_SHAPE)
 
 @api_router.post("/families/{family_id}/members", response_model=FamilyMember)
 async def create_family_member(family_id: str, member_data: FamilyMemberCreate):
     # Verify family exists
-    family = await db.families.find_one({"id": family_id}, {"_id": 0})
+    family = await db.families.find_one(live_family(family_id), {"_id": 0})
     if not family:
         raise HTTPException(status_code=404, detail="Family not found")
     
-    member = FamilyMember(family_id=family_id, **member_data.model_dump())
+    data = member_data.model_dump()
+    photo_base64 = data.pop('photo_base64', None)
+    member = FamilyMember(family_id=family_id, **data)
+    if photo_base64:
+        photo_fields = await store_member_photo(member.id, family_id, photo_base64)
+        member = member.model_copy(update=photo_fields)
     doc = member.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc.update(occurrences.date_parts(doc)[0])
     await db.family_members.insert_one(doc)
+    await occurrences.sync_member(db, doc)
+    await response_cache.bump(family_id)
+    graph_index.upsert_member(family_id, doc)
     return member
 
-@api_router.put("/families/{family_id}/members/{member_id}", response_model=FamilyMember)
-async def update_family_member(family_id: str, member_id: str, member_data: FamilyMemberUpdate):
-    # Get existing member
-    existing = await db.family_members.find_one({"id": member_id, "family_id": family_id}, {"_id": 0})
-    if not existing:
+# Fields an update needs back to keep the calendar index and the graph index current
+MEMBER_SYNC_FIELDS = ("id", "family_id", "first_name", "last_name", "birthday", "anniversary", "father_id", "mother_id")
+MEMBER_REQUIRED_FIELDS = ("first_name", "last_name")
+PHOTO_FIELDS = ("photo_hash", "photo_url", "photo_thumbnail_url", "photo_sizes", "photo_base64")
+
+def member_etag(version: int) -> str:
+    return f'"{version}"'
+
+def if_match_version(if_match: Optional[str]):
+    """The member version an If-Match header asks for, or None when there is no header (or it is *)"""
+    if not if_match or if_match.strip() == "*":
+        return None
+    tag = if_match.split(",")[0].strip().removeprefix("W/").strip('"')
+    if not tag.isdigit():
+        raise HTTPException(status_code=412, detail="If-Match does not name a member version")
+    return int(tag)
+
+async def member_update_failed(family_id: str, member_id: str, expected: int, status_code: int):
+    """Raise 404, or a conflict when the member exists but is no longer at the expected version"""
+    current = await db.family_members.find_one({"id": member_id, "family_id": family_id}, {"_id": 0, "version": 1})
+    if not current:
         raise HTTPException(status_code=404, detail="Member not found")
+    raise HTTPException(
+        status_code=status_code,
+        detail=f"Member was changed by someone else (version {current.get('version', 0)}, expected {expected})",
+        headers={"ETag": member_etag(current.get("version", 0))},
+    )
+
+@api_router.put("/families/{family_id}/members/{member_id}", response_model=FamilyMember)
+async def update_family_member(
+    family_id: str,
+    member_id: str,
+    member_data: FamilyMemberUpdate,
+    response: Response,
+    changed_only: bool = Query(False, description="Return only the id, the version and the fields this update changed"),
+    if_match: Optional[str] = Header(None),
+):
+    """Apply the fields sent in one find_one_and_update; fields sent as null are cleared, omitted ones are left alone"""
+    # A deleted family's rows may not be gone yet; writing to them would bring its calendar rows back
+    await require_live_family(family_id)
+    data = member_data.model_dump(exclude_unset=True)
+    for field in MEMBER_REQUIRED_FIELDS:
+        if field in data and data[field] is None:
+            raise HTTPException(status_code=422, detail=f"{field} cannot be cleared")
     
-    # Update only provided fields
-    update_data = {k: v for k, v in member_data.model_dump().items() if v is not None}
-    if update_data:
-        await db.family_members.update_one({"id": member_id}, {"$set": update_data})
+    # If-Match answers 412 like any conditional request; a version in the body answers 409
+    header_version, body_version = if_match_version(if_match), data.pop("version", None)
+    if header_version is not None and body_version is not None and header_version != body_version:
+        raise HTTPException(status_code=412, detail="If-Match and version name different versions")
+    expected = header_version if header_version is not None else body_version
+    conflict_status = 412 if header_version is not None else 409
+    query = {"id": member_id, "family_id": family_id}
+    if expected is not None:
+        query["version"] = expected if expected else {"$in": [0, None]}
+    
+    changes, cleared = {}, []
+    photo_base64 = data.pop("photo_base64", "")
+    if photo_base64:
+        # The upload replaces the stored photo, so only make it once the update is known to apply
+        if not await db.family_members.find_one(query, {"_id": 1}):
+            await member_update_failed(family_id, member_id, expected, conflict_status)
+        changes.update(await store_member_photo(member_id, family_id, photo_base64))
+        cleared.append("photo_base64")
+    elif photo_base64 is None:
+        cleared.extend(PHOTO_FIELDS)
+    changes.update((field, value) for field, value in data.items() if value is not None)
+    cleared.extend(field for field, value in data.items() if value is None)
+    
+    changed = [field for field in (*changes, *cleared) if field != "photo_base64"]
+    parts, cleared_parts = occurrences.date_parts(data)
+    changes.update(parts)
+    cleared.extend(cleared_parts)
+    if changed_only:
+        projection = {"_id": 0, "version": 1, **{field: 1 for field in (*MEMBER_SYNC_FIELDS, *changed)}}
+    else:
+        projection = MEMBER_PROJECTION
+    if changes or cleared:
+        update = {"$inc": {"version": 1}}
+        if changes:
+            update["$set"] = changes
+        if cleared:
+            update["$unset"] = {field: "" for field in cleared}
+        updated = await db.family_members.find_one_and_update(query, update, projection, return_document=ReturnDocument.AFTER)
+    else:
+        updated = await db.family_members.find_one(query, projection)
+    if not updated:
+        await member_update_failed(family_id, member_id, expected, conflict_status)
+    
+    if photo_base64 is None:
+        await photo_store.delete(member_id)
+    if any(field in data for field in occurrences.MEMBER_FIELDS):
+        await occurrences.sync_member(db, updated)
+    if "father_id" in data or "mother_id" in data:
+        graph_index.upsert_member(family_id, updated)
+    await response_cache.bump(family_id)
     
-    # Return updated member
-    updated = await db.family_members.find_one({"id": member_id}, {"_id": 0})
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
+    etag = member_etag(updated.get("version", 0))
+    if changed_only:
+        body = {"id": member_id, "version": updated.get("version", 0), **{field: updated.get(field) for field in changed}}
+        return JSONResponse(body, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return FamilyMember(**updated)
 
 @api_router.delete("/families/{family_id}/members/{member_id}")
 async def delete_family_member(family_id: str, member_id: str):
+    await require_live_family(family_id)
     result = await db.family_members.delete_one({"id": member_id, "family_id": family_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Member not found")
+    await occurrences.remove_source(db, family_id, member_id)
+    await photo_store.delete(member_id)
+    await response_cache.bump(family_id)
+    graph_index.remove_member(family_id, member_id)
     return {"message": "Member deleted successfully"}
 
+@api_router.get("/families/{family_id}/tree")
+async def get_family_tree(family_id: str, request: Request):
+    """Precomputed tree layout: roots, generations, ordered children, couples, plus any cycles or dangling parents"""
+    async def tree(response):
+        with metrics.phase("db"):
+            family, members = await asyncio.gather(
+                db.families.find_one(live_family(family_id), {"_id": 1}),
+                db.family_members.find({"family_id": family_id}, family_tree.TREE_PROJECTION).to_list(None),
+            )
+        if not family:
+            raise HTTPException(status_code=404, detail="Family not found")
+        with metrics.phase("compute"):
+            return {"family_id": family_id, **family_tree.build_tree(members)}
+    
+    return await cached_response(request, family_id, "tree", {}, tree)
+
+# ============= MEMBER IMPORT =============
+
+def validated(model, fields: dict, exclude_unset: bool = False) -> dict:
+    """fields validated by model, with a one-line ValueError instead of a ValidationError"""
+    try:
+        return model(**fields).model_dump(exclude_unset=exclude_unset)
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{'.'.join(map(str, error['loc'])) or 'row'}: {error['msg']}" for error in e.errors()))
+
+def imported_created_at(fields: dict) -> dict:
+    # Exports carry created_at; rows without one (CSV, GEDCOM) are created now
+    return {"created_at": fields["created_at"]} if fields.get("created_at") else {}
+
+async def imported_member(family_id: str, member_id: str, fields: dict) -> dict:
+    """Member document for one imported row; raises ValueError with a short message when the row is invalid"""
+    data = validated(FamilyMemberCreate, fields)
+    photo_base64 = data.pop("photo_base64", None)
+    member = validated(FamilyMember, {"id": member_id, "family_id": family_id, **data, **imported_created_at(fields)})
+    if photo_base64:
+        try:
+            member.update(await photo_store.save_base64(member_id, family_id, photo_base64))
+        except InvalidPhoto as e:
+            raise ValueError(f"photo_base64: {str(e)}")
+    member.update(occurrences.date_parts(member)[0])
+    return member
+
+async def imported_event(family_id: str, event_id: str, fields: dict) -> dict:
+    data = validated(CustomEventCreate, fields)
+    event = validated(CustomEvent, {"id": event_id, "family_id": family_id, **data, **imported_created_at(fields)})
+    event.update(occurrences.date_parts(event)[0])
+    return event
+
+async def imported_family(family_id: str, fields: dict):
+    """Apply the name and timezone of an export's family line; a null timezone is cleared, a null name is ignored"""
+    data = validated(FamilyUpdate, fields, exclude_unset=True)
+    if data.get("name") is None:
+        data.pop("name", None)
+    if data:
+        await db.families.update_one(live_family(family_id), {"$set": data})
+        await response_cache.bump(family_id, FAMILIES_SCOPE)
+
+@api_router.post("/families/{family_id}/import")
+async def import_family_members(
+    family_id: str,
+    request: Request,
+    file_format: Optional[str] = Query(None, alias="format", pattern="^(csv|gedcom|ndjson)$"),
+):
+    """Add members from a CSV, GEDCOM or NDJSON export file (optionally gzipped) sent as the request body,
+    parsed as it streams in.
+    
+    Returns a report with counts and row-level errors; rows that fail do not stop the others.
+    """
+    await find_family(family_id)
+    try:
+        file_format, chunks = await member_import.open_upload(request.stream(), request.headers.get("content-type"), file_format)
+    except member_import.InvalidImport as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    report = await member_import.import_members(
+        db, family_id, chunks, file_format,
+        lambda member_id, fields: imported_member(family_id, member_id, fields),
+        lambda event_id, fields: imported_event(family_id, event_id, fields),
+        lambda fields: imported_family(family_id, fields),
+    )
+    if report["imported"]:
+        await occurrences.rebuild(db, family_id)
+        await response_cache.bump(family_id)
+        graph_index.drop(family_id)
+    elif report["events_imported"]:
+        await occurrences.rebuild(db, family_id)
+        await response_cache.bump(family_id)
+    elif report["stopped"] and not report["family_updated"]:
+        raise HTTPException(status_code=400, detail=report["stopped"])
+    return report
+
+@api_router.get("/families/{family_id}/export")
+async def export_family(
+    family_id: str,
+    file_format: str = Query(family_export.NDJSON, alias="format", pattern="^(ndjson|json|gedcom)$"),
+    photos: bool = False,
+    compress: bool = False,
+):
+    """Stream the family's members and custom events as NDJSON (the backup format, see import), JSON or GEDCOM.
+    
+    photos=true embeds each original photo; compress=true sends a .gz file.
+    """
+    family = await find_family(family_id)
+    filename = f"{family['name'] or 'family'}.{family_export.EXTENSIONS[file_format]}"
+    media_type = family_export.MEDIA_TYPES[file_format]
+    if compress:
+        filename, media_type = filename + ".gz", "application/gzip"
+    return StreamingResponse(
+        family_export.export_family(db, family, file_format, photo_store if photos else None, compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+    )
+
+# ============= RELATIONSHIPS =============
+
+async def get_family_graph(family_id: str, *member_ids: str):
+    # Checked first: building the graph of a deleted family would cache it again
+    await require_live_family(family_id)
+    graph = await graph_index.get(family_id)
+    for member_id in member_ids:
+        if member_id not in graph:
+            raise HTTPException(status_code=404, detail="Member not found")
+    return graph
+
+def depth_list(depths: dict):
+    return [{"id": member_id, "depth": depth} for member_id, depth in sorted(depths.items(), key=lambda item: (item[1], item[0]))]
+
+@api_router.get("/families/{family_id}/members/{member_id}/ancestors")
+async def get_member_ancestors(family_id: str, member_id: str, max_depth: Optional[int] = Query(None, ge=1)):
+    graph = await get_family_graph(family_id, member_id)
+    return depth_list(graph.ancestors(member_id, max_depth))
+
+@api_router.get("/families/{family_id}/members/{member_id}/descendants")
+async def get_member_descendants(family_id: str, member_id: str, max_depth: Optional[int] = Query(None, ge=1)):
+    graph = await get_family_graph(family_id, member_id)
+    return depth_list(graph.descendants(member_id, max_depth))
+
+@api_router.get("/families/{family_id}/common-ancestors")
+async def get_common_ancestors(family_id: str, a: str, b: str):
+    """Common ancestors of members a and b; 'lowest' are those with no common ancestor below them"""
+    graph = await get_family_graph(family_id, a, b)
+    common, lowest = graph.common_ancestors(a, b)
+    return {
+        "common_ancestors": [
+            {"id": member_id, "a_depth": a_depth, "b_depth": b_depth}
+            for member_id, (a_depth, b_depth) in sorted(common.items(), key=lambda item: (sum(item[1]), item[0]))
+        ],
+        "lowest": lowest,
+    }
+
+@api_router.get("/families/{family_id}/relationship")
+async def get_relationship(family_id: str, a: str, b: str):
+    """How member a is related to member b (label is None when they are not related)"""
+    graph = await get_family_graph(family_id, a, b)
+    return {"a": a, "b": b, **graph.relationship(a, b)}
+
+# ============= MEMBER PHOTOS =============
+
+@public_router.get("/members/{member_id}/photo")
+async def get_member_photo(member_id: str, request: Request, size: Optional[int] = None):
+    """Stream a member photo, or one of its thumbnails, from the photo store (supports ETag and Range requests)"""
+    if size is not None and size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {list(THUMBNAIL_SIZES)}")
+    grid_out = await photo_store.open(member_id, size)
+    if grid_out is None:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    
+    metadata = grid_out.metadata or {}
+    etag = f'"{metadata.get("sha256", "")}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # Photo URLs carry the content hash, so a given URL never changes
+        "Cache-Control": "public, max-age=31536000, immutable" if request.query_params.get("v") else "no-cache",
+        # Served without a login: browsers must not sniff the bytes into something they would render
+        "X-Content-Type-Options": "nosniff",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    content_type = metadata.get("content_type")
+    if content_type not in PHOTO_CONTENT_TYPES:
+        # Stored before uploads were checked
+        content_type = "application/octet-stream"
+    length = grid_out.length
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = parse_range(range_header, length)
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{length}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(iter_grid_out(grid_out, start, end), status_code=206, media_type=content_type, headers=headers)
+    
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(iter_grid_out(grid_out), media_type=content_type, headers=headers)
+
 # ============= CUSTOM EVENTS =============
 
+EVENT_SHAPE = DocumentShape(CustomEvent)
+
 @api_router.get("/families/{family_id}/events", response_model=List[CustomEvent])
-async def get_custom_events(family_id: str, month: Optional[int] = None, year: Optional[int] = None):
+async def get_custom_events(
+    family_id: str,
+    request: Request,
+    month: Optional[int] = Query(None, ge=1, le=12),
+    year: Optional[int] = Query(None, ge=1, le=9998),
+    page: PageParams = Depends(),
+):
     query = {"family_id": family_id}
-    events = await db.custom_events.find(query, {"_id": 0}).to_list(1000)
-    
-    # Filter by month/year if provided
-    if month or year:
-        filtered_events = []
-        for event in events:
-            event_date = datetime.strptime(event['event_date'], '%Y-%m-%d')
-            if month and event_date.month != month:
-                continue
-            if year and event_date.year != year:
-                continue
-            filtered_events.append(event)
-        events = filtered_events
     
-    for event in events:
-        if isinstance(event.get('created_at'), str):
-            event['created_at'] = datetime.fromisoformat(event['created_at'])
-    return events
+    # Filter on the stored date parts in the query, so pages stay consistent
+    if year:
+        query["event_on"] = {"$gte": datetime(year, 1, 1, tzinfo=timezone.utc), "$lt": datetime(year + 1, 1, 1, tzinfo=timezone.utc)}
+    if month:
+        query["event_month"] = month
+    
+    async def events(response):
+        [body] = await require_live_family(family_id, list_page(db.custom_events, query, EVENT_SHAPE.projection, page, response))
+        return body
+    
+    if page.stream:
+        return await events(None)
+    return await cached_response(
+        request, family_id, "events", {"month": month, "year": year, **page_key(page)}, events, EVENT_SHAPE
+    )
 
 @api_router.post("/families/{family_id}/events", response_model=CustomEvent)
 async def create_custom_event(family_id: str, event_data: CustomEventCreate):
     # Verify family exists
-    family = await db.families.find_one({"id": family_id}, {"_id": 0})
+    family = await db.families.find_one(live_family(family_id), {"_id": 0})
     if not family:
         raise HTTPException(status_code=404, detail="Family not found")
     
     event = CustomEvent(family_id=family_id, **event_data.model_dump())
     doc = event.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc.update(occurrences.date_parts(doc)[0])
     await db.custom_events.insert_one(doc)
+    await occurrences.sync_event(db, doc)
+    await response_cache.bump(family_id)
     return event
 
 @api_router.delete("/families/{family_id}/events/{event_id}")
 async def delete_custom_event(family_id: str, event_id: str):
+    await require_live_family(family_id)
     result = await db.custom_events.delete_one({"id": event_id, "family_id": family_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Event not found")
+    await occurrences.remove_source(db, family_id, event_id)
+    await response_cache.bump(family_id)
     return {"message": "Event deleted successfully"}
 
-# ============= ALERTS =============
+# ============= BATCH =============
 
-@api_router.get("/families/{family_id}/alerts", response_model=List[Alert])
-async def get_alerts(family_id: str):
-    alerts = []
-    today = datetime.now(timezone.utc)
+# One request for many member/event changes. The whole batch is validated
+# against the family first (targets and parent/member references must exist
+# at that point in the batch). It is then written with one ordered bulk_write
+# per collection, optionally inside a transaction. Members are written before
+# events, so an event may not point at a member the batch deletes after it.
+BATCH_MODELS = {
+    ("member", "create"): FamilyMemberCreate,
+    ("member", "update"): FamilyMemberUpdate,
+    ("event", "create"): CustomEventCreate,
+    ("event", "update"): CustomEventUpdate,
+}
+BATCH_REFERENCES = {"member": ("father_id", "mother_id"), "event": ("member_id",)}
+BATCH_REQUIRED = {"member": ("first_name", "last_name"), "event": ("event_name", "event_date")}
+
+class BatchConflict(Exception):
+    """A versioned update matched nothing when written: the member changed after the batch was planned"""
+
+class BatchPlan:
+    """Validated writes for a batch: results[i] describes operations[i]; writes hold (index, write) per collection"""
+    
+    def __init__(self, family_id: str, existing: dict, versions: dict):
+        self.family_id = family_id
+        self.existing = existing  # {"member": ids, "event": ids} as they will be at this point in the batch
+        self.versions = versions  # Member versions, likewise
+        self.refs = {}
+        self.results = []
+        self.writes = {"member": [], "event": []}
+        self.deleted = {"member": set(), "event": set()}
+        self.event_members = {}  # {member id: indexes of the event operations that set it as member_id}
+        self.expected = {}  # {index: version} for the updates sent with a version
+        self.valid = True
     
-    # Get all family members
-    members = await db.family_members.find({"family_id": family_id}, {"_id": 0}).to_list(1000)
+    def resolve(self, value):
+        return self.refs.get(value, value)
+    
+    def check_references(self, kind: str, target: str, data: dict):
+        for field in BATCH_REFERENCES[kind]:
+            if data.get(field) is None:
+                continue
+            data[field] = self.resolve(data[field])
+            if data[field] not in self.existing["member"]:
+                raise ValueError(f"{field} '{data[field]}' is not a member of this family")
+            if data[field] == target:
+                raise ValueError(f"{field} cannot be the member itself")
+    
+    def note_event_member(self, kind: str, index: int, data: dict):
+        if kind == "event" and data.get("member_id") is not None:
+            self.event_members.setdefault(data["member_id"], []).append(index)
+    
+    def add(self, index: int, operation: BatchOperation):
+        result = {"index": index, "op": operation.op, "type": operation.type, "id": operation.id}
+        try:
+            result.update(self._plan(index, operation))
+        except ValueError as e:
+            self.valid = False
+            result.update(status="invalid", error=str(e))
+        self.results.append(result)
     
-    for member in members:
-        member_name = f"{member.get('first_name', '')} {member.get('last_name', '')}"
+    def stop(self, applied: set, failed: int, status: str, error: str):
+        """Mark operation failed as not applied, with status, and every operation after it as skipped"""
+        for result in self.results:
+            if result["index"] == failed:
+                result.update(status=status, error=error)
+            elif result["index"] not in applied and result["status"] not in ("failed", "conflict"):
+                result.update(status="skipped")
+    
+    def _plan(self, index: int, operation: BatchOperation) -> dict:
+        kind = operation.type
+        if operation.op == "create":
+            if operation.id:
+                raise ValueError("ids are assigned on create; use ref to refer to the new record")
+            if operation.ref and operation.ref in self.refs:
+                raise ValueError(f"ref '{operation.ref}' is used twice")
+            if operation.data.get("photo_base64"):
+                raise ValueError("photos cannot be set in a batch; use the member endpoints")
+            data = validated(BATCH_MODELS[kind, "create"], operation.data)
+            data.pop("photo_base64", None)
+            doc = (FamilyMember if kind == "member" else CustomEvent)(family_id=self.family_id, **data).model_dump()
+            self.check_references(kind, doc["id"], doc)
+            self.note_event_member(kind, index, doc)
+            doc.update(occurrences.date_parts(doc)[0])
+            self.writes[kind].append((index, InsertOne(doc)))
+            self.existing[kind].add(doc["id"])
+            if kind == "member":
+                self.versions[doc["id"]] = doc["version"]
+            if operation.ref:
+                self.refs[operation.ref] = doc["id"]
+            return {"status": "created", "id": doc["id"], "ref": operation.ref}
         
-        # Check birthday
-        if member.get('birthday'):
-            try:
-                bday = datetime.strptime(member['birthday'], '%Y-%m-%d')
-                # Get this year's birthday
-                this_year_bday = bday.replace(year=today.year)
-                if this_year_bday < today:
-                    this_year_bday = bday.replace(year=today.year + 1)
-                
-                days_until = (this_year_bday - today).days
-                if 0 <= days_until <= 30:  # Alert for next 30 days
-                    alerts.append(Alert(
-                        type="birthday",
-                        title=f"{member_name}'s Birthday",
-                        date=this_year_bday.strftime('%Y-%m-%d'),
-                        member_name=member_name,
-                        days_until=days_until
-                    ))
-            except:
-                pass
+        target = self.resolve(operation.id)
+        if not target or target not in self.existing[kind]:
+            raise ValueError(f"{kind.capitalize()} not found")
+        if operation.op == "delete":
+            self.writes[kind].append((index, DeleteOne({"family_id": self.family_id, "id": target})))
+            self.existing[kind].discard(target)
+            self.deleted[kind].add(target)
+            # Members are written first, so the member would be gone before these events are written
+            for event_index in self.event_members.pop(target, []):
+                self.valid = False
+                self.results[event_index].update(status="invalid", error=f"member_id '{target}' is deleted later in this batch (operation {index})")
+            return {"status": "deleted", "id": target}
         
-        # Check anniversary
-        if member.get('anniversary'):
-            try:
-                anniv = datetime.strptime(member['anniversary'], '%Y-%m-%d')
-                this_year_anniv = anniv.replace(year=today.year)
-                if this_year_anniv < today:
-                    this_year_anniv = anniv.replace(year=today.year + 1)
-                
-                days_until = (this_year_anniv - today).days
-                if 0 <= days_until <= 30:
-                    alerts.append(Alert(
-                        type="anniversary",
-                        title=f"{member_name}'s Anniversary",
-                        date=this_year_anniv.strftime('%Y-%m-%d'),
-                        member_name=member_name,
-                        days_until=days_until
-                    ))
-            except:
-                pass
+        # Update: fields sent as null are cleared, omitted fields are left alone
+        data = validated(BATCH_MODELS[kind, "update"], operation.data, exclude_unset=True)
+        data.pop("photo_base64", None)
+        expected = data.pop("version", None)
+        if not data:
+            raise ValueError("Nothing to update")
+        if expected is not None and expected != self.versions.get(target, 0):
+            raise ValueError(f"Member was changed by someone else (version {self.versions.get(target, 0)}, expected {expected})")
+        for field in BATCH_REQUIRED[kind]:
+            if field in data and data[field] is None:
+                raise ValueError(f"{field} cannot be cleared")
+        self.check_references(kind, target, data)
+        self.note_event_member(kind, index, data)
+        update = {}
+        if any(value is not None for value in data.values()):
+            update["$set"] = {field: value for field, value in data.items() if value is not None}
+        if any(value is None for value in data.values()):
+            update["$unset"] = {field: "" for field, value in data.items() if value is None}
+        parts, cleared = occurrences.date_parts(data)
+        if parts:
+            update.setdefault("$set", {}).update(parts)
+        if cleared:
+            update.setdefault("$unset", {}).update(dict.fromkeys(cleared, ""))
+        if kind == "event":
+            self.writes[kind].append((index, UpdateOne({"family_id": self.family_id, "id": target}, update)))
+            return {"status": "updated", "id": target}
+        update["$inc"] = {"version": 1}
+        self.versions[target] = self.versions.get(target, 0) + 1
+        query = {"family_id": self.family_id, "id": target}
+        if expected is not None:
+            query["version"] = expected if expected else {"$in": [0, None]}
+            self.expected[index] = expected
+        self.writes[kind].append((index, UpdateOne(query, update)))
+        return {"status": "updated", "id": target, "version": self.versions[target]}
+
+async def plan_batch(family_id: str, operations: List[BatchOperation]) -> BatchPlan:
+    """Validate every operation against the family in two queries"""
+    wanted = {"member": set(), "event": set()}
+    for operation in operations:
+        if operation.id:
+            wanted[operation.type].add(operation.id)
+        for field in BATCH_REFERENCES[operation.type]:
+            if isinstance(operation.data.get(field), str):
+                wanted["member"].add(operation.data[field])
+    members, events = await asyncio.gather(
+        db.family_members.find({"family_id": family_id, "id": {"$in": list(wanted["member"])}}, {"_id": 0, "id": 1, "version": 1}).to_list(None),
+        db.custom_events.find({"family_id": family_id, "id": {"$in": list(wanted["event"])}}, {"_id": 0, "id": 1}).to_list(None),
+    )
+    plan = BatchPlan(
+        family_id,
+        {"member": {doc["id"] for doc in members}, "event": {doc["id"] for doc in events}},
+        {doc["id"]: doc.get("version", 0) for doc in members},
+    )
+    for index, operation in enumerate(operations):
+        plan.add(index, operation)
+    return plan
+
+def batch_chunks(writes: list, versioned: dict):
+    """Split writes into runs for bulk_write, each versioned update in a run of its own"""
+    chunk = []
+    for write in writes:
+        if write[0] not in versioned:
+            chunk.append(write)
+            continue
+        if chunk:
+            yield chunk
+        yield [write]
+        chunk = []
+    if chunk:
+        yield chunk
+
+async def write_batch(plan: BatchPlan, session=None):
+    """Ordered bulk_writes per collection; on failure, marks the failed operation and the ones not applied.
     
-    # Check custom events
-    events = await db.custom_events.find({"family_id": family_id}, {"_id": 0}).to_list(1000)
-    for event in events:
-        try:
-            event_date = datetime.strptime(event['event_date'], '%Y-%m-%d')
-            days_until = (event_date - today).days
-            if 0 <= days_until <= 30:
-                alerts.append(Alert(
-                    type="custom",
-                    title=event['event_name'],
-                    date=event['event_date'],
-                    member_name=None,
-                    days_until=days_until
-                ))
-        except:
-            pass
-    
-    # Sort by days_until
-    alerts.sort(key=lambda x: x.days_until)
-    return alerts
+    A versioned update is written on its own so that one matching nothing, because the member changed
+    since the batch was planned, can be reported as a conflict (BatchConflict) rather than as applied.
+    """
+    applied = set()
+    for kind, collection in (("member", db.family_members), ("event", db.custom_events)):
+        for chunk in batch_chunks(plan.writes[kind], plan.expected):
+            try:
+                result = await collection.bulk_write([write for _, write in chunk], ordered=True, session=session)
+            except BulkWriteError as e:
+                error = e.details["writeErrors"][0]
+                applied.update(index for index, _ in chunk[:error["index"]])
+                plan.stop(applied, chunk[error["index"]][0], "failed", error.get("errmsg", "Write failed"))
+                raise
+            index = chunk[0][0]
+            if index in plan.expected and not result.matched_count:
+                plan.stop(applied, index, "conflict", f"Member was changed by someone else (expected version {plan.expected[index]})")
+                raise BatchConflict()
+            applied.update(index for index, _ in chunk)
 
-# ============= EMAIL NOTIFICATIONS =============
+async def sync_batch(family_id: str, plan: BatchPlan):
+    """Bring occurrences, photos, the graph and the cache up to date with whatever the batch wrote"""
+    written = {"member": set(), "event": set()}
+    for result in plan.results:
+        if result["status"] in ("created", "updated"):
+            written[result["type"]].add(result["id"])
+    deleted = [result["id"] for result in plan.results if result["status"] == "deleted"]
+    members, events = await asyncio.gather(
+        db.family_members.find({"family_id": family_id, "id": {"$in": list(written["member"])}}, occurrences.MEMBER_FIELDS).to_list(None),
+        db.custom_events.find({"family_id": family_id, "id": {"$in": list(written["event"])}}, {"_id": 0}).to_list(None),
+    )
+    await occurrences.sync_many(db, members, events)
+    if deleted:
+        await occurrences.remove_sources(db, family_id, deleted)
+    for result in plan.results:
+        if result["status"] == "deleted" and result["type"] == "member":
+            await photo_store.delete(result["id"])
+    graph_index.drop(family_id)
+    await response_cache.bump(family_id)
 
-async def send_email_notification(to_email: str, subject: str, content: str):
-    """Send email notification using SendGrid"""
-    sendgrid_key = os.getenv('SENDGRID_API_KEY')
-    sender_email = os.getenv('SENDER_EMAIL', 'noreply@onefam.com')
+@api_router.post("/families/{family_id}/batch")
+async def batch_family_changes(family_id: str, batch: BatchRequest):
+    """Create, update and delete members and events in one request; returns a result per operation.
     
-    if not sendgrid_key:
-        logging.warning("SendGrid API key not configured")
-        return False
+    Later operations may use the ref of a member created earlier in the batch as its id or as a
+    father_id/mother_id/member_id. Nothing is written unless every operation is valid. With
+    transaction=true the writes commit or roll back together (needs a replica set); otherwise a
+    failed write leaves the operations before it applied. An update sent with a version is written
+    only if the member is still at that version; otherwise its result has status "conflict".
+    """
+    await find_family(family_id)
+    plan = await plan_batch(family_id, batch.operations)
+    if not plan.valid:
+        return JSONResponse(status_code=422, content={"applied": False, "results": plan.results})
     
     try:
-        message = Mail(
-            from_email=sender_email,
-            to_emails=to_email,
-            subject=subject,
-            html_content=content
-        )
-        sg = SendGridAPIClient(sendgrid_key)
-        response = sg.send(message)
-        return response.status_code == 202
-    except Exception as e:
-        logging.error(f"Failed to send email to {to_email}: {str(e)}")
-        return False
+        if batch.transaction:
+            async with await client.start_session() as session:
+                await session.with_transaction(lambda session: write_batch(plan, session))
+        else:
+            await write_batch(plan)
+    except (BulkWriteError, BatchConflict):
+        if batch.transaction:
+            for result in plan.results:
+                if result["status"] not in ("failed", "conflict"):
+                    result["status"] = "skipped"
+        else:
+            await sync_batch(family_id, plan)
+        return JSONResponse(status_code=409, content={"applied": False, "results": plan.results})
+    except OperationFailure as e:
+        if batch.transaction and e.code in (20, 263):
+            raise HTTPException(status_code=400, detail="Transactions need MongoDB to run as a replica set")
+        raise
+    
+    await sync_batch(family_id, plan)
+    return {"applied": True, "results": plan.results}
 
-@api_router.post("/families/{family_id}/send-alerts")
-async def send_alert_emails(family_id: str, background_tasks: BackgroundTasks):
-    """Send email alerts to all family members with emails (1 day before events)"""
-    today = datetime.now(timezone.utc)
-    tomorrow = today + timedelta(days=1)
+# ============= ALERTS =============
+
+ALERT_WINDOW_DAYS = 30
+
+def query_timezone(tz: Optional[str]) -> Optional[str]:
+    try:
+        return timezones.validate(tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def compute_alerts(family_id: str, tz: Optional[str] = None) -> List[Alert]:
+    """Alerts counted from today in tz, or in the family's timezone when tz is not given; 404 for a deleted family"""
+    with metrics.phase("db"):
+        # Looked up even with tz: a deleted family keeps its calendar rows until its delete job has run
+        family = await db.families.find_one(live_family(family_id), {"_id": 0, "timezone": 1})
+        if not family:
+            raise HTTPException(status_code=404, detail="Family not found")
+        tz = tz or family.get("timezone")
+        today = timezones.local_today(timezones.resolve(tz))
+        # Only the occurrences in the next 30 days are read, however large the family is
+        upcoming = await occurrences.upcoming(db, family_id, today, ALERT_WINDOW_DAYS)
     
-    # Get all family members with emails
-    members = await db.family_members.find({"family_id": family_id}, {"_id": 0}).to_list(1000)
-    member_emails = [m['email'] for m in members if m.get('email')]
+    with metrics.phase("compute"):
+        alerts = []
+        for row, occurrence in upcoming:
+            alerts.append(Alert(
+                type=row['kind'],
+                title=row['title'],
+                date=occurrence.strftime('%Y-%m-%d'),
+                member_name=row.get('member_name'),
+                days_until=(occurrence - today).days
+            ))
+    return alerts
+
+@api_router.get("/families/{family_id}/alerts", response_model=List[Alert])
+async def get_alerts(family_id: str, request: Request, tz: Optional[str] = None):
+    """Upcoming alerts; ?tz= (the viewer's timezone) overrides the family's for days_until"""
+    tz = query_timezone(tz)
+    return await cached_response(
+        request, family_id, "alerts", {"tz": tz, "clock": alert_clock()},
+        lambda response: compute_alerts(family_id, tz), List[Alert]
+    )
+
+# ============= EMAIL NOTIFICATIONS =============
+
+@api_router.post("/families/{family_id}/send-alerts")
+async def send_alert_emails(family_id: str):
+    """Queue email alerts to all family members with emails (1 day before events); worker.py sends them"""
+    family, members = await asyncio.gather(
+        db.families.find_one(live_family(family_id), {"_id": 0, "timezone": 1}),
+        db.family_members.find(
+            {"family_id": family_id, "email": {"$nin": [None, ""]}}, {"_id": 0, "email": 1, "timezone": 1}
+        ).to_list(None),
+    )
     
-    if not member_emails:
+    if not family:
+        raise HTTPException(status_code=404, detail="Family not found")
+    if not members:
         raise HTTPException(status_code=400, detail="No family members have email addresses")
     
-    alerts_to_send = []
+    # "Tomorrow" is local to each recipient, so members in different timezones may get different digests
+    recipients_by_day = {}
+    for m in members:
+        tomorrow = timezones.local_today(timezones.resolve(m.get('timezone'), family.get('timezone'))) + timedelta(days=1)
+        recipients_by_day.setdefault(tomorrow, {})[m['email']] = None
     
-    for member in members:
-        member_name = f"{member.get('first_name', '')} {member.get('last_name', '')}"
-        
-        # Check birthday (tomorrow)
-        if member.get('birthday'):
-            try:
-                bday = datetime.strptime(member['birthday'], '%Y-%m-%d')
-                this_year_bday = bday.replace(year=today.year)
-                if this_year_bday.date() == tomorrow.date():
-                    alerts_to_send.append({
-                        'type': 'Birthday',
-                        'name': member_name,
-                        'date': this_year_bday.strftime('%B %d, %Y')
-                    })
-            except:
-                pass
-        
-        # Check anniversary (tomorrow)
-        if member.get('anniversary'):
-            try:
-                anniv = datetime.strptime(member['anniversary'], '%Y-%m-%d')
-                this_year_anniv = anniv.replace(year=today.year)
-                if this_year_anniv.date() == tomorrow.date():
-                    alerts_to_send.append({
-                        'type': 'Anniversary',
-                        'name': member_name,
-                        'date': this_year_anniv.strftime('%B %d, %Y')
-                    })
-            except:
-                pass
+    member_emails = set()
+    event_keys = set()
+    delivery_ids = []
+    for tomorrow, recipients in sorted(recipients_by_day.items()):
+        alerts_to_send = [
+            reminders.alert(row, occurrence)
+            for row, occurrence in await occurrences.upcoming(db, family_id, tomorrow, 0)
+        ]
+        if alerts_to_send:
+            job = await reminders.enqueue(db, family_id, tomorrow, alerts_to_send, list(recipients))
+            delivery_ids.append(job["id"])
+            member_emails.update(recipients)
+            event_keys.update(alert['key'] for alert in alerts_to_send)
     
-    # Check custom events (tomorrow)
-    events = await db.custom_events.find({"family_id": family_id}, {"_id": 0}).to_list(1000)
-    for event in events:
-        try:
-            event_date = datetime.strptime(event['event_date'], '%Y-%m-%d')
-            if event_date.date() == tomorrow.date():
-                alerts_to_send.append({
-                    'type': 'Event',
-                    'name': event['event_name'],
-                    'date': event_date.strftime('%B %d, %Y')
-                })
-        except:
-            pass
-    
-    if alerts_to_send:
-        # Build email content
-        email_content = "<html><body style='font-family: Arial, sans-serif;'><h2 style='color: #2C4F42;'>Upcoming Events Reminder</h2><p>The following events are happening tomorrow:</p><ul style='list-style-type: none; padding: 0;'>"
-        for alert in alerts_to_send:
-            email_content += f"<li style='margin: 10px 0; padding: 10px; background: #F5F2EB; border-left: 4px solid #C86B53;'><strong style='color: #2C4F42;'>{alert['type']}</strong>: {alert['name']} on {alert['date']}</li>"
-        email_content += "</ul><p style='color: #78716C;'>Don't forget to celebrate!</p><p style='font-size: 12px; color: #78716C;'>- OneFam Family Tree</p></body></html>"
-        
-        # Send email to all members in background
-        for email in member_emails:
-            background_tasks.add_task(
-                send_email_notification,
-                email,
-                "OneFam - Upcoming Events Reminder",
-                email_content
-            )
-        
+    if delivery_ids:
         return {
-            "message": f"Email notification queued for {len(alerts_to_send)} event(s) to {len(member_emails)} family member(s)",
+            "message": f"Email notification queued for {len(event_keys)} event(s) to {len(member_emails)} family member(s)",
             "recipients": len(member_emails),
-            "events": len(alerts_to_send)
+            "events": len(event_keys),
+            "delivery_id": delivery_ids[0],
+            "delivery_ids": delivery_ids
         }
     
     return {"message": "No events happening tomorrow"}
 
+@api_router.get("/families/{family_id}/email-deliveries/{delivery_id}")
+async def get_email_delivery(family_id: str, delivery_id: str):
+    """Status of a send-alerts job: attempts, last error and the result of every SendGrid call"""
+    job = await db.jobs.find_one(
+        {"family_id": family_id, "id": delivery_id, "kind": reminders.KIND},
+        {"_id": 0, "payload": 0, "locked_by": 0, "locked_until": 0}
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Delivery not found")
+    return job
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, attempts, last error and result of any background job; a running family delete reports its progress in result"""
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0, "payload": 0, "locked_by": 0, "locked_until": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # ============= EVENTS BY MONTH/YEAR =============
 
 @api_router.get("/families/{family_id}/events-calendar")
-async def get_events_calendar(family_id: str, month: Optional[int] = None, year: Optional[int] = None):
+async def get_events_calendar(family_id: str, request: Request, month: Optional[int] = None, year: Optional[int] = None):
     """Get all birthdays, anniversaries, and custom events for a specific month/year"""
-    events_list = []
-    
-    # Get all family members
-    members = await db.family_members.find({"family_id": family_id}, {"_id": 0}).to_list(1000)
+    return await cached_response(
+        request, family_id, "calendar", {"month": month, "year": year},
+        lambda response: compute_events_calendar(family_id, month, year)
+    )
+
+async def compute_events_calendar(family_id: str, month: Optional[int], year: Optional[int]) -> list:
+    query = {"family_id": family_id}
+    if month:
+        query["month"] = month
+    if year:
+        query["year"] = year
     
-    for member in members:
-        member_name = f"{member.get('first_name', '')} {member.get('last_name', '')}"
-        
-        # Birthdays
-        if member.get('birthday'):
-            try:
-                bday = datetime.strptime(member['birthday'], '%Y-%m-%d')
-                if (not month or bday.month == month) and (not year or bday.year == year):
-                    events_list.append({
-                        'type': 'birthday',
-                        'title': f"{member_name}'s Birthday",
-                        'date': member['birthday'],
-                        'member_id': member['id'],
-                        'member_name': member_name
-                    })
-            except:
-                pass
-        
-        # Anniversaries
-        if member.get('anniversary'):
-            try:
-                anniv = datetime.strptime(member['anniversary'], '%Y-%m-%d')
-                if (not month or anniv.month == month) and (not year or anniv.year == year):
-                    events_list.append({
-                        'type': 'anniversary',
-                        'title': f"{member_name}'s Anniversary",
-                        'date': member['anniversary'],
-                        'member_id': member['id'],
-                        'member_name': member_name
-                    })
-            except:
-                pass
+    with metrics.phase("db"):
+        [rows] = await require_live_family(family_id, db.occurrences.find(query, occurrences.PROJECTION).to_list(None))
     
-    # Custom events
-    events = await db.custom_events.find({"family_id": family_id}, {"_id": 0}).to_list(1000)
-    for event in events:
-        try:
-            event_date = datetime.strptime(event['event_date'], '%Y-%m-%d')
-            if (not month or event_date.month == month) and (not year or event_date.year == year):
+    with metrics.phase("compute"):
+        events_list = []
+        for row in rows:
+            if row['kind'] == occurrences.CUSTOM:
                 events_list.append({
                     'type': 'custom',
-                    'title': event['event_name'],
-                    'date': event['event_date'],
-                    'event_id': event['id']
+                    'title': row['title'],
+                    'date': row['date'],
+                    'event_id': row['source_id']
                 })
-        except:
-            pass
-    
-    # Sort by date
-    events_list.sort(key=lambda x: x['date'])
+            else:
+                events_list.append({
+                    'type': row['kind'],
+                    'title': row['title'],
+                    'date': row['date'],
+                    'member_id': row['member_id'],
+                    'member_name': row['member_name']
+                })
+        
+        # Sort by date
+        events_list.sort(key=lambda x: x['date'])
     return events_list
 
+# ============= ADMIN =============
+
+@api_router.get("/admin/index-stats")
+async def get_index_stats():
+    """Usage counters for every index the API relies on, to check query plans hit them"""
+    return await indexes.index_stats(db)
+
+@api_router.get("/admin/auth-stats")
+async def get_auth_stats():
+    """Verified-token cache counters for this API worker"""
+    return token_verifier.info()
+
+@api_router.get("/admin/admission-stats")
+async def get_admission_stats():
+    """Rate-limit rejections per rule, plus requests in flight and queued, for this API worker"""
+    return {"rate_limit": rate_limiter.info(), "concurrency": request_gate.info()}
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats():
+    """Response cache hit/miss/eviction counters for this API worker"""
+    return response_cache.info()
+
+@api_router.post("/admin/orphan-sweep", status_code=202)
+async def start_orphan_sweep():
+    """Queue an orphan sweep now instead of waiting for the worker's next one"""
+    job = await cleanup.queue_sweep(db)
+    return {"job_id": job["id"]}
+
+@api_router.get("/admin/profiles")
+async def list_profiles(limit: int = Query(50, ge=1, le=500)):
+    """Saved request profiles, newest first, without their call trees"""
+    projection = {"_id": 0, "commands": 0, "report": 0, "data": 0}
+    return await db.request_profiles.find({}, projection).sort("created_at", -1).limit(limit).to_list(None)
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    """One request profile: breakdown, every MongoDB command, and the top of the call tree as text"""
+    profile = await db.request_profiles.find_one({"id": profile_id}, {"_id": 0, "data": 0})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@api_router.get("/admin/profiles/{profile_id}/download")
+async def download_profile(profile_id: str):
+    """The raw profile: a .prof file (pstats, snakeviz) or pyinstrument's HTML call tree"""
+    profile = await db.request_profiles.find_one({"id": profile_id}, {"_id": 0, "profiler": 1, "data": 1})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    profiler = profiling.PROFILERS[profile["profiler"]]
+    return Response(
+        content=bytes(profile["data"]),
+        media_type=profiler.media_type,
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.{profiler.extension}"'},
+    )
+
+@api_router.get("/admin/profiling-stats")
+async def get_profiling_stats():
+    """Profiling settings, plus profiled and slow request counts for this API worker"""
+    return request_profiler.info()
+
+@api_router.get("/admin/job-stats")
+async def get_job_stats(window_seconds: int = Query(3600, ge=60, le=7 * 86400)):
+    """Job queue backlog, lag, throughput and failure counts"""
+    return await jobs.queue_stats(db, window_seconds)
+
 # Include the router in the main app
 app.include_router(api_router)
+app.include_router(public_router)
+
+# ============= PROFILING =============
+
+# Innermost middleware, so a profile covers the request's own work and not its wait for a slot
+request_profiler = profiling.RequestProfiler(save=lambda document: db.request_profiles.insert_one(document))
+app.add_middleware(profiling.ProfilingMiddleware, request_profiler=request_profiler)
+
+# ============= ADMISSION =============
+
+rate_limiter = ratelimit.RateLimiter(ratelimit.rules_from_env(), ratelimit.store_from_env())
+request_gate = ratelimit.ConcurrencyGate()
+
+def rate_limit_client(scope) -> str:
+    """Requests count against their access token when it is valid, otherwise against the client IP"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            token = auth.bearer_token(value.decode("latin-1"))
+            try:
+                if token and token_verifier.verify(token):
+                    return "token:" + token.rpartition(".")[2]
+            except auth.InvalidToken:
+                pass
+            break
+    return "ip:" + ratelimit.client_ip(scope)
+
+# Added before CORS so that CORS wraps it and 429/503 answers carry CORS headers
+app.add_middleware(ratelimit.AdmissionMiddleware, limiter=rate_limiter, gate=request_gate, client_key=rate_limit_client)
+
+# ============= METRICS =============
+
+# Prometheus scrapes GET /metrics on every API process. It sits outside /api, so it
+# needs no access token and is never rate limited; set METRICS_TOKEN to require
+# "Authorization: Bearer <METRICS_TOKEN>" instead.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+metrics.REGISTRY.register(metrics.StatsCollector(response_cache, token_verifier, rate_limiter, request_gate))
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and not hmac.compare_digest(auth.bearer_token(authorization) or "", METRICS_TOKEN):
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        metrics.set_job_gauges(await jobs.queue_depth(db))
+    except Exception as e:
+        # The rest of the metrics are still worth serving while MongoDB is unreachable
+        logger.warning(f"Could not read the job queue for metrics: {str(e)}")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+# Outside the admission middleware, so request latency includes time spent queued for a slot
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -499,6 +1391,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-After", "Retry-After", "X-Profile-Id"],
 )
 
 # Configure logging
@@ -508,6 +1401,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await indexes.ensure_indexes(db)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await response_cache.close()
+    await rate_limiter.store.close()
+    client.close()
+    shutdown_executor()
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""IANA timezones for families and members.
+
+A member without a timezone uses their family's, and a family without one uses
+UTC. "Today" for alerts and "tomorrow" for reminders are computed in that zone.
+"""
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DEFAULT_TIMEZONE = "UTC"
+
+
+@lru_cache(maxsize=None)
+def get_zone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+
+def validate(name: Optional[str]) -> Optional[str]:
+    """The name if it is a known IANA timezone, None for empty; raises ValueError otherwise"""
+    if not name:
+        return None
+    try:
+        get_zone(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {name}")
+    return name
+
+
+def resolve(*names) -> str:
+    """The first of names that is a valid timezone (e.g. member's, then family's), else UTC"""
+    for name in names:
+        try:
+            if validate(name):
+                return name
+        except ValueError:
+            continue
+    return DEFAULT_TIMEZONE
+
+
+def local_now(name: str, now: datetime = None) -> datetime:
+    return (now or datetime.now(timezone.utc)).astimezone(get_zone(name))
+
+
+def local_today(name: str, now: datetime = None) -> date:
+    return local_now(name, now).date()
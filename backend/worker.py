@@ -0,0 +1,61 @@
+"""Background worker: runs the jobs the API queues (see jobs.py), the daily
+reminder run (see scheduler.py) and the periodic orphan sweep (see cleanup.py).
+
+Run from the backend directory next to the API, as many replicas as needed:
+
+    python worker.py --concurrency 4
+
+With --metrics-port (or METRICS_PORT) set, Prometheus metrics for this process
+(jobs run, emails sent, MongoDB commands) are served on that port.
+"""
+import argparse
+import asyncio
+import signal
+
+from prometheus_client import start_http_server
+
+import cleanup
+import indexes
+import jobs
+import metrics
+import reminders
+import scheduler
+from mailer import Mailer
+from server import db, client, photo_store
+
+
+async def main(args):
+    await indexes.ensure_indexes(db)
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    sender = Mailer()
+    handlers = {
+        reminders.KIND: lambda job: reminders.deliver(db, sender, job),
+        cleanup.DELETE_KIND: lambda job: cleanup.delete_family(db, photo_store, job),
+        cleanup.SWEEP_KIND: lambda job: cleanup.sweep(db, photo_store, job),
+    }
+    worker = jobs.Worker(db, handlers, concurrency=args.concurrency, poll_interval=args.poll_interval)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    tasks = [worker.run(stop)]
+    if not args.no_scheduler:
+        tasks.append(scheduler.Scheduler(db).run(stop))
+    if not args.no_sweeper:
+        tasks.append(cleanup.Sweeper(db).run(stop))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await sender.close()
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run queued background jobs")
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs run at once")
+    parser.add_argument("--no-scheduler", action="store_true", help="only run jobs, not the daily reminder run")
+    parser.add_argument("--no-sweeper", action="store_true", help="do not queue the periodic orphan sweep")
+    parser.add_argument("--metrics-port", type=int, default=metrics.METRICS_PORT, help="serve Prometheus metrics on this port (0: off)")
+    parser.add_argument("--poll-interval", type=float, default=jobs.POLL_INTERVAL_SECONDS, help="seconds between polls when idle")
+    asyncio.run(main(parser.parse_args()))
@@ -110,6 +110,33 @@ class FamilyTreeAPITester:
             return True
         return False
 
+    def test_get_family_snapshot(self):
+        """Test the single-family and snapshot endpoints, including ETag revalidation"""
+        if not self.family_id:
+            print("❌ No family ID available")
+            return False
+
+        success, response = self.run_test(
+            "Get Family",
+            "GET",
+            f"families/{self.family_id}",
+            200
+        )
+        if not success or response.get('id') != self.family_id:
+            return False
+
+        self.tests_run += 1
+        url = f"{self.base_url}/api/families/{self.family_id}/snapshot"
+        headers = {'Authorization': f'Bearer {self.token}'} if self.token else {}
+        snapshot = requests.get(url, headers=headers)
+        revalidated = requests.get(url, headers={**headers, 'If-None-Match': snapshot.headers.get('ETag', '')})
+        if snapshot.status_code == 200 and set(snapshot.json()) == {'family', 'members', 'alerts'} and revalidated.status_code == 304:
+            self.tests_passed += 1
+            print(f"✅ Snapshot returned {len(snapshot.json()['members'])} members and revalidated with ETag")
+            return True
+        print(f"❌ Snapshot failed - Status: {snapshot.status_code}, revalidation: {revalidated.status_code}")
+        return False
+
     def test_create_family_member(self):
         """Test creating a family member with email field"""
         if not self.family_id:
@@ -142,6 +169,38 @@ class FamilyTreeAPITester:
             return True
         return False
 
+    def test_member_photo(self):
+        """Test that photos are served from the photo store instead of inline"""
+        if not self.family_id:
+            print("❌ No family ID available")
+            return False
+
+        # 1x1 transparent PNG
+        photo = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+        success, response = self.run_test(
+            "Create Member With Photo",
+            "POST",
+            f"families/{self.family_id}/members",
+            200,
+            data={"first_name": "Photo", "last_name": "Member", "photo_base64": photo}
+        )
+        if not success:
+            return False
+        if 'photo_base64' in response or not response.get('photo_url'):
+            print("❌ Member payload should carry photo_url instead of photo_base64")
+            return False
+
+        self.tests_run += 1
+        photo_response = requests.get(f"{self.base_url}{response['photo_url']}")
+        etag = photo_response.headers.get('ETag')
+        cached_response = requests.get(f"{self.base_url}{response['photo_url']}", headers={'If-None-Match': etag or ''})
+        if photo_response.status_code == 200 and photo_response.headers.get('Content-Type') == 'image/png' and cached_response.status_code == 304:
+            self.tests_passed += 1
+            print(f"✅ Photo streamed ({len(photo_response.content)} bytes) and revalidated with ETag")
+            return True
+        print(f"❌ Photo fetch failed - Status: {photo_response.status_code}, revalidation: {cached_response.status_code}")
+        return False
+
     def test_get_family_members(self):
         """Test getting family members"""
         if not self.family_id:
@@ -258,6 +317,23 @@ class FamilyTreeAPITester:
             return True
         return False
 
+    def test_family_tree(self):
+        """Test the server-side tree layout"""
+        if not self.family_id:
+            print("❌ No family ID available")
+            return False
+
+        success, response = self.run_test(
+            "Get Family Tree",
+            "GET",
+            f"families/{self.family_id}/tree",
+            200
+        )
+        if success and self.member_id in response.get('nodes', {}) and not response.get('cycles'):
+            print(f"✅ Tree has {len(response['roots'])} root(s) across {len(response['generations'])} generation(s)")
+            return True
+        return False
+
     def test_update_family_member(self):
         """Test updating a family member with parent fields"""
         if not self.family_id or not self.member_id:
@@ -438,6 +514,7 @@ def main():
     # Family Member Tests
     print("\n📋 FAMILY MEMBER TESTS")
     tester.test_create_family_member()
+    tester.test_member_photo()
     tester.test_get_family_members()
     
     # Dual Parent System Tests
@@ -446,6 +523,8 @@ def main():
     tester.test_create_member_with_mother()
     tester.test_create_member_with_both_parents()
     tester.test_update_family_member()
+    tester.test_get_family_snapshot()
+    tester.test_family_tree()
 
     # Events Tests
     print("\n📋 EVENTS TESTS")
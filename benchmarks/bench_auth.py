@@ -0,0 +1,95 @@
+"""Per-request cost of token verification, with the verified-token cache and without it.
+
+Times TokenVerifier.verify on its own, then requests to a one-route app whose
+only work is the auth dependency, so the difference between rows is the auth
+overhead. Needs no database.
+
+    python benchmarks/bench_auth.py --repeat 20000
+"""
+import argparse
+import asyncio
+import contextlib
+import sys
+import time
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+
+from common import BACKEND_DIR, Timer, api_client, print_table, summarize
+
+sys.path.insert(0, str(BACKEND_DIR))
+import auth
+
+
+def ping_app(verifier):
+    app = FastAPI()
+
+    async def require_auth(request: Request):
+        token = auth.bearer_token(request.headers.get("Authorization"))
+        try:
+            return verifier.verify(token or "")
+        except auth.InvalidToken as e:
+            raise HTTPException(status_code=401, detail=str(e))
+
+    @app.get("/ping")
+    async def ping():
+        return {}
+
+    @app.get("/ping-auth", dependencies=[Depends(require_auth)])
+    async def ping_auth():
+        return {}
+
+    return app
+
+
+def time_verify(verifier, token: str, repeat: int) -> float:
+    """Mean microseconds per verify call"""
+    verifier.verify(token)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        verifier.verify(token)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+async def time_requests(variants: dict, token: str, repeat: int, rounds: int = 20) -> dict:
+    """Milliseconds per request for each (app, path) variant, run in alternating rounds so drift hits all alike"""
+    timings = {name: [] for name in variants}
+    headers = {"Authorization": f"Bearer {token}"}
+    async with contextlib.AsyncExitStack() as stack:
+        clients = {name: await stack.enter_async_context(api_client(app)) for name, (app, _) in variants.items()}
+        for name, (_, path) in variants.items():
+            (await clients[name].get(path, headers=headers)).raise_for_status()
+        for _ in range(rounds):
+            for name, (_, path) in variants.items():
+                for _ in range(max(1, repeat // rounds)):
+                    with Timer() as timer:
+                        await clients[name].get(path, headers=headers)
+                    timings[name].append(timer.ms)
+    return timings
+
+
+async def run(args):
+    cached, uncached = auth.TokenVerifier("bench-secret"), auth.TokenVerifier("bench-secret", max_entries=0)
+    token = cached.issue("onefam")
+    rows = [
+        {"path": "verify, cached", "us_per_call": round(time_verify(cached, token, args.repeat), 2)},
+        {"path": "verify, uncached", "us_per_call": round(time_verify(uncached, token, args.repeat), 2)},
+    ]
+    print_table(rows, ["path", "us_per_call"])
+    print()
+
+    timings = await time_requests({
+        "no auth": (ping_app(cached), "/ping"),
+        "auth, cached": (ping_app(cached), "/ping-auth"),
+        "auth, uncached": (ping_app(uncached), "/ping-auth"),
+    }, token, max(1, args.repeat // 4))
+    rows = [{"request": name, **summarize(samples)} for name, samples in timings.items()]
+    baseline = rows[0]["mean_ms"]
+    for row in rows:
+        row["overhead_us"] = round((row["mean_ms"] - baseline) * 1000, 1)
+    print_table(rows, ["request", "n", "mean_ms", "p50_ms", "p99_ms", "overhead_us"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20000)
+    asyncio.run(run(parser.parse_args()))
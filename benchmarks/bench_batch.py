@@ -0,0 +1,52 @@
+"""Re-parenting N siblings: N PUT /members/{id} calls vs one POST /batch.
+
+    python benchmarks/bench_batch.py --siblings 50 --repeat 10
+"""
+import argparse
+import asyncio
+
+from common import Timer, api_client, drop_bench_db, load_server, print_table, summarize
+
+
+async def run(args):
+    server = load_server()
+    try:
+        async with api_client(server.app) as http:
+            family_id = (await http.post("/api/families", json={"name": "Batch benchmark"})).json()["id"]
+
+            async def add(**fields):
+                return (await http.post(f"/api/families/{family_id}/members", json=fields)).json()["id"]
+
+            parents = [await add(first_name=f"Parent{i}", last_name="Bench") for i in range(2)]
+            siblings = [await add(first_name=f"Sibling{i}", last_name="Bench", father_id=parents[0]) for i in range(args.siblings)]
+
+            timings = {"put": [], "batch": []}
+            for attempt in range(args.repeat):
+                parent = parents[(attempt + 1) % 2]
+                with Timer() as timer:
+                    for sibling in siblings:
+                        (await http.put(f"/api/families/{family_id}/members/{sibling}", json={"father_id": parent})).raise_for_status()
+                timings["put"].append(timer.ms)
+
+                parent = parents[attempt % 2]
+                operations = [{"op": "update", "type": "member", "id": sibling, "data": {"father_id": parent}} for sibling in siblings]
+                with Timer() as timer:
+                    (await http.post(f"/api/families/{family_id}/batch", json={"operations": operations})).raise_for_status()
+                timings["batch"].append(timer.ms)
+
+            rows = [
+                {"path": f"PUT x {args.siblings}", "requests": args.siblings, **summarize(timings["put"])},
+                {"path": "POST /batch", "requests": 1, **summarize(timings["batch"])},
+            ]
+            print_table(rows, ["path", "requests", "n", "mean_ms", "p50_ms", "p99_ms"])
+    finally:
+        await drop_bench_db(server)
+        server.client.close()
+        server.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--siblings", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
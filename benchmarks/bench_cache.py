@@ -0,0 +1,107 @@
+"""Read endpoint latency with the response cache cold (version bumped before every request) vs warm.
+
+Seeds one family with --members members (each with a birthday) and --events
+custom events, then times each cached read endpoint. --backend redis runs the
+cache against benchmarks/fake_redis.py instead of the in-process LRU.
+
+    python benchmarks/bench_cache.py --members 2000 --repeat 50
+"""
+import argparse
+import asyncio
+import random
+from datetime import date, datetime, timedelta, timezone
+
+from common import Timer, api_client, drop_bench_db, load_server, print_table, summarize
+from fake_redis import FakeRedis
+
+CREATED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def seed(family_id: str, members: int, events: int, rng: random.Random):
+    start = date(1950, 1, 1)
+    member_docs = [
+        {
+            "id": f"m{i:06d}", "family_id": family_id, "first_name": "Member", "last_name": str(i),
+            "birthday": (start + timedelta(days=rng.randrange(365 * 60))).isoformat(),
+            "father_id": f"m{rng.randrange(i):06d}" if i > 10 else None,
+            "created_at": CREATED_AT,
+        }
+        for i in range(members)
+    ]
+    event_docs = [
+        {
+            "id": f"e{i:06d}", "family_id": family_id, "event_name": f"Event {i}",
+            "event_date": (date.today() + timedelta(days=rng.randrange(-200, 200))).isoformat(),
+            "created_at": CREATED_AT,
+        }
+        for i in range(events)
+    ]
+    return member_docs, event_docs
+
+
+async def run(args):
+    server = load_server()
+    fake = None
+    if args.backend == "redis":
+        import cache
+        fake = await FakeRedis().start()
+        server.response_cache = cache.ResponseCache(cache.RedisBackend.from_url(fake.url))
+    rng = random.Random(args.seed)
+    try:
+        async with api_client(server.app) as http:
+            family_id = (await http.post("/api/families", json={"name": "Cache benchmark"})).json()["id"]
+            member_docs, event_docs = seed(family_id, args.members, args.events, rng)
+            for doc in (*member_docs, *event_docs):
+                doc.update(server.occurrences.date_parts(doc)[0])
+            await server.db.family_members.insert_many(member_docs)
+            await server.db.custom_events.insert_many(event_docs)
+            await server.occurrences.rebuild(server.db, family_id)
+
+            month = date.today().month
+            endpoints = [
+                ("members", f"/api/families/{family_id}/members"),
+                ("events", f"/api/families/{family_id}/events"),
+                ("alerts", f"/api/families/{family_id}/alerts"),
+                ("calendar", f"/api/families/{family_id}/events-calendar?month={month}"),
+                ("tree", f"/api/families/{family_id}/tree"),
+                ("snapshot", f"/api/families/{family_id}/snapshot"),
+            ]
+            rows = []
+            for name, url in endpoints:
+                cold_ms, warm_ms = [], []
+                for _ in range(args.repeat):
+                    await server.response_cache.bump(family_id)
+                    with Timer() as timer:
+                        response = await http.get(url)
+                    response.raise_for_status()
+                    cold_ms.append(timer.ms)
+                for _ in range(args.repeat):
+                    with Timer() as timer:
+                        response = await http.get(url)
+                    warm_ms.append(timer.ms)
+                cold, warm = summarize(cold_ms), summarize(warm_ms)
+                rows.append({
+                    "endpoint": name, "bytes": len(response.content),
+                    "cold_p50_ms": cold["p50_ms"], "cold_p99_ms": cold["p99_ms"],
+                    "warm_p50_ms": warm["p50_ms"], "warm_p99_ms": warm["p99_ms"],
+                    "speedup_p50": round(cold["p50_ms"] / warm["p50_ms"], 1) if warm["p50_ms"] else None,
+                })
+            print_table(rows, ["endpoint", "bytes", "cold_p50_ms", "cold_p99_ms", "warm_p50_ms", "warm_p99_ms", "speedup_p50"])
+            print(f"cache: {server.response_cache.info()}")
+    finally:
+        await drop_bench_db(server)
+        await server.response_cache.close()
+        if fake:
+            await fake.stop()
+        server.client.close()
+        server.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--backend", choices=("lru", "redis"), default="lru")
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,79 @@
+"""Member edit latency: the old read/update/read sequence vs one find_one_and_update.
+
+Seeds --members members whose comments hold --comment-bytes of text, then edits
+one field of random members. The "db" rows time the Mongo calls alone. The
+"PUT" rows time the endpoint returning the whole member or, with changed_only,
+just the changed fields.
+
+    python benchmarks/bench_edit.py --members 2000 --repeat 200
+"""
+import argparse
+import asyncio
+import random
+from datetime import datetime, timezone
+
+from common import Timer, api_client, drop_bench_db, load_server, print_table, summarize
+from pymongo import ReturnDocument
+
+
+async def legacy_edit(db, family_id: str, member_id: str, fields: dict):
+    """What update_family_member did before: existence check, update by id alone, read back"""
+    await db.family_members.find_one({"id": member_id, "family_id": family_id}, {"_id": 1})
+    await db.family_members.update_one({"id": member_id}, {"$set": fields})
+    return await db.family_members.find_one({"id": member_id}, {"_id": 0, "photo_base64": 0})
+
+
+async def single_edit(db, family_id: str, member_id: str, fields: dict, projection: dict):
+    return await db.family_members.find_one_and_update(
+        {"id": member_id, "family_id": family_id}, {"$set": fields, "$inc": {"version": 1}},
+        projection, return_document=ReturnDocument.AFTER,
+    )
+
+
+async def run(args):
+    server = load_server()
+    rng = random.Random(args.seed)
+    try:
+        async with api_client(server.app) as http:
+            family_id = (await http.post("/api/families", json={"name": "Edit benchmark"})).json()["id"]
+            comments = "x" * args.comment_bytes
+            await server.db.family_members.insert_many([
+                {"id": f"m{i:06d}", "family_id": family_id, "first_name": "Member", "last_name": str(i),
+                 "comments": comments, "version": 0, "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc)}
+                for i in range(args.members)
+            ])
+            ids = [f"m{i:06d}" for i in range(args.members)]
+            changed_projection = {"_id": 0, "id": 1, "version": 1, "email": 1}
+
+            paths = {
+                "db: find + update + find": lambda member_id, fields: legacy_edit(server.db, family_id, member_id, fields),
+                "db: find_one_and_update": lambda member_id, fields: single_edit(server.db, family_id, member_id, fields, server.MEMBER_PROJECTION),
+                "db: find_one_and_update, changed": lambda member_id, fields: single_edit(server.db, family_id, member_id, fields, changed_projection),
+                "PUT": lambda member_id, fields: http.put(f"/api/families/{family_id}/members/{member_id}", json=fields),
+                "PUT ?changed_only": lambda member_id, fields: http.put(
+                    f"/api/families/{family_id}/members/{member_id}", json=fields, params={"changed_only": True}
+                ),
+            }
+            rows = []
+            for name, edit in paths.items():
+                timings = []
+                for attempt in range(args.repeat):
+                    fields = {"email": f"edit{attempt}@example.com"}
+                    with Timer() as timer:
+                        await edit(rng.choice(ids), fields)
+                    timings.append(timer.ms)
+                rows.append({"path": name, **summarize(timings)})
+            print_table(rows, ["path", "n", "mean_ms", "p50_ms", "p99_ms"])
+    finally:
+        await drop_bench_db(server)
+        server.client.close()
+        server.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=2000)
+    parser.add_argument("--comment-bytes", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""Query latency of the in-memory family graph on a synthetic family.
+
+Builds a family of --members people (100k by default): founding couples whose
+children each marry someone from outside the family and have children of their
+own, generation after generation. Then times the queries behind the
+ancestors/descendants/common-ancestors/relationship endpoints. No database needed.
+
+    python benchmarks/bench_family_graph.py --members 100000
+"""
+import argparse
+import random
+import sys
+import time
+
+from common import BACKEND_DIR, print_table, summarize
+
+sys.path.insert(0, str(BACKEND_DIR))
+from family_graph import FamilyGraph  # noqa: E402
+
+
+def synthetic_family(size: int, founders: int, rng: random.Random):
+    members = []
+    couples = []
+    for i in range(founders):
+        members += [{"id": f"f{i}"}, {"id": f"m{i}"}]
+        couples.append((f"f{i}", f"m{i}"))
+    generations = [[member["id"] for member in members]]
+    while len(members) < size:
+        next_couples, generation = [], []
+        for father_id, mother_id in couples:
+            for _ in range(rng.choice((1, 2, 2, 3))):
+                child_id = f"c{len(members)}"
+                members.append({"id": child_id, "father_id": father_id, "mother_id": mother_id})
+                generation.append(child_id)
+                spouse_id = f"s{len(members)}"
+                members.append({"id": spouse_id})
+                next_couples.append((child_id, spouse_id))
+                if len(members) >= size:
+                    break
+            if len(members) >= size:
+                break
+        couples = next_couples
+        generations.append(generation)
+    return members, generations
+
+
+def time_queries(name, fn, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"query": name, **summarize(samples)}
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    members, generations = synthetic_family(args.members, args.founders, rng)
+    start = time.perf_counter()
+    graph = FamilyGraph()
+    for member in members:
+        graph.upsert(member)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"{len(members)} members in {len(generations)} generations, graph built in {build_ms:.0f} ms")
+
+    youngest = generations[-2]
+    middle = generations[len(generations) // 2]
+    pairs = [(rng.choice(youngest), rng.choice(youngest)) for _ in range(args.queries)]
+    rows = [
+        time_queries("ancestors (all)", graph.ancestors, [(rng.choice(youngest),) for _ in range(args.queries)]),
+        time_queries("descendants (max_depth=2)", graph.descendants, [(rng.choice(middle), 2) for _ in range(args.queries)]),
+        time_queries("common ancestors", graph.common_ancestors, pairs),
+        time_queries("relationship", graph.relationship, pairs),
+        time_queries("upsert (re-parent)", graph.upsert, [
+            ({"id": rng.choice(youngest), "father_id": rng.choice(middle)},) for _ in range(args.queries)
+        ]),
+    ]
+    print_table(rows, ["query", "n", "mean_ms", "p50_ms", "p99_ms"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=100_000)
+    parser.add_argument("--founders", type=int, default=200, help="founding couples")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+"""Onboarding a family: one POST /members per person vs one streamed POST /import.
+
+Also parses progressively larger CSV files without writing them, to show that
+parser memory (tracemalloc peak) stays flat as the file grows.
+
+    python benchmarks/bench_import.py --members 5000
+"""
+import argparse
+import asyncio
+import io
+import random
+import tracemalloc
+
+from common import Timer, api_client, drop_bench_db, load_server, print_table
+
+CHUNK_SIZE = 64 * 1024
+
+
+def csv_rows(count: int, rng: random.Random):
+    """Header plus count rows, each after its parents so the one-by-one path can reference real ids"""
+    yield "ref,first_name,last_name,email,birthday,father_ref,mother_ref\n"
+    for i in range(count):
+        father = f"p{rng.randrange(i)}" if i > 20 else ""
+        mother = f"p{rng.randrange(i)}" if i > 20 else ""
+        birthday = f"{rng.randrange(1930, 2020)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}"
+        yield f"p{i},Person,{i},p{i}@example.com,{birthday},{father},{mother}\n"
+
+
+async def upload(text: str):
+    data = text.encode()
+    for start in range(0, len(data), CHUNK_SIZE):
+        yield data[start:start + CHUNK_SIZE]
+
+
+async def one_by_one(http, family_id: str, count: int, rng: random.Random):
+    ids = {}
+    for line in list(csv_rows(count, rng))[1:]:
+        ref, first, last, email, birthday, father, mother = line.strip().split(",")
+        response = await http.post(f"/api/families/{family_id}/members", json={
+            "first_name": first, "last_name": last, "email": email, "birthday": birthday,
+            "father_id": ids.get(father), "mother_id": ids.get(mother),
+        })
+        response.raise_for_status()
+        ids[ref] = response.json()["id"]
+
+
+async def parse_peak_kb(member_import, count: int) -> float:
+    """tracemalloc peak while parsing count rows streamed from a generator"""
+    async def chunks():
+        buffer = io.StringIO()
+        for line in csv_rows(count, random.Random(1)):
+            buffer.write(line)
+            if buffer.tell() >= CHUNK_SIZE:
+                yield buffer.getvalue().encode()
+                buffer = io.StringIO()
+        yield buffer.getvalue().encode()
+
+    tracemalloc.start()
+    async for _ in member_import.parse_csv(chunks()):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+async def run(args):
+    server = load_server()
+    import member_import
+    try:
+        async with api_client(server.app) as http:
+            rows = []
+            family_id = (await http.post("/api/families", json={"name": "One by one"})).json()["id"]
+            with Timer() as timer:
+                await one_by_one(http, family_id, args.members, random.Random(args.seed))
+            rows.append({"path": "POST /members x N", "members": args.members, "requests": args.members, "total_ms": round(timer.ms, 1)})
+
+            family_id = (await http.post("/api/families", json={"name": "Import"})).json()["id"]
+            text = "".join(csv_rows(args.members, random.Random(args.seed)))
+            with Timer() as timer:
+                response = await http.post(f"/api/families/{family_id}/import", content=upload(text), headers={"Content-Type": "text/csv"})
+            report = response.json()
+            rows.append({"path": "POST /import", "members": report["imported"], "requests": 1, "total_ms": round(timer.ms, 1), "parents_linked": report["parents_linked"]})
+            for row in rows:
+                row["ms_per_member"] = round(row["total_ms"] / max(row["members"], 1), 3)
+            print_table(rows, ["path", "members", "requests", "total_ms", "ms_per_member", "parents_linked"])
+
+        print()
+        print_table(
+            [{"rows": count, "parse_peak_kb": await parse_peak_kb(member_import, count)} for count in args.parse_rows],
+            ["rows", "parse_peak_kb"],
+        )
+    finally:
+        await drop_bench_db(server)
+        server.client.close()
+        server.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--parse-rows", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
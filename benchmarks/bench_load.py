@@ -0,0 +1,380 @@
+"""Load test: every API endpoint under concurrent clients, on families of 10, 1k and 50k members.
+
+Seeds one family per --sizes entry with birthdays, anniversaries, parent links,
+custom events and --photos members with photos. Then it sends --requests
+requests to each endpoint from --concurrency concurrent clients, reads first
+and writes after. For every (size, endpoint) it reports throughput,
+p50/p95/p99 latency and response size. --output writes the results as JSON,
+with the commit and settings they came from. --compare diffs two such files
+and exits 1 when an endpoint got slower than --threshold allows:
+
+    python benchmarks/bench_load.py --output bench-results/$(git rev-parse --short HEAD).json
+    python benchmarks/bench_load.py --compare bench-results/main.json bench-results/HEAD.json
+
+Reads hit the response cache after their first request; --cold bumps the
+family's cache version before every request instead. --mongo fake runs on an
+in-memory mongomock-motor database, so no MongoDB is needed but database time
+is not representative. mongomock scans a collection for every query, so a 50k
+family takes the better part of an hour there; use --sizes 10,1000 with it.
+Clients and app share one event loop, as in the other benchmarks, so
+throughput is what one API process sustains.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+from PIL import Image, ImageDraw
+
+from common import BACKEND_DIR, Timer, api_client, drop_bench_db, fake_mongo, load_server, print_table, summarize
+
+FORMAT_VERSION = 1
+SIZES = (10, 1000, 50000)
+SEED_BATCH_SIZE = 5000
+CREATED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+COLUMNS = ["size", "endpoint", "requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "bytes"]
+
+
+# ============= SEEDING =============
+
+def synthetic_photo(rng: random.Random, size: int = 640) -> bytes:
+    image = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x, y = rng.randrange(size), rng.randrange(size)
+        draw.ellipse((x, y, x + rng.randrange(20, 200), y + rng.randrange(20, 200)), fill=tuple(rng.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def random_date(rng: random.Random, first_year: int, last_year: int) -> str:
+    start = date(first_year, 1, 1)
+    return (start + timedelta(days=rng.randrange((last_year - first_year) * 365))).isoformat()
+
+
+def member_docs(family_id: str, prefix: str, count: int, rng: random.Random) -> list:
+    """Members whose parents are earlier members, so the family forms a tree several generations deep"""
+    docs = []
+    for i in range(count):
+        doc = {
+            "id": f"{prefix}-m{i:06d}", "family_id": family_id, "first_name": f"Member{i}", "last_name": prefix,
+            "birthday": random_date(rng, 1930, 2020), "created_at": CREATED_AT, "version": 0,
+        }
+        if i >= 2:
+            doc["father_id"] = f"{prefix}-m{rng.randrange(i // 2, i):06d}"
+            if rng.random() < 0.8:
+                doc["mother_id"] = f"{prefix}-m{rng.randrange(i // 2, i):06d}"
+        if rng.random() < 0.3:
+            doc["anniversary"] = random_date(rng, 1960, 2020)
+        if rng.random() < 0.5:
+            doc["email"] = f"member{i}@{prefix}.example"
+        docs.append(doc)
+    return docs
+
+
+def event_docs(family_id: str, prefix: str, count: int, rng: random.Random) -> list:
+    return [
+        {
+            "id": f"{prefix}-e{i:06d}", "family_id": family_id, "event_name": f"Event {i}",
+            "event_date": (date.today() + timedelta(days=rng.randrange(-200, 200))).isoformat(),
+            "created_at": CREATED_AT,
+        }
+        for i in range(count)
+    ]
+
+
+async def seed_family(server, http, size: int, photos: int, rng: random.Random) -> dict:
+    """Create a family of `size` members; returns what the endpoints need to address it"""
+    family_id = (await http.post("/api/families", json={"name": f"Load test {size}"})).json()["id"]
+    prefix = f"s{size}"
+    members = member_docs(family_id, prefix, size, rng)
+    photo_ids = []
+    for member in members[:photos]:
+        member.update(await server.photo_store.save(member["id"], family_id, synthetic_photo(rng)))
+        photo_ids.append(member["id"])
+    # Written the way the API writes them: with their date parts
+    for doc in members:
+        doc.update(server.occurrences.date_parts(doc)[0])
+    for start in range(0, len(members), SEED_BATCH_SIZE):
+        await server.db.family_members.insert_many(members[start:start + SEED_BATCH_SIZE])
+    events = event_docs(family_id, prefix, max(5, size // 10), rng)
+    for doc in events:
+        doc.update(server.occurrences.date_parts(doc)[0])
+    await server.db.custom_events.insert_many(events)
+    await server.occurrences.rebuild(server.db, family_id)
+    member_ids = [member["id"] for member in members]
+    return {
+        "size": size,
+        "family_id": family_id,
+        "member_ids": member_ids,
+        "photo_ids": photo_ids or member_ids[:1],
+        # The newest members have the longest ancestry, the first ones the most descendants
+        "deep_ids": member_ids[-max(1, size // 10):],
+        "root_ids": member_ids[:2],
+        "created_members": [],
+        "created_events": [],
+    }
+
+
+# ============= ENDPOINTS =============
+
+class Endpoint:
+    """One endpoint to load: request(ctx, i) gives (method, url, httpx request kwargs) for the i-th request.
+    heavy endpoints get a tenth of the requests; collect(ctx, response) keeps ids in ctx that a later
+    endpoint `needs`."""
+
+    def __init__(self, name: str, request, kind: str = "read", heavy: bool = False, collect=None, needs: str = None):
+        self.name = name
+        self.request = request
+        self.kind = kind
+        self.heavy = heavy
+        self.collect = collect
+        self.needs = needs
+
+
+def family_url(ctx: dict, path: str = "") -> str:
+    return f"/api/families/{ctx['family_id']}{path}"
+
+
+def pick(ids: list, i: int) -> str:
+    return ids[i % len(ids)]
+
+
+def import_body(ctx: dict, i: int) -> bytes:
+    lines = (
+        json.dumps({"type": "member", "first_name": f"Imported{i}-{n}", "last_name": "Load", "birthday": "1990-05-17",
+                    "father_id": pick(ctx["member_ids"], i + n)})
+        for n in range(10)
+    )
+    return ("\n".join(lines) + "\n").encode()
+
+
+def batch_body(ctx: dict, i: int) -> dict:
+    ids = ctx["member_ids"]
+    return {"operations": [
+        {"op": "update", "type": "member", "id": pick(ids, i * 10 + n), "data": {"comments": f"Batch {i}"}}
+        for n in range(10)
+    ]}
+
+
+def keep_id(key: str):
+    def collect(ctx: dict, response):
+        if response.status_code == 200:
+            ctx[key].append(response.json()["id"])
+    return collect
+
+
+ENDPOINTS = [
+    Endpoint("families", lambda ctx, i: ("GET", "/api/families", {})),
+    Endpoint("family", lambda ctx, i: ("GET", family_url(ctx), {})),
+    Endpoint("snapshot", lambda ctx, i: ("GET", family_url(ctx, "/snapshot"), {})),
+    Endpoint("members", lambda ctx, i: ("GET", family_url(ctx, "/members"), {})),
+    Endpoint("members_ndjson", lambda ctx, i: ("GET", family_url(ctx, "/members?format=ndjson"), {}), heavy=True),
+    Endpoint("tree", lambda ctx, i: ("GET", family_url(ctx, "/tree"), {})),
+    Endpoint("alerts", lambda ctx, i: ("GET", family_url(ctx, "/alerts"), {})),
+    Endpoint("events", lambda ctx, i: ("GET", family_url(ctx, "/events"), {})),
+    Endpoint("events_month", lambda ctx, i: ("GET", family_url(ctx, f"/events?month={i % 12 + 1}"), {})),
+    Endpoint("calendar", lambda ctx, i: ("GET", family_url(ctx, f"/events-calendar?month={i % 12 + 1}"), {})),
+    Endpoint("ancestors", lambda ctx, i: ("GET", family_url(ctx, f"/members/{pick(ctx['deep_ids'], i)}/ancestors"), {})),
+    Endpoint("descendants", lambda ctx, i: ("GET", family_url(ctx, f"/members/{pick(ctx['root_ids'], i)}/descendants"), {})),
+    Endpoint("relationship", lambda ctx, i: (
+        "GET", family_url(ctx, f"/relationship?a={pick(ctx['deep_ids'], i)}&b={pick(ctx['deep_ids'], i + 1)}"), {})),
+    Endpoint("common_ancestors", lambda ctx, i: (
+        "GET", family_url(ctx, f"/common-ancestors?a={pick(ctx['deep_ids'], i)}&b={pick(ctx['deep_ids'], i + 1)}"), {})),
+    Endpoint("photo", lambda ctx, i: ("GET", f"/api/members/{pick(ctx['photo_ids'], i)}/photo", {})),
+    Endpoint("photo_thumbnail", lambda ctx, i: ("GET", f"/api/members/{pick(ctx['photo_ids'], i)}/photo?size=128", {})),
+    Endpoint("export_ndjson", lambda ctx, i: ("GET", family_url(ctx, "/export"), {}), heavy=True),
+    Endpoint("create_member", lambda ctx, i: ("POST", family_url(ctx, "/members"), {"json": {
+        "first_name": f"New{i}", "last_name": "Load", "birthday": "2001-02-03", "father_id": pick(ctx["member_ids"], i),
+    }}), kind="write", collect=keep_id("created_members")),
+    Endpoint("update_member", lambda ctx, i: ("PUT", family_url(ctx, f"/members/{pick(ctx['member_ids'], i)}"), {"json": {
+        "comments": f"Edited {i}",
+    }}), kind="write"),
+    Endpoint("batch", lambda ctx, i: ("POST", family_url(ctx, "/batch"), {"json": batch_body(ctx, i)}), kind="write", heavy=True),
+    Endpoint("create_event", lambda ctx, i: ("POST", family_url(ctx, "/events"), {"json": {
+        "event_name": f"Load {i}", "event_date": (date.today() + timedelta(days=i % 60)).isoformat(),
+    }}), kind="write", collect=keep_id("created_events")),
+    Endpoint("delete_event", lambda ctx, i: ("DELETE", family_url(ctx, f"/events/{pick(ctx['created_events'], i)}"), {}), kind="write",
+             needs="created_events"),
+    Endpoint("delete_member", lambda ctx, i: ("DELETE", family_url(ctx, f"/members/{pick(ctx['created_members'], i)}"), {}), kind="write",
+             needs="created_members"),
+    Endpoint("import_ndjson", lambda ctx, i: ("POST", family_url(ctx, "/import?format=ndjson"), {
+        "content": import_body(ctx, i), "headers": {"Content-Type": "application/x-ndjson"},
+    }), kind="write", heavy=True),
+    Endpoint("send_alerts", lambda ctx, i: ("POST", family_url(ctx, "/send-alerts"), {}), kind="write", heavy=True),
+]
+
+
+# ============= DRIVER =============
+
+async def drive(server, http, endpoint: Endpoint, ctx: dict, requests: int, concurrency: int, cold: bool) -> dict:
+    """Send `requests` requests from `concurrency` clients; latency, size and status of each"""
+    latencies, sizes, request_sizes, statuses = [], [], [], Counter()
+    indexes = iter(range(requests))
+
+    async def client():
+        # The clients share one iterator, so together they send exactly `requests` requests
+        for i in indexes:
+            method, url, kwargs = endpoint.request(ctx, i)
+            if cold and endpoint.kind == "read":
+                await server.response_cache.bump(ctx["family_id"])
+            with Timer() as timer:
+                response = await http.request(method, url, **kwargs)
+            latencies.append(timer.ms)
+            sizes.append(len(response.content))
+            request_sizes.append(len(response.request.content))
+            statuses[response.status_code] += 1
+            if endpoint.collect:
+                endpoint.collect(ctx, response)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    wall_seconds = time.perf_counter() - start
+    stats = summarize(latencies)
+    return {
+        "size": ctx["size"],
+        "endpoint": endpoint.name,
+        "kind": endpoint.kind,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "wall_s": round(wall_seconds, 3),
+        "throughput_rps": round(requests / wall_seconds, 1) if wall_seconds else None,
+        **stats,
+        "max_ms": round(max(latencies), 3) if latencies else 0.0,
+        "bytes": round(sum(sizes) / len(sizes)) if sizes else 0,
+        "request_bytes": round(sum(request_sizes) / len(request_sizes)) if request_sizes else 0,
+    }
+
+
+def git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+async def load(server, args) -> dict:
+    rng = random.Random(args.seed)
+    selected = [endpoint for endpoint in ENDPOINTS if not args.endpoints or endpoint.name in args.endpoints]
+    results, seed_seconds = [], {}
+    started_at = datetime.now(timezone.utc).isoformat()
+    if args.mongo != "fake":
+        # mongomock checks unique indexes by scanning the collection on every insert, and uses none for queries
+        await server.indexes.ensure_indexes(server.db)
+    async with api_client(server.app) as http:
+        for size in args.sizes:
+            with Timer() as timer:
+                ctx = await seed_family(server, http, size, args.photos, rng)
+            seed_seconds[str(size)] = round(timer.ms / 1000, 2)
+            print(f"seeded {size} members in {seed_seconds[str(size)]} s", file=sys.stderr)
+            for endpoint in selected:
+                if endpoint.needs and not ctx[endpoint.needs]:
+                    print(f"skipped {endpoint.name}: nothing in {endpoint.needs}", file=sys.stderr)
+                    continue
+                requests = max(5, args.requests // 10) if endpoint.heavy else args.requests
+                result = await drive(server, http, endpoint, ctx, requests, args.concurrency, args.cold)
+                results.append(result)
+                if args.verbose:
+                    print_table([result], COLUMNS)
+    return {
+        "format_version": FORMAT_VERSION,
+        "benchmark": "bench_load",
+        "started_at": started_at,
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "mongo": args.mongo, "sizes": args.sizes, "photos": args.photos, "requests": args.requests,
+            "concurrency": args.concurrency, "cold": args.cold, "seed": args.seed,
+        },
+        "seed_seconds": seed_seconds,
+        "results": results,
+    }
+
+
+async def run(args):
+    server = load_server()
+    # The report has every request's latency; per-request and slow-request log lines would only repeat it
+    for name in ("httpx", "profiling"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    try:
+        if args.mongo == "fake":
+            with fake_mongo(server):
+                report = await load(server, args)
+        else:
+            report = await load(server, args)
+    finally:
+        await drop_bench_db(server)
+        await server.response_cache.close()
+        server.client.close()
+        server.shutdown_executor()
+    print_table(report["results"], COLUMNS)
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
+        print(f"results written to {args.output}")
+
+
+# ============= COMPARE =============
+
+def compare(base_path: str, head_path: str, threshold: float) -> int:
+    """Print head against base per (size, endpoint); returns how many got slower than threshold allows"""
+    with open(base_path) as base_file, open(head_path) as head_file:
+        base, head = json.load(base_file), json.load(head_file)
+    before = {(row["size"], row["endpoint"]): row for row in base["results"]}
+    rows, regressions = [], 0
+    for row in head["results"]:
+        old = before.get((row["size"], row["endpoint"]))
+        if old is None:
+            continue
+        p50_change = row["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] else 0.0
+        p99_change = row["p99_ms"] / old["p99_ms"] - 1 if old["p99_ms"] else 0.0
+        throughput_change = row["throughput_rps"] / old["throughput_rps"] - 1 if old["throughput_rps"] else 0.0
+        # p99 is left out of the verdict: a few hundred requests make it too noisy
+        regressed = p50_change > threshold or throughput_change < -threshold or row["errors"] > old["errors"]
+        regressions += regressed
+        rows.append({
+            "size": row["size"], "endpoint": row["endpoint"],
+            "p50_ms": f"{old['p50_ms']} -> {row['p50_ms']}", "p50": f"{p50_change:+.0%}",
+            "p99": f"{p99_change:+.0%}", "throughput": f"{throughput_change:+.0%}",
+            "bytes": f"{old['bytes']} -> {row['bytes']}", "verdict": "SLOWER" if regressed else "",
+        })
+    print(f"base {base['git']['commit'] or base_path} vs head {head['git']['commit'] or head_path}")
+    print_table(rows, ["size", "endpoint", "p50_ms", "p50", "p99", "throughput", "bytes", "verdict"])
+    if base["settings"] != head["settings"]:
+        print(f"warning: settings differ: {base['settings']} vs {head['settings']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=lambda value: sorted({int(size) for size in value.split(",")}), default=list(SIZES),
+                        help="comma-separated family sizes (members)")
+    parser.add_argument("--photos", type=int, default=20, help="members per family with a photo")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint (a tenth for heavy ones)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--endpoints", type=lambda value: value.split(","), help="comma-separated endpoint names (default: all)")
+    parser.add_argument("--cold", action="store_true", help="bump the response cache before every read")
+    parser.add_argument("--mongo", choices=("mongodb", "fake"), default="mongodb", help="MongoDB from backend/.env, or mongomock-motor")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative p50/throughput change --compare flags")
+    parser.add_argument("--verbose", action="store_true", help="print each result as it finishes")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    asyncio.run(run(args))
@@ -0,0 +1,89 @@
+"""send-alerts email delivery: one blocking SDK call per recipient (before) vs the pooled mailer (after).
+
+Both run against benchmarks/fake_sendgrid.py in a background thread, so no real
+email is sent. "Before" replays the original background task for every recipient;
+"after" hands the whole recipient list to a warmed-up mailer.Mailer, as the
+long-lived one in server.py would be. Reports wall time, API calls and the
+longest event-loop stall seen by a 10 ms ticker while sending.
+
+    python benchmarks/bench_mailer.py --recipients 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from common import BACKEND_DIR, print_table
+from fake_sendgrid import FakeSendGrid
+
+sys.path.insert(0, str(BACKEND_DIR))
+import mailer  # noqa: E402
+
+SUBJECT = "OneFam - Upcoming Events Reminder"
+CONTENT = "<html><body><p>Birthday: Ada Lovelace on December 10, 2026</p></body></html>"
+
+
+async def legacy_send(url: str, recipients):
+    from sendgrid import SendGridAPIClient
+    from sendgrid.helpers.mail import Mail
+    for email in recipients:
+        message = Mail(from_email="noreply@onefam.com", to_emails=email, subject=SUBJECT, html_content=CONTENT)
+        SendGridAPIClient("fake", host=url).send(message)
+
+
+async def mailer_send(sender, recipients):
+    results = await sender.send(recipients, SUBJECT, CONTENT)
+    assert all(result["status"] == mailer.SENT for result in results), results
+
+
+async def measure(name, fake, send):
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls.append((time.perf_counter() - start - 0.01) * 1000)
+
+    calls_before = len(fake.requests)
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await send()
+    wall_ms = (time.perf_counter() - start) * 1000
+    done.set()
+    await tick
+    return {
+        "delivery": name,
+        "wall_ms": round(wall_ms, 1),
+        "api_calls": len(fake.requests) - calls_before,
+        "max_loop_stall_ms": round(max(stalls, default=0.0), 1),
+    }
+
+
+async def main(args):
+    fake = FakeSendGrid(latency=args.latency).start()
+    recipients = [f"member{i}@example.com" for i in range(args.recipients)]
+    sender = mailer.Mailer(api_key="fake", api_url=fake.url, concurrency=args.concurrency,
+                           rate=args.rate, batch_size=args.batch_size)
+    try:
+        await mailer_send(sender, ["warmup@example.com"])
+        rows = [
+            await measure("sdk per recipient", fake, lambda: legacy_send(fake.url, recipients)),
+            await measure("pooled mailer", fake, lambda: mailer_send(sender, recipients)),
+        ]
+    finally:
+        await sender.close()
+        fake.stop()
+    print_table(rows, ["delivery", "wall_ms", "api_calls", "max_loop_stall_ms"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake API latency in seconds")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=10, help="API calls per second")
+    asyncio.run(main(parser.parse_args()))
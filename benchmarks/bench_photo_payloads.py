@@ -0,0 +1,101 @@
+"""Bytes and latency of one family listing with inline photos (before) vs thumbnails (after).
+
+"Before" replays the original handler: every member document carries its
+photo as photo_base64 and the listing returns all of them. "After" lists the
+members through the API (photo URLs only) and then fetches the list-size
+thumbnail of every member, which is what CardsView/TreeView do.
+
+    python benchmarks/bench_photo_payloads.py --members 200 --repeat 10
+"""
+import argparse
+import asyncio
+import base64
+import io
+import os
+
+from fastapi import FastAPI
+
+from common import Timer, api_client, drop_bench_db, load_server, print_table, summarize
+
+
+def make_photo(edge: int) -> bytes:
+    """A noisy JPEG, roughly the size of a phone photo after the 5MB upload cap"""
+    from PIL import Image
+    image = Image.frombytes("RGB", (edge, edge), os.urandom(edge * edge * 3))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def legacy_app(server):
+    """The pre-photo-store listing endpoint, reading the same database"""
+    app = FastAPI()
+
+    @app.get("/api/families/{family_id}/members")
+    async def get_family_members(family_id: str):
+        return await server.db.family_members.find({"family_id": family_id}, {"_id": 0}).to_list(1000)
+
+    return app
+
+
+async def run(args):
+    server = load_server()
+    photo = make_photo(args.edge)
+    photo_base64 = "data:image/jpeg;base64," + base64.b64encode(photo).decode()
+    print(f"Photo: {args.edge}x{args.edge} JPEG, {len(photo) / 1024:.0f} KiB ({len(photo_base64) / 1024:.0f} KiB as base64)")
+
+    try:
+        async with api_client(server.app) as http, api_client(legacy_app(server)) as legacy_http:
+            before_family = (await http.post("/api/families", json={"name": "Inline photos"})).json()["id"]
+            after_family = (await http.post("/api/families", json={"name": "Photo store"})).json()["id"]
+
+            # Legacy documents are written directly, the way the old create handler stored them
+            await server.db.family_members.insert_many([
+                {"id": f"legacy-{i}", "family_id": before_family, "first_name": "Member", "last_name": str(i), "photo_base64": photo_base64}
+                for i in range(args.members)
+            ])
+            upload_ms = []
+            for i in range(args.members):
+                member = {"first_name": "Member", "last_name": str(i), "photo_base64": photo_base64}
+                with Timer() as timer:
+                    response = await http.post(f"/api/families/{after_family}/members", json=member)
+                response.raise_for_status()
+                upload_ms.append(timer.ms)
+
+            before_ms, before_bytes = [], 0
+            for _ in range(args.repeat):
+                with Timer() as timer:
+                    response = await legacy_http.get(f"/api/families/{before_family}/members")
+                before_ms.append(timer.ms)
+                before_bytes = len(response.content)
+
+            list_ms, page_ms, list_bytes, thumb_bytes = [], [], 0, 0
+            for _ in range(args.repeat):
+                with Timer() as page_timer:
+                    with Timer() as timer:
+                        response = await http.get(f"/api/families/{after_family}/members")
+                    list_ms.append(timer.ms)
+                    list_bytes = len(response.content)
+                    thumbs = await asyncio.gather(*(http.get(m["photo_thumbnail_url"]) for m in response.json()))
+                page_ms.append(page_timer.ms)
+                thumb_bytes = sum(len(t.content) for t in thumbs)
+
+            rows = [
+                {"variant": "before: inline base64 listing", "bytes": before_bytes, **summarize(before_ms)},
+                {"variant": "after: member listing", "bytes": list_bytes, **summarize(list_ms)},
+                {"variant": f"after: listing + {args.members} thumbnails", "bytes": list_bytes + thumb_bytes, **summarize(page_ms)},
+                {"variant": "upload (decode + resize + store)", "bytes": len(photo_base64), **summarize(upload_ms)},
+            ]
+            print_table(rows, ["variant", "bytes", "n", "mean_ms", "p50_ms", "p99_ms"])
+    finally:
+        await drop_bench_db(server)
+        server.client.close()
+        server.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=100)
+    parser.add_argument("--edge", type=int, default=1200, help="edge of the generated photo in pixels")
+    parser.add_argument("--repeat", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
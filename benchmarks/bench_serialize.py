@@ -0,0 +1,153 @@
+"""CPU time to encode a read response: validating documents through the response model vs encoding them as read.
+
+Builds --members member documents and --events custom events as a find()
+returns them, then encodes the members page, the events list and the family
+snapshot --repeat times each way and reports process CPU time per response:
+
+- "validate, string created_at": what the endpoints did before created_at was
+  stored as a date: parse every created_at, validate every document through
+  the response model with a TypeAdapter, dump it.
+- "validate": the same with created_at already a datetime.
+- "orjson": serialize() with the endpoint's DocumentShape, which fills in
+  missing defaults and encodes the documents with orjson.
+
+Both ways must produce the same JSON; the benchmark checks that first.
+
+    python benchmarks/bench_serialize.py --members 1000 --repeat 200
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import List
+
+from common import load_server, print_table
+from pydantic import TypeAdapter
+
+CREATED_AT = datetime(2024, 1, 1, 12, 30, 15, 123000, tzinfo=timezone.utc)
+
+
+def member_docs(count: int, rng: random.Random) -> list:
+    start = date(1930, 1, 1)
+    docs = []
+    for i in range(count):
+        doc = {
+            "id": f"m{i:06d}", "family_id": "f1", "first_name": "Member", "last_name": f"Number {i}",
+            "birthday": (start + timedelta(days=rng.randrange(365 * 90))).isoformat(),
+            "created_at": CREATED_AT, "version": rng.randrange(5),
+        }
+        if i:
+            doc["father_id"] = f"m{rng.randrange(i // 2, i):06d}"
+        if rng.random() < 0.5:
+            doc["email"] = f"member{i}@example.com"
+        if rng.random() < 0.3:
+            doc["anniversary"] = (start + timedelta(days=rng.randrange(365 * 90))).isoformat()
+        if rng.random() < 0.2:
+            doc.update(photo_url=f"/api/photos/m{i:06d}", photo_thumbnail_url=f"/api/photos/m{i:06d}?size=128",
+                       photo_sizes=[128, 512], photo_hash=f"{i:040x}")
+        docs.append(doc)
+    return docs
+
+
+def event_docs(count: int, rng: random.Random) -> list:
+    return [
+        {"id": f"e{i:06d}", "family_id": "f1", "event_name": f"Event {i}", "created_at": CREATED_AT,
+         "event_date": (date(2024, 1, 1) + timedelta(days=rng.randrange(366))).isoformat()}
+        for i in range(count)
+    ]
+
+
+def with_string_created_at(value):
+    if isinstance(value, list):
+        return [with_string_created_at(doc) for doc in value]
+    if isinstance(value, dict):
+        return {key: with_string_created_at(item) for key, item in value.items()}
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def parse_created_at(value):
+    """The fromisoformat pass list_page and find_family used to make over every document"""
+    if isinstance(value, list):
+        return [parse_created_at(doc) for doc in value]
+    if isinstance(value, dict):
+        if isinstance(value.get("created_at"), str):
+            value = {**value, "created_at": datetime.fromisoformat(value["created_at"])}
+        return {key: parse_created_at(item) if isinstance(item, (list, dict)) else item for key, item in value.items()}
+    return value
+
+
+def snapshot_body(server, value: dict) -> dict:
+    """What the snapshot handler hands serialize(): each part filled by its shape"""
+    return {
+        "family": server.FAMILY_SHAPE.fill(value["family"]),
+        "members": server.MEMBER_SUMMARY_SHAPE.fill(value["members"]),
+        "alerts": [alert.model_dump() for alert in value["alerts"]],
+    }
+
+
+def cpu_ms(encode, value, repeat: int):
+    encode(value)
+    start = time.process_time()
+    for _ in range(repeat):
+        body = encode(value)
+    return (time.process_time() - start) * 1000 / repeat, len(body)
+
+
+def run(args):
+    server = load_server()
+    rng = random.Random(args.seed)
+    members = member_docs(args.members, rng)
+    events = event_docs(args.events, rng)
+    family = {"id": "f1", "name": "Serialize benchmark", "timezone": "Europe/Paris", "created_at": CREATED_AT}
+    summary_fields = server.MEMBER_SUMMARY_SHAPE.projection
+    alerts = [
+        server.Alert(type="birthday", title=f"Member {i}'s Birthday", date="2024-06-01", member_name=f"Member {i}", days_until=i % 30)
+        for i in range(args.alerts)
+    ]
+    responses = [
+        ("members", members, List[server.FamilyMember], server.MEMBER_SHAPE),
+        ("events", events, List[server.CustomEvent], server.EVENT_SHAPE),
+        (
+            "snapshot",
+            {"family": family, "members": [{k: v for k, v in doc.items() if k in summary_fields} for doc in members], "alerts": alerts},
+            server.FamilySnapshot,
+            None,
+        ),
+    ]
+
+    rows = []
+    for name, value, model, shape in responses:
+        adapter = TypeAdapter(model)
+        if shape is None:
+            encode_fast = lambda value: server.serialize(snapshot_body(server, value))
+        else:
+            encode_fast = lambda value, shape=shape: server.serialize(value, shape)
+        paths = [
+            ("validate, string created_at", with_string_created_at(value),
+             lambda value: adapter.dump_json(adapter.validate_python(parse_created_at(value)))),
+            ("validate", value, lambda value: adapter.dump_json(adapter.validate_python(value))),
+            ("orjson", value, encode_fast),
+        ]
+        expected = json.loads(paths[0][2](paths[0][1]))
+        if json.loads(encode_fast(value)) != expected:
+            raise SystemExit(f"{name}: the orjson body differs from the validated one")
+        baseline = None
+        for path, path_value, encode in paths:
+            ms, size = cpu_ms(encode, path_value, args.repeat)
+            baseline = baseline or ms
+            rows.append({"response": name, "path": path, "cpu_ms": round(ms, 3), "bytes": size,
+                         "speedup": f"{baseline / ms:.1f}x" if ms else "-"})
+    print_table(rows, ["response", "path", "cpu_ms", "bytes", "speedup"])
+    server.client.close()
+    server.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--alerts", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    run(parser.parse_args())
@@ -0,0 +1,91 @@
+"""Shared helpers for the benchmark scripts.
+
+Benchmarks run the FastAPI app in-process against the MongoDB from backend/.env,
+using a throwaway database (BENCH_DB_NAME, default "onefam_bench") that is
+dropped afterwards, or against an in-memory mongomock-motor database with
+fake_mongo(). They need httpx in addition to the backend requirements.
+"""
+import os
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+def load_server():
+    """Import backend/server.py bound to the benchmark database"""
+    os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "onefam_bench")
+    # Benchmarks measure the endpoints, not the per-client rate limits
+    os.environ.setdefault("RATE_LIMIT_RULES", "[]")
+    # One login serves the whole run, which can outlast the usual 15 minutes
+    os.environ.setdefault("ACCESS_TOKEN_SECONDS", str(24 * 3600))
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    return server
+
+
+@asynccontextmanager
+async def api_client(app):
+    import httpx
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        # Apps without a login route (e.g. a replayed legacy handler) are used without a token
+        login = await http.post("/api/auth/login", json={"username": "onefam", "password": "Welcome1"})
+        if login.status_code == 200:
+            http.headers["Authorization"] = f"Bearer {login.json()['token']}"
+        yield http
+
+
+@contextmanager
+def fake_mongo(server):
+    """Point server at an in-memory mongomock-motor database (GridFS included) instead of MongoDB.
+    Timings then measure the API's own work rather than a real database's."""
+    from mongomock_motor import AsyncMongoMockClient, enabled_gridfs_integration
+    with enabled_gridfs_integration():
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[server.db.name]
+        server.photo_store = server.PhotoStore(server.db)
+        server.graph_index.db = server.db
+        yield server
+
+
+async def drop_bench_db(server):
+    await server.client.drop_database(server.db.name)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples_ms):
+    return {
+        "n": len(samples_ms),
+        "mean_ms": round(statistics.fmean(samples_ms), 3) if samples_ms else 0.0,
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+    }
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self.start) * 1000
+
+
+def print_table(rows, columns):
+    widths = [max(len(str(col)), *(len(str(row.get(col, ""))) for row in rows)) for col in columns]
+    print("  ".join(str(col).ljust(width) for col, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(col, "")).ljust(width) for col, width in zip(columns, widths)))
@@ -0,0 +1,107 @@
+"""A stand-in Redis server speaking just enough RESP for the response cache.
+
+    python benchmarks/fake_redis.py --port 6380
+    CACHE_URL=redis://127.0.0.1:6380 uvicorn server:app
+
+Supports PING, GET, SET (with EX/PX), INCR/INCRBY, DEL and FLUSHDB on a single in-memory
+keyspace; anything else gets an error reply.
+"""
+import argparse
+import asyncio
+import time
+
+
+class FakeRedis:
+    def __init__(self, port: int = 0):
+        self.port = port
+        self.data = {}
+        self.expires = {}
+        self.commands = 0
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"redis://{host}:{port}/0"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", self.port)
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def _live(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def _execute(self, args) -> bytes:
+        command = args[0].upper()
+        self.commands += 1
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command == b"GET":
+            value = self._live(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET":
+            key, value = args[1], args[2]
+            self.data[key] = value
+            self.expires.pop(key, None)
+            options = [arg.upper() for arg in args[3:]]
+            for unit, scale in ((b"EX", 1), (b"PX", 0.001)):
+                if unit in options:
+                    self.expires[key] = time.monotonic() + int(args[3 + options.index(unit) + 1]) * scale
+            return b"+OK\r\n"
+        if command in (b"INCR", b"INCRBY"):
+            value = int(self._live(args[1]) or 0) + (int(args[2]) if command == b"INCRBY" else 1)
+            self.data[args[1]] = str(value).encode()
+            return b":%d\r\n" % value
+        if command == b"DEL":
+            removed = sum(self.data.pop(key, None) is not None for key in args[1:])
+            return b":%d\r\n" % removed
+        if command in (b"FLUSHDB", b"SELECT"):
+            if command == b"FLUSHDB":
+                self.data.clear()
+                self.expires.clear()
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % args[0]
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.startswith(b"*"):
+                    writer.write(b"-ERR inline commands are not supported\r\n")
+                    continue
+                args = []
+                for _ in range(int(line[1:])):
+                    size = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                writer.write(self._execute(args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def main(port: int):
+    fake = await FakeRedis(port).start()
+    print(f"Fake Redis listening on {fake.url}")
+    async with fake.server:
+        await fake.server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=6380)
+    try:
+        asyncio.run(main(parser.parse_args().port))
+    except KeyboardInterrupt:
+        pass
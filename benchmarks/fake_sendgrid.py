@@ -0,0 +1,104 @@
+"""A stand-in for SendGrid's mail/send endpoint, to exercise email delivery locally.
+
+    python benchmarks/fake_sendgrid.py --port 8025 --latency 0.05
+    SENDGRID_API_URL=http://127.0.0.1:8025 SENDGRID_API_KEY=fake uvicorn server:app
+
+Answers POST /v3/mail/send with 202 after --latency seconds (429 with Retry-After
+for a --throttle fraction of calls) and keeps every accepted request body.
+fail() queues the statuses the next calls are answered with, for tests of retries.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeSendGrid:
+    def __init__(self, port: int = 0, latency: float = 0.0, throttle: float = 0.0):
+        self.latency = latency
+        self.throttle = throttle
+        self.requests = []
+        self.failures = deque()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def recipients(self) -> int:
+        with self.lock:
+            return sum(len(body["personalizations"]) for body in self.requests)
+
+    def fail(self, *statuses: int):
+        """Answer the next len(statuses) calls with these statuses instead of accepting them"""
+        with self.lock:
+            self.failures.extend(statuses)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path != "/v3/mail/send":
+                    return self._reply(404, b'{"errors": [{"message": "not found"}]}')
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    return self._reply(401, b'{"errors": [{"message": "unauthorized"}]}')
+                time.sleep(fake.latency)
+                with fake.lock:
+                    status = fake.failures.popleft() if fake.failures else None
+                if status:
+                    return self._reply(status, b'{"errors": [{"message": "injected failure"}]}', {"Retry-After": "0.1"} if status == 429 else None)
+                if random.random() < fake.throttle:
+                    return self._reply(429, b'{"errors": [{"message": "too many requests"}]}', {"Retry-After": "0.1"})
+                with fake.lock:
+                    fake.requests.append(json.loads(body))
+                self._reply(202, b"", {"X-Message-Id": uuid.uuid4().hex})
+
+            def _reply(self, status, body, headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per API call")
+    parser.add_argument("--throttle", type=float, default=0.0, help="fraction of calls answered with 429")
+    args = parser.parse_args()
+    fake = FakeSendGrid(args.port, args.latency, args.throttle)
+    print(f"Fake SendGrid listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"{len(fake.requests)} API calls, {fake.recipients} recipients")
@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import axios from 'axios';
 import { BrowserRouter, Routes, Route, Navigate } from 'react-router-dom';
 import './App.css';
 import Login from './pages/Login';
@@ -6,9 +7,54 @@ import Dashboard from './pages/Dashboard';
 import FamilyView from './pages/FamilyView';
 import { Toaster } from './components/ui/sonner';
 
-const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+export const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 export const API = `${BACKEND_URL}/api`;
 
+// Every API call carries the access token. When it has expired, the refresh token
+// gets a new one (once, however many calls failed at the same time) and the call is retried.
+axios.interceptors.request.use((config) => {
+  const token = localStorage.getItem('token');
+  if (token && config.url?.startsWith(API)) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
+let refreshing = null;
+
+const refreshAccessToken = async () => {
+  const refreshToken = localStorage.getItem('refreshToken');
+  if (!refreshToken) {
+    throw new Error('Not logged in');
+  }
+  const response = await axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken });
+  localStorage.setItem('token', response.data.token);
+  localStorage.setItem('refreshToken', response.data.refresh_token);
+  return response.data.token;
+};
+
+axios.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const { config, response } = error;
+    if (response?.status !== 401 || !config || config.retried || config.url?.startsWith(`${API}/auth/`)) {
+      throw error;
+    }
+    try {
+      refreshing = refreshing || refreshAccessToken().finally(() => { refreshing = null; });
+      const token = await refreshing;
+      config.retried = true;
+      config.headers.Authorization = `Bearer ${token}`;
+      return axios(config);
+    } catch (refreshError) {
+      localStorage.removeItem('token');
+      localStorage.removeItem('refreshToken');
+      window.location.assign('/login');
+      throw error;
+    }
+  }
+);
+
 function App() {
   const [token, setToken] = useState(localStorage.getItem('token'));
 
@@ -17,6 +63,7 @@ function App() {
       localStorage.setItem('token', token);
     } else {
       localStorage.removeItem('token');
+      localStorage.removeItem('refreshToken');
     }
   }, [token]);
 
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
-import { API } from '../App';
+import { API, BACKEND_URL } from '../App';
 import { toast } from 'sonner';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from './ui/dialog';
 import { Label } from './ui/label';
@@ -37,7 +37,7 @@ const AddMemberModal = ({ open, onClose, familyId, member, members, onSuccess })
         comments: member.comments || '',
         father_id: member.father_id || '',
         mother_id: member.mother_id || '',
-        photo_base64: member.photo_base64 || '',
+        photo_base64: '',
       });
     } else {
       setFormData({
@@ -55,6 +55,11 @@ const AddMemberModal = ({ open, onClose, familyId, member, members, onSuccess })
     }
   }, [member, open]);
 
+  // The preview is drawn at 128px, so the 512px thumbnail is sharp enough on any screen
+  const storedPhotoUrl = member?.photo_url
+    ? `${BACKEND_URL}${member.photo_url}${member.photo_sizes?.includes(512) ? '&size=512' : ''}`
+    : null;
+
   const handlePhotoUpload = (e) => {
     const file = e.target.files[0];
     if (file) {
@@ -76,15 +81,20 @@ const AddMemberModal = ({ open, onClose, familyId, member, members, onSuccess })
     setLoading(true);
 
     try {
+      const { photo_base64, ...fields } = formData;
       const submitData = {
-        ...formData,
+        ...fields,
         father_id: formData.father_id === 'root' ? null : formData.father_id || null,
         mother_id: formData.mother_id === 'root' ? null : formData.mother_id || null,
       };
+      // Only send a photo when a new one was picked; the stored one is kept otherwise
+      if (photo_base64) {
+        submitData.photo_base64 = photo_base64;
+      }
 
       if (member) {
-        // Update existing member
-        await axios.put(`${API}/families/${familyId}/members/${member.id}`, submitData);
+        // Update existing member; the version makes the server refuse to overwrite a newer edit
+        await axios.put(`${API}/families/${familyId}/members/${member.id}`, { ...submitData, version: member.version });
         toast.success('Member updated successfully!');
       } else {
         // Create new member
@@ -95,6 +105,10 @@ const AddMemberModal = ({ open, onClose, familyId, member, members, onSuccess })
       onSuccess();
       onClose();
     } catch (error) {
+      if (error.response?.status === 409) {
+        toast.error('Someone else changed this member. Reload to see their changes.');
+        return;
+      }
       toast.error(member ? 'Failed to update member' : 'Failed to add member');
     } finally {
       setLoading(false);
@@ -125,8 +139,12 @@ const AddMemberModal = ({ open, onClose, familyId, member, members, onSuccess })
                 border: '3px solid #2C4F42',
               }}
             >
-              {formData.photo_base64 ? (
-                <img src={formData.photo_base64} alt="Preview" className="w-full h-full object-cover" />
+              {formData.photo_base64 || storedPhotoUrl ? (
+                <img
+                  src={formData.photo_base64 || storedPhotoUrl}
+                  alt="Preview"
+                  className="w-full h-full object-cover"
+                />
               ) : (
                 <div className="w-full h-full flex items-center justify-center" style={{ color: '#2C4F42' }}>
                   <User size={64} />
@@ -1,6 +1,7 @@
 import React, { useState } from 'react';
 import { Pencil, Trash2, User, Cake, Heart, MapPin, ChevronRight, ArrowLeft, Users2 } from 'lucide-react';
 import { Button } from './ui/button';
+import { BACKEND_URL } from '../App';
 
 const CardsView = ({ members, onEdit, onDelete }) => {
   const [currentParentId, setCurrentParentId] = useState(null);
@@ -156,9 +157,9 @@ const CardsView = ({ members, onEdit, onDelete }) => {
                       border: '3px solid #2C4F42',
                     }}
                   >
-                    {member.photo_base64 ? (
+                    {member.photo_url ? (
                       <img
-                        src={member.photo_base64}
+                        src={`${BACKEND_URL}${member.photo_thumbnail_url || member.photo_url}`}
                         alt={`${member.first_name} ${member.last_name}`}
                         className="w-full h-full object-cover"
                       />
@@ -1,39 +1,30 @@
 import React from 'react';
 import { Pencil, Trash2, User, Cake, Heart } from 'lucide-react';
+import { BACKEND_URL } from '../App';
 
-const TreeView = ({ members, onEdit, onDelete }) => {
-  // Build tree structure with both parents support
+const TreeView = ({ members, tree, onEdit, onDelete }) => {
+  // The hierarchy is laid out by the server (GET /families/:id/tree); here it is
+  // only joined with the member details. A child is drawn under its first parent.
   const buildTree = () => {
+    if (!tree) {
+      return [];
+    }
+
     const memberMap = {};
     members.forEach((member) => {
       memberMap[member.id] = { ...member, children: [] };
     });
 
-    const roots = [];
-    const addedToParent = new Set();
-
-    members.forEach((member) => {
-      // Add to father's children if father exists
-      if (member.father_id && memberMap[member.father_id]) {
-        if (!addedToParent.has(member.id)) {
-          memberMap[member.father_id].children.push(memberMap[member.id]);
-          addedToParent.add(member.id);
-        }
-      }
-      // Add to mother's children if mother exists and not already added
-      else if (member.mother_id && memberMap[member.mother_id]) {
-        if (!addedToParent.has(member.id)) {
-          memberMap[member.mother_id].children.push(memberMap[member.id]);
-          addedToParent.add(member.id);
-        }
-      }
-      // If no parents, add to roots
-      else if (!member.father_id && !member.mother_id) {
-        roots.push(memberMap[member.id]);
+    Object.entries(tree.nodes).forEach(([memberId, node]) => {
+      if (!memberMap[memberId]) {
+        return;
       }
+      memberMap[memberId].children = node.children
+        .filter((childId) => memberMap[childId] && tree.nodes[childId].parents[0] === memberId)
+        .map((childId) => memberMap[childId]);
     });
 
-    return roots;
+    return tree.roots.filter((rootId) => memberMap[rootId]).map((rootId) => memberMap[rootId]);
   };
 
   const TreeNode = ({ node, level = 0 }) => {
@@ -71,9 +62,9 @@ const TreeView = ({ members, onEdit, onDelete }) => {
                 border: '2px solid #2C4F42',
               }}
             >
-              {node.photo_base64 ? (
+              {node.photo_url ? (
                 <img
-                  src={node.photo_base64}
+                  src={`${BACKEND_URL}${node.photo_thumbnail_url || node.photo_url}`}
                   alt={`${node.first_name} ${node.last_name}`}
                   className="w-full h-full object-cover"
                 />
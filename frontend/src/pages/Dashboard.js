@@ -52,6 +52,7 @@ const Dashboard = ({ setToken }) => {
     }
 
     try {
+      // The family disappears at once; its members and photos are removed in the background
       await axios.delete(`${API}/families/${familyId}`);
       toast.success('Family deleted successfully');
       loadFamilies();
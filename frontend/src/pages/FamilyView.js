@@ -1,9 +1,9 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import { useParams, useNavigate } from 'react-router-dom';
 import { API } from '../App';
 import { toast } from 'sonner';
-import { ArrowLeft, Plus, Bell, Calendar, Grid3x3, GitBranch, Users2, Mail } from 'lucide-react';
+import { ArrowLeft, Plus, Bell, Calendar, Grid3x3, GitBranch, Users2, Mail, Upload, Download } from 'lucide-react';
 import TreeView from '../components/TreeView';
 import CardsView from '../components/CardsView';
 import AddMemberModal from '../components/AddMemberModal';
@@ -17,6 +17,7 @@ const FamilyView = ({ setToken }) => {
   const navigate = useNavigate();
   const [family, setFamily] = useState(null);
   const [members, setMembers] = useState([]);
+  const [tree, setTree] = useState(null);
   const [alerts, setAlerts] = useState([]);
   const [loading, setLoading] = useState(true);
   const [viewMode, setViewMode] = useState('tree'); // 'tree' or 'cards'
@@ -24,6 +25,8 @@ const FamilyView = ({ setToken }) => {
   const [showAlertsPanel, setShowAlertsPanel] = useState(false);
   const [showEventsCalendar, setShowEventsCalendar] = useState(false);
   const [selectedMember, setSelectedMember] = useState(null);
+  const [importing, setImporting] = useState(false);
+  const importInput = useRef(null);
 
   useEffect(() => {
     loadFamilyData();
@@ -31,16 +34,18 @@ const FamilyView = ({ setToken }) => {
 
   const loadFamilyData = async () => {
     try {
-      const [familiesRes, membersRes, alertsRes] = await Promise.all([
-        axios.get(`${API}/families`),
-        axios.get(`${API}/families/${familyId}/members`),
-        axios.get(`${API}/families/${familyId}/alerts`),
+      const [snapshotRes, treeRes] = await Promise.all([
+        // Alerts count days from today in the viewer's timezone
+        axios.get(`${API}/families/${familyId}/snapshot`, {
+          params: { tz: Intl.DateTimeFormat().resolvedOptions().timeZone },
+        }),
+        axios.get(`${API}/families/${familyId}/tree`),
       ]);
 
-      const currentFamily = familiesRes.data.find((f) => f.id === familyId);
-      setFamily(currentFamily);
-      setMembers(membersRes.data);
-      setAlerts(alertsRes.data);
+      setFamily(snapshotRes.data.family);
+      setMembers(snapshotRes.data.members);
+      setTree(treeRes.data);
+      setAlerts(snapshotRes.data.alerts);
     } catch (error) {
       toast.error('Failed to load family data');
     } finally {
@@ -72,6 +77,52 @@ const FamilyView = ({ setToken }) => {
     }
   };
 
+  const handleImport = async (event) => {
+    const file = event.target.files[0];
+    event.target.value = '';
+    if (!file) {
+      return;
+    }
+
+    setImporting(true);
+    try {
+      // The file is sent as the raw request body so the server can parse it as it arrives
+      // The server detects the format (and gzip) from the first bytes of the file
+      const { data } = await axios.post(`${API}/families/${familyId}/import`, file, {
+        headers: { 'Content-Type': 'application/octet-stream' },
+      });
+      if (data.error_count > 0) {
+        const first = data.errors[0];
+        toast.warning(`Imported ${data.imported} of ${data.rows} members, ${data.error_count} problem(s): row ${first.row}: ${first.error}`);
+      } else {
+        toast.success(`Imported ${data.imported} members`);
+      }
+      loadFamilyData();
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'Failed to import members');
+    } finally {
+      setImporting(false);
+    }
+  };
+
+  const handleExport = async () => {
+    try {
+      // A backup that Import restores, photos included
+      const response = await axios.get(`${API}/families/${familyId}/export`, {
+        params: { format: 'ndjson', photos: true, compress: true },
+        responseType: 'blob',
+      });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `${family.name}.ndjson.gz`;
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      toast.error('Failed to export family');
+    }
+  };
+
   const upcomingAlertsCount = alerts.filter((a) => a.days_until <= 7).length;
 
   if (loading) {
@@ -150,6 +201,38 @@ const FamilyView = ({ setToken }) => {
                 Add Member
               </button>
 
+              <input
+                ref={importInput}
+                type="file"
+                accept=".csv,.ged,.gedcom,.ndjson,.gz"
+                className="hidden"
+                onChange={handleImport}
+              />
+              <button
+                data-testid="import-members-button"
+                onClick={() => importInput.current.click()}
+                disabled={importing}
+                className="flex items-center gap-2 rounded-full px-4 py-2 text-sm font-serif italic"
+                style={{
+                  color: '#2C4F42',
+                  border: '1px solid rgba(44, 79, 66, 0.2)',
+                  opacity: importing ? 0.6 : 1,
+                }}
+              >
+                <Upload size={16} />
+                {importing ? 'Importing...' : 'Import'}
+              </button>
+
+              <button
+                data-testid="export-family-button"
+                onClick={handleExport}
+                className="flex items-center gap-2 rounded-full px-4 py-2 text-sm font-serif italic"
+                style={{ color: '#2C4F42', border: '1px solid rgba(44, 79, 66, 0.2)' }}
+              >
+                <Download size={16} />
+                Export
+              </button>
+
               <button
                 data-testid="alerts-button"
                 onClick={() => setShowAlertsPanel(true)}
@@ -251,6 +334,7 @@ const FamilyView = ({ setToken }) => {
             {viewMode === 'tree' && (
               <TreeView
                 members={members}
+                tree={tree}
                 onEdit={handleEditMember}
                 onDelete={handleDeleteMember}
               />
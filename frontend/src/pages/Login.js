@@ -21,6 +21,7 @@ const Login = ({ setToken }) => {
         password,
       });
 
+      localStorage.setItem('refreshToken', response.data.refresh_token);
       setToken(response.data.token);
       toast.success('Welcome to OneFam!');
       navigate('/');
@@ -0,0 +1,34 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+# The backend modules import each other flat, as they do under uvicorn
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# Tests fire requests far faster than any client should; rate limits have their own tests
+os.environ.setdefault("RATE_LIMIT_RULES", "[]")
+# server.py reads these on import; with the api fixture no MongoDB is contacted
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "onefam_test")
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """A logged-in TestClient for the API running against an empty mongomock database, GridFS included"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import cache
+    import server
+
+    db = mongomock_motor.AsyncMongoMockClient()["onefam_test"]
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server.graph_index, "db", db)
+    monkeypatch.setattr(server, "response_cache", cache.ResponseCache(cache.LRUBackend()))
+    with mongomock_motor.enabled_gridfs_integration(), TestClient(server.app) as client:
+        # The GridFS bucket binds to the running event loop, which is the client's
+        monkeypatch.setattr(server, "photo_store", client.portal.call(server.PhotoStore, db))
+        token = client.post("/api/auth/login", json={"username": "onefam", "password": "Welcome1"}).json()["token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
@@ -0,0 +1,28 @@
+"""Alerts and send-alerts: counted in the family's timezone, and gone as soon as the family is deleted."""
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import server
+import timezones
+
+
+def test_a_deleted_familys_alerts_and_emails_stop_at_once(api):
+    family_id = api.post("/api/families", json={"name": "Curie", "timezone": "Europe/Paris"}).json()["id"]
+    tomorrow = timezones.local_today("Europe/Paris") + timedelta(days=1)
+    api.post(f"/api/families/{family_id}/members", json={
+        "first_name": "Marie", "last_name": "Curie", "email": "marie@example.com", "birthday": f"1867-{tomorrow:%m-%d}",
+    })
+
+    alerts = api.get(f"/api/families/{family_id}/alerts").json()
+    assert [(alert["title"], alert["days_until"]) for alert in alerts] == [("Marie Curie's Birthday", 1)]
+    assert api.post(f"/api/families/{family_id}/send-alerts").json()["recipients"] == 1
+
+    # The delete job has not run, so the calendar rows are still there
+    assert api.delete(f"/api/families/{family_id}").status_code == 202
+    assert api.portal.call(server.db.occurrences.count_documents, {"family_id": family_id}) == 1
+    for tz in (None, "Asia/Tokyo"):
+        assert api.get(f"/api/families/{family_id}/alerts", params={"tz": tz} if tz else {}).status_code == 404
+    assert api.post(f"/api/families/{family_id}/send-alerts").status_code == 404
@@ -0,0 +1,80 @@
+"""Access and refresh tokens: expiry, the verified-token cache, and which routes need a token."""
+import os
+import time
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "onefam_test")
+
+import auth
+import server
+
+SECRET = "test-secret"
+
+
+def test_verify_caches_by_signature():
+    verifier = auth.TokenVerifier(SECRET)
+    token = verifier.issue("onefam")
+    assert verifier.verify(token)["sub"] == "onefam"
+    assert verifier.verify(token)["sub"] == "onefam"
+    assert verifier.info()["hits"] == 1
+    assert verifier.info()["misses"] == 1
+
+
+def test_cached_signature_does_not_vouch_for_another_payload():
+    verifier = auth.TokenVerifier(SECRET)
+    token = verifier.issue("onefam")
+    verifier.verify(token)
+    header, _, signature = token.split(".")
+    forged_payload = jwt.encode({"sub": "admin", "type": "access", "exp": int(time.time()) + 60}, "other").split(".")[1]
+    with pytest.raises(auth.InvalidToken):
+        verifier.verify(f"{header}.{forged_payload}.{signature}")
+
+
+def test_expiry_is_enforced_on_cache_hits(monkeypatch):
+    verifier = auth.TokenVerifier(SECRET, access_seconds=60)
+    token = verifier.issue("onefam")
+    verifier.verify(token)
+    later = time.time() + 61
+    monkeypatch.setattr(auth.time, "time", lambda: later)
+    with pytest.raises(auth.InvalidToken, match="expired"):
+        verifier.verify(token)
+    assert verifier.info()["entries"] == 0
+
+
+def test_token_types_are_not_interchangeable():
+    verifier = auth.TokenVerifier(SECRET)
+    with pytest.raises(auth.InvalidToken):
+        verifier.verify(verifier.issue("onefam", auth.REFRESH))
+    with pytest.raises(auth.InvalidToken):
+        verifier.verify(verifier.issue("onefam"), auth.REFRESH)
+
+
+def test_tokens_without_expiry_are_refused():
+    verifier = auth.TokenVerifier(SECRET)
+    with pytest.raises(auth.InvalidToken):
+        verifier.verify(jwt.encode({"username": "onefam"}, SECRET, algorithm=auth.ALGORITHM))
+
+
+def test_cache_is_bounded():
+    verifier = auth.TokenVerifier(SECRET, max_entries=2)
+    for subject in ("a", "b", "c"):
+        verifier.verify(verifier.issue(subject))
+    assert verifier.info()["entries"] == 2
+
+
+def test_api_routes_need_an_access_token():
+    # Without the context manager no startup hooks run, so no database is needed
+    client = TestClient(server.app)
+    assert client.get("/api/families").status_code == 401
+    assert client.get("/api/families", headers={"Authorization": "Bearer nonsense"}).status_code == 401
+
+    tokens = client.post("/api/auth/login", json={"username": "onefam", "password": "Welcome1"}).json()
+    assert tokens["expires_in"] == auth.ACCESS_TOKEN_SECONDS
+    refreshed = client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert refreshed.status_code == 200
+    assert client.post("/api/auth/refresh", json={"refresh_token": tokens["token"]}).status_code == 401
+    assert client.get("/api/admin/auth-stats", headers={"Authorization": f"Bearer {refreshed.json()['token']}"}).status_code == 200
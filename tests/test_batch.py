@@ -0,0 +1,117 @@
+"""POST /families/{id}/batch: refs, per-operation results when a write fails or a version went stale, and members
+deleted under an event."""
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import server
+
+
+@pytest.fixture
+def family(api):
+    return api.post("/api/families", json={"name": "Curie"}).json()["id"]
+
+
+def stored(api, collection: str, record_id: str):
+    return api.portal.call(server.db[collection].find_one, {"id": record_id}, {"_id": 0})
+
+
+def batch(api, family_id: str, *operations):
+    return api.post(f"/api/families/{family_id}/batch", json={"operations": list(operations)})
+
+
+def test_refs_name_records_created_earlier_in_the_batch(api, family):
+    response = batch(
+        api, family,
+        {"op": "create", "type": "member", "ref": "pierre", "data": {"first_name": "Pierre", "last_name": "Curie"}},
+        {"op": "create", "type": "member", "ref": "irene", "data": {"first_name": "Irène", "last_name": "Curie", "father_id": "pierre"}},
+        {"op": "create", "type": "event", "data": {"event_name": "Nobel Prize", "event_date": "1935-12-10", "member_id": "irene"}},
+        {"op": "update", "type": "member", "id": "irene", "data": {"last_name": "Joliot-Curie"}},
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == ["created", "created", "created", "updated"]
+    pierre, irene, event = (result["id"] for result in results[:3])
+    assert results[3]["id"] == irene and results[3]["version"] == 1
+    assert (stored(api, "family_members", irene)["father_id"], stored(api, "family_members", irene)["last_name"]) == (pierre, "Joliot-Curie")
+    assert stored(api, "custom_events", event)["member_id"] == irene
+
+    invalid = batch(api, family, {"op": "create", "type": "member", "data": {"first_name": "Ève", "last_name": "Curie", "mother_id": "marie"}})
+    assert invalid.status_code == 422
+    assert invalid.json()["results"][0]["error"] == "mother_id 'marie' is not a member of this family"
+
+
+def test_a_failed_write_marks_the_operations_it_stopped(api, family, monkeypatch):
+    other = api.post("/api/families", json={"name": "Other"}).json()["id"]
+    api.portal.call(server.db.family_members.insert_one, {"id": "taken", "family_id": other, "first_name": "Taken", "last_name": "Id"})
+    existing = api.post(f"/api/families/{family}/members", json={"first_name": "Pierre", "last_name": "Curie"}).json()["id"]
+    # The second new member gets an id another family already has, which the unique index refuses
+    ids = iter(["marie", "taken"])
+    monkeypatch.setattr(server.uuid, "uuid4", lambda: next(ids))
+
+    response = batch(
+        api, family,
+        {"op": "create", "type": "member", "data": {"first_name": "Marie", "last_name": "Curie"}},
+        {"op": "create", "type": "member", "data": {"first_name": "Irène", "last_name": "Curie"}},
+        {"op": "update", "type": "member", "id": existing, "data": {"comments": "Physicist"}},
+        {"op": "delete", "type": "member", "id": existing},
+    )
+    assert response.status_code == 409
+    body = response.json()
+    assert body["applied"] is False
+    assert [result["status"] for result in body["results"]] == ["created", "failed", "skipped", "skipped"]
+    # Without a transaction the writes before the failure stay
+    assert stored(api, "family_members", "marie")["family_id"] == family
+    assert stored(api, "family_members", existing)["comments"] is None
+
+
+def test_an_event_cannot_point_at_a_member_deleted_later(api, family):
+    pierre = api.post(f"/api/families/{family}/members", json={"first_name": "Pierre", "last_name": "Curie"}).json()["id"]
+    event = api.post(f"/api/families/{family}/events", json={"event_name": "Wedding", "event_date": "1895-07-26"}).json()["id"]
+
+    response = batch(
+        api, family,
+        {"op": "create", "type": "event", "data": {"event_name": "Nobel Prize", "event_date": "1903-12-10", "member_id": pierre}},
+        {"op": "update", "type": "event", "id": event, "data": {"member_id": pierre}},
+        {"op": "delete", "type": "member", "id": pierre},
+    )
+    assert response.status_code == 422
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == ["invalid", "invalid", "deleted"]
+    assert results[0]["error"] == f"member_id '{pierre}' is deleted later in this batch (operation 2)"
+    assert stored(api, "family_members", pierre) is not None
+    assert stored(api, "custom_events", event)["member_id"] is None
+
+    after = batch(
+        api, family,
+        {"op": "delete", "type": "member", "id": pierre},
+        {"op": "create", "type": "event", "data": {"event_name": "Nobel Prize", "event_date": "1903-12-10", "member_id": pierre}},
+    )
+    assert after.status_code == 422
+    assert after.json()["results"][1]["error"] == f"member_id '{pierre}' is not a member of this family"
+
+
+def test_a_member_changed_after_planning_is_a_conflict(api, family, monkeypatch):
+    pierre = api.post(f"/api/families/{family}/members", json={"first_name": "Pierre", "last_name": "Curie"}).json()["id"]
+    marie = api.post(f"/api/families/{family}/members", json={"first_name": "Marie", "last_name": "Curie"}).json()["id"]
+    # Another request updates Pierre between the batch being planned and written
+    plan_batch = server.plan_batch
+    async def planned_then_changed(family_id, operations):
+        plan = await plan_batch(family_id, operations)
+        await server.db.family_members.update_one({"id": pierre}, {"$set": {"comments": "Elsewhere"}, "$inc": {"version": 1}})
+        return plan
+    monkeypatch.setattr(server, "plan_batch", planned_then_changed)
+
+    response = batch(
+        api, family,
+        {"op": "update", "type": "member", "id": marie, "data": {"comments": "Chemist", "version": 0}},
+        {"op": "update", "type": "member", "id": pierre, "data": {"comments": "Physicist", "version": 0}},
+        {"op": "update", "type": "member", "id": marie, "data": {"address": "Paris"}},
+    )
+    assert response.status_code == 409
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == ["updated", "conflict", "skipped"]
+    assert results[1]["error"] == "Member was changed by someone else (expected version 0)"
+    assert (stored(api, "family_members", pierre)["comments"], stored(api, "family_members", pierre)["version"]) == ("Elsewhere", 1)
+    assert (stored(api, "family_members", marie)["comments"], stored(api, "family_members", marie)["address"]) == ("Chemist", None)
@@ -0,0 +1,39 @@
+"""The versioned response cache: writes bump the family's version, and the LRU bounds versions as well as entries."""
+import asyncio
+
+import cache
+import server
+
+
+def test_a_write_bumps_the_family_version_and_the_next_read_misses(api):
+    family_id = api.post("/api/families", json={"name": "Curie"}).json()["id"]
+    members = f"/api/families/{family_id}/members"
+    stats = server.response_cache.stats
+    version = api.portal.call(server.response_cache.version, family_id)
+
+    assert api.get(members).json() == []
+    misses = stats["misses"]
+    assert api.get(members).json() == []
+    assert (stats["hits"], stats["misses"]) == (1, misses)
+
+    api.post(members, json={"first_name": "Marie", "last_name": "Curie"})
+    assert api.portal.call(server.response_cache.version, family_id) > version
+    assert [member["first_name"] for member in api.get(members).json()] == ["Marie"]
+    assert (stats["hits"], stats["misses"]) == (1, misses + 1)
+
+
+def test_lru_versions_are_bounded_and_never_reused():
+    async def check():
+        backend = cache.LRUBackend(max_entries=2)
+        responses = cache.ResponseCache(backend)
+        key = responses.key("f1", await responses.version("f1"), "members", {})
+        await responses.set(key, b"[]", {})
+        await responses.bump("f2")
+        await responses.bump("f3")
+        # f1's version was evicted with its entry still cached; its new version must not find it
+        assert backend.info()["versions"] == 2 and backend.stats["version_evictions"] == 1
+        assert responses.key("f1", await responses.version("f1"), "members", {}) != key
+        assert await responses.get(key) == (b"[]", {})
+        assert len(backend.versions) == 2
+
+    asyncio.run(check())
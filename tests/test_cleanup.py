@@ -0,0 +1,174 @@
+"""Family deletes and the orphan sweep, run as jobs against mongomock with GridFS photos."""
+import asyncio
+import io
+from datetime import timedelta
+
+import pytest
+from PIL import Image
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import cleanup
+import indexes
+import jobs
+from photo_store import PhotoStore
+
+PHOTO = io.BytesIO()
+Image.new("RGB", (64, 48), "teal").save(PHOTO, "PNG")
+
+ROW_COLLECTIONS = ("family_members", "custom_events", "occurrences", "reminder_log")
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    # Several batches per stage, without the pause between them
+    monkeypatch.setattr(cleanup, "DELETE_BATCH_SIZE", 2)
+    monkeypatch.setattr(cleanup, "DELETE_BATCH_PAUSE_SECONDS", 0)
+
+
+def run(test):
+    """Run test(db, store) on a fresh mongomock database, inside the event loop GridFS binds to"""
+    async def main():
+        db = mongomock_motor.AsyncMongoMockClient()["onefam_test"]
+        await indexes.ensure_indexes(db)
+        await test(db, PhotoStore(db))
+    with mongomock_motor.enabled_gridfs_integration():
+        asyncio.run(main())
+
+
+async def add_family(db, store, family_id: str, members: int = 3, **fields):
+    await db.families.insert_one({"id": family_id, "name": family_id, **fields})
+    await add_rows(db, store, family_id, members)
+
+
+async def add_rows(db, store, family_id: str, members: int = 3):
+    for i in range(members):
+        member_id = f"{family_id}-m{i}"
+        await db.family_members.insert_one({"id": member_id, "family_id": family_id, "first_name": "Member", "last_name": str(i)})
+        await store.save(member_id, family_id, PHOTO.getvalue())
+        await db.custom_events.insert_one({"id": f"{family_id}-e{i}", "family_id": family_id, "event_name": "Event", "event_date": "2000-01-01"})
+        await db.occurrences.insert_one({"family_id": family_id, "kind": "birthday", "source_id": member_id})
+        await db.reminder_log.insert_one({"family_id": family_id, "event_key": member_id, "date": "2000-01-01", "recipient": "a@example.com"})
+    await jobs.enqueue(db, "reminder_send", {}, family_id=family_id)
+
+
+async def rows(db, store, family_id: str) -> dict:
+    counts = {collection: await db[collection].count_documents({"family_id": family_id}) for collection in ROW_COLLECTIONS}
+    counts["photos"] = await db[f"{store.bucket_name}.files"].count_documents({"metadata.family_id": family_id})
+    counts["family"] = await db.families.count_documents({"id": family_id})
+    return counts
+
+
+def handlers(db, store) -> dict:
+    return {
+        cleanup.DELETE_KIND: lambda job: cleanup.delete_family(db, store, job),
+        cleanup.SWEEP_KIND: lambda job: cleanup.sweep(db, store, job),
+    }
+
+
+async def run_due(db, worker):
+    """Make every queued job due, then run them all"""
+    await db.jobs.update_many({"status": jobs.QUEUED}, {"$set": {"run_at": jobs.utcnow() - timedelta(seconds=1)}})
+    while await worker.run_once():
+        pass
+
+
+def test_an_interrupted_delete_resumes_where_it_stopped(monkeypatch):
+    async def test(db, store):
+        await add_family(db, store, "gone", deleted_at=jobs.utcnow())
+        await add_family(db, store, "kept")
+        kept = await rows(db, store, "kept")
+        job = await cleanup.enqueue_delete(db, "gone")
+        worker = jobs.Worker(db, handlers(db, store), worker_id="w1")
+
+        # The worker dies once the first stage is done
+        delete_batch = cleanup._delete_batch
+        async def dies_after_the_first_stage(db, store, job, stage):
+            if stage == cleanup.STAGES[1]:
+                raise ConnectionError("worker lost")
+            return await delete_batch(db, store, job, stage)
+        monkeypatch.setattr(cleanup, "_delete_batch", dies_after_the_first_stage)
+        assert await worker.run_once()
+
+        stopped = await db.jobs.find_one({"id": job["id"]})
+        assert (stopped["status"], stopped["result"]["stage"]) == (jobs.QUEUED, cleanup.STAGES[0])
+        assert stopped["result"]["deleted"]["occurrences"] == 3
+        left = await rows(db, store, "gone")
+        assert left["occurrences"] == 0 and left["family_members"] == 3 and left["photos"] > 0
+
+        monkeypatch.setattr(cleanup, "_delete_batch", delete_batch)
+        await run_due(db, worker)
+        done = await db.jobs.find_one({"id": job["id"]})
+        assert (done["status"], done["attempts"], done["result"]["stage"]) == (jobs.DONE, 2, jobs.DONE)
+        assert await rows(db, store, "gone") == dict.fromkeys([*ROW_COLLECTIONS, "photos", "family"], 0)
+        assert done["result"]["deleted"] == {**done["result"]["total"], "jobs": 1, "family": 1}
+        assert await db.jobs.count_documents({"family_id": "gone", "kind": "reminder_send"}) == 0
+        assert await rows(db, store, "kept") == kept
+
+    run(test)
+
+
+def test_a_delete_stops_when_another_worker_takes_it_over():
+    async def test(db, store):
+        await add_family(db, store, "gone", deleted_at=jobs.utcnow())
+        await cleanup.enqueue_delete(db, "gone")
+        job = await jobs.claim(db, "w1")
+        # The lease ran out and w2 claimed the job: w1's heartbeat no longer matches
+        await db.jobs.update_one({"id": job["id"]}, {"$set": {"locked_by": "w2"}})
+        assert not await jobs.heartbeat(db, job)
+        with pytest.raises(jobs.RetryableJobError):
+            await cleanup.delete_family(db, store, job)
+        assert (await rows(db, store, "gone"))["family_members"] == 3
+
+    run(test)
+
+
+def test_a_live_family_is_not_deleted():
+    async def test(db, store):
+        await add_family(db, store, "kept")
+        await cleanup.enqueue_delete(db, "kept")
+        worker = jobs.Worker(db, handlers(db, store))
+        assert await worker.run_once()
+        job = await db.jobs.find_one({"kind": cleanup.DELETE_KIND})
+        assert (job["status"], job["last_error"]) == (jobs.DEAD, "Family is not marked deleted")
+        assert (await rows(db, store, "kept"))["family_members"] == 3
+
+    run(test)
+
+
+def test_sweep_removes_only_what_is_orphaned(monkeypatch):
+    # Photos uploaded during the test count as old enough to sweep
+    monkeypatch.setattr(cleanup, "PHOTO_GRACE_SECONDS", -60)
+
+    async def test(db, store):
+        await add_family(db, store, "kept")
+        await add_family(db, store, "soft", deleted_at=jobs.utcnow())
+        await add_family(db, store, "pending", deleted_at=jobs.utcnow())
+        await cleanup.enqueue_delete(db, "pending")
+        # Rows whose family document is gone, and a photo whose member is gone
+        await add_rows(db, store, "vanished", members=2)
+        await db.occurrences.insert_one({"family_id": "no-family", "kind": "custom", "source_id": "e1"})
+        kept = await rows(db, store, "kept")
+        await store.save("ghost", "kept", PHOTO.getvalue())
+
+        result = await cleanup.sweep(db, store)
+        assert result == {"deletes_queued": ["no-family", "soft", "vanished"], "orphaned_families": ["no-family", "vanished"], "orphaned_photos_deleted": 1}
+        assert await rows(db, store, "kept") == kept
+        assert await db.jobs.count_documents({"kind": cleanup.DELETE_KIND, "family_id": "pending"}) == 1
+
+        await run_due(db, jobs.Worker(db, handlers(db, store)))
+        for family_id in ("soft", "pending", "vanished", "no-family"):
+            assert not any((await rows(db, store, family_id)).values()), family_id
+        assert await rows(db, store, "kept") == kept
+        assert await db.jobs.count_documents({"kind": cleanup.DELETE_KIND, "status": {"$ne": jobs.DONE}}) == 0
+
+    run(test)
+
+
+def test_one_sweep_is_queued_per_window():
+    async def test(db, store):
+        sweepers = [cleanup.Sweeper(db, interval=3600) for _ in range(3)]
+        assert [await sweeper.queue_due() for sweeper in sweepers] == [True, False, False]
+        assert await db.jobs.count_documents({"kind": cleanup.SWEEP_KIND}) == 1
+
+    run(test)
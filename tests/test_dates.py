@@ -0,0 +1,83 @@
+"""Birthdays, anniversaries and event dates: checked on write, stored with their date parts, filtered in the query."""
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import occurrences
+import server
+
+
+@pytest.fixture
+def family(api):
+    return f"/api/families/{api.post('/api/families', json={'name': 'Curie'}).json()['id']}"
+
+
+def stored(api, collection: str, record_id: str) -> dict:
+    return api.portal.call(server.db[collection].find_one, {"id": record_id}, {"_id": 0})
+
+
+def test_dates_are_checked_and_stored_with_their_parts(api, family):
+    assert api.post(f"{family}/members", json={"first_name": "Marie", "last_name": "Curie", "birthday": "1867-02-30"}).status_code == 422
+    assert api.post(f"{family}/events", json={"event_name": "Nobel Prize", "event_date": ""}).status_code == 422
+
+    marie = api.post(f"{family}/members", json={"first_name": "Marie", "last_name": "Curie", "birthday": "1867-11-7", "anniversary": ""}).json()
+    assert marie["birthday"] == "1867-11-07" and marie["anniversary"] is None
+    doc = stored(api, "family_members", marie["id"])
+    assert (doc["birthday_on"].year, doc["birthday_month"], doc["birthday_day"]) == (1867, 11, 7)
+    assert "anniversary_month" not in doc
+
+    api.put(f"{family}/members/{marie['id']}", json={"birthday": None, "anniversary": "1895-07-26"})
+    doc = stored(api, "family_members", marie["id"])
+    assert "birthday_month" not in doc and "birthday_on" not in doc
+    assert doc["anniversary_month"] == 7
+    assert "anniversary_month" not in api.get(f"{family}/members").json()[0]
+
+
+def test_events_are_filtered_by_month_and_year_in_the_query(api, family):
+    for name, day in (("Nobel Physics", "1903-12-10"), ("Nobel Chemistry", "1911-12-10"), ("Radium", "1898-12-26"), ("Sorbonne", "1906-11-05")):
+        api.post(f"{family}/events", json={"event_name": name, "event_date": day})
+
+    def names(**params):
+        return sorted(event["event_name"] for event in api.get(f"{family}/events", params=params).json())
+
+    assert names(month=12) == ["Nobel Chemistry", "Nobel Physics", "Radium"]
+    assert names(year=1911) == ["Nobel Chemistry"]
+    assert names(month=12, year=1903) == ["Nobel Physics"]
+    assert api.get(f"{family}/events", params={"month": 13}).status_code == 422
+
+
+def test_batch_rejects_invalid_dates_and_stores_parts(api, family):
+    response = api.post(f"{family}/batch", json={"operations": [
+        {"op": "create", "type": "event", "ref": "prize", "data": {"event_name": "Nobel Prize", "event_date": "1911-12-10"}},
+        {"op": "create", "type": "member", "data": {"first_name": "Irène", "last_name": "Curie", "birthday": "12/09/1897"}},
+    ]})
+    assert response.status_code == 422
+    assert "is not a YYYY-MM-DD date" in response.json()["results"][1]["error"]
+
+    created = api.post(f"{family}/batch", json={"operations": [
+        {"op": "create", "type": "event", "data": {"event_name": "Nobel Prize", "event_date": "1911-12-10"}},
+    ]}).json()["results"][0]
+    event_id = created["id"]
+    api.post(f"{family}/batch", json={"operations": [{"op": "update", "type": "event", "id": event_id, "data": {"event_date": "1911-11-07"}}]})
+    assert stored(api, "custom_events", event_id)["event_month"] == 11
+
+
+def test_a_gedcom_marriage_date_is_stored_with_its_parts(api, family):
+    gedcom = (
+        "0 HEAD\n0 @I1@ INDI\n1 NAME Pierre /Curie/\n0 @I2@ INDI\n1 NAME Marie /Curie/\n"
+        "0 @F1@ FAM\n1 HUSB @I1@\n1 WIFE @I2@\n1 MARR\n2 DATE 26 JUL 1895\n0 TRLR\n"
+    )
+    report = api.post(f"{family}/import", params={"format": "gedcom"}, content=gedcom).json()
+    assert (report["imported"], report["errors"]) == (2, [])
+    for member in api.get(f"{family}/members").json():
+        doc = stored(api, "family_members", member["id"])
+        assert (doc["anniversary"], doc["anniversary_on"].year, doc["anniversary_month"], doc["anniversary_day"]) == ("1895-07-26", 1895, 7, 26)
+
+
+def test_date_parts():
+    parts, cleared = occurrences.date_parts({"birthday": "2000-02-29", "anniversary": None})
+    assert (parts["birthday_month"], parts["birthday_day"]) == (2, 29)
+    assert cleared == occurrences.part_fields("anniversary")
+    with pytest.raises(ValueError):
+        occurrences.validate_date("2001-02-29")
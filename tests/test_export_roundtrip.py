@@ -0,0 +1,109 @@
+"""Export a family and import it into a new one: the copy must match the original field for field.
+
+Runs the API in-process against mongomock (no MongoDB needed), through the
+api fixture in conftest.py; photos are not covered here.
+"""
+import gzip
+import json
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import member_import
+import server
+
+
+def create_family(api) -> str:
+    family_id = api.post("/api/families", json={"name": "Lovelace", "timezone": "Europe/London"}).json()["id"]
+
+    def add(**fields):
+        response = api.post(f"/api/families/{family_id}/members", json=fields)
+        assert response.status_code == 200
+        return response.json()["id"]
+
+    george = add(first_name="George", last_name="Byron", birthday="1788-01-22", anniversary="1815-01-02", email="george@example.com")
+    anne = add(first_name="Anne", last_name="Milbanke", birthday="1792-05-17", anniversary="1815-01-02", timezone="Europe/Paris")
+    ada = add(
+        first_name="Ada", last_name="Lovelace", birthday="1815-12-10", father_id=george, mother_id=anne,
+        address="St James's Square\nLondon", comments="Wrote the first program, \"Note G\"; ünïcödé",
+    )
+    add(first_name="Byron", last_name="King", birthday="1836-05-12", mother_id=ada)
+    api.post(f"/api/families/{family_id}/events", json={"event_name": "Notes published", "event_date": "1843-09-01", "member_id": ada})
+    api.post(f"/api/families/{family_id}/events", json={"event_name": "Analytical Engine", "event_date": "1837-12-26"})
+    return family_id
+
+
+def documents(api, family_id: str, collection: str) -> list:
+    async def read():
+        return await server.db[collection].find({"family_id": family_id}, {"_id": 0}).to_list(None)
+    return api.portal.call(read)
+
+
+def assert_copied(api, family_id: str, copy_id: str, import_id: str):
+    def new_id(old_id):
+        return old_id and member_import.record_id(import_id, old_id)
+
+    def moved(doc):
+        return {
+            **doc, "id": new_id(doc["id"]), "family_id": copy_id,
+            **{field: new_id(doc[field]) for field in ("father_id", "mother_id", "member_id") if field in doc},
+        }
+
+    for collection in ("family_members", "custom_events", "occurrences"):
+        original, copy = documents(api, family_id, collection), documents(api, copy_id, collection)
+        assert len(copy) == len(original) > 0
+        if collection == "occurrences":
+            key = lambda row: (row["kind"], row["date"], row["title"])
+            assert [{**row, "family_id": None, "source_id": None, "member_id": None} for row in sorted(copy, key=key)] == \
+                [{**row, "family_id": None, "source_id": None, "member_id": None} for row in sorted(original, key=key)]
+        else:
+            assert sorted(copy, key=lambda doc: doc["id"]) == sorted(map(moved, original), key=lambda doc: doc["id"])
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_ndjson_export_then_import_reproduces_the_family(api, compress):
+    family_id = create_family(api)
+    export = api.get(f"/api/families/{family_id}/export", params={"format": "ndjson", "compress": compress})
+    assert export.status_code == 200
+    body = gzip.decompress(export.content) if compress else export.content
+    assert [json.loads(line)["type"] for line in body.splitlines()] == ["family"] + ["member"] * 4 + ["event"] * 2
+
+    copy_id = api.post("/api/families", json={"name": "Copy"}).json()["id"]
+    report = api.post(f"/api/families/{copy_id}/import", content=export.content).json()
+    assert (report["format"], report["imported"], report["events_imported"], report["parents_linked"], report["errors"]) == \
+        ("ndjson", 4, 2, 3, [])
+    assert_copied(api, family_id, copy_id, report["import_id"])
+    assert report["family_updated"]
+    copy = api.get(f"/api/families/{copy_id}").json()
+    assert (copy["name"], copy["timezone"]) == ("Lovelace", "Europe/London")
+
+
+def test_ndjson_family_line_with_an_invalid_timezone_is_reported(api):
+    family_id = api.post("/api/families", json={"name": "Curie", "timezone": "Europe/Paris"}).json()["id"]
+    body = "\n".join([
+        json.dumps({"type": "family", "name": "Curie-Joliot", "timezone": "Mars/Olympus"}),
+        json.dumps({"type": "member", "id": "marie", "first_name": "Marie", "last_name": "Curie"}),
+    ])
+    report = api.post(f"/api/families/{family_id}/import", params={"format": "ndjson"}, content=body).json()
+    assert (report["imported"], report["family_updated"], report["errors"][0]["row"]) == (1, False, 1)
+    family = api.get(f"/api/families/{family_id}").json()
+    assert (family["name"], family["timezone"]) == ("Curie", "Europe/Paris")
+
+
+def test_gedcom_export_keeps_names_dates_and_parents(api):
+    family_id = create_family(api)
+    export = api.get(f"/api/families/{family_id}/export", params={"format": "gedcom"})
+    assert export.text.startswith("0 HEAD") and export.text.endswith("0 TRLR\n")
+
+    copy_id = api.post("/api/families", json={"name": "Copy"}).json()["id"]
+    report = api.post(f"/api/families/{copy_id}/import", content=export.content).json()
+    assert (report["format"], report["imported"], report["parents_linked"], report["errors"]) == ("gedcom", 4, 3, [])
+
+    def summary(members):
+        names = {member["id"]: member["first_name"] for member in members}
+        return sorted(
+            (m["first_name"], m["last_name"], m["birthday"], m["anniversary"], m["address"], m["comments"], names.get(m["father_id"]), names.get(m["mother_id"]))
+            for m in members
+        )
+    assert summary(documents(api, copy_id, "family_members")) == summary(documents(api, family_id, "family_members"))
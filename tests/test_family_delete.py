@@ -0,0 +1,33 @@
+"""Once DELETE /families/{id} has answered 202 the family is gone from every endpoint, before its rows are deleted."""
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+import server
+
+
+def test_a_deleted_familys_rows_are_not_read_or_written(api):
+    family_id = api.post("/api/families", json={"name": "Curie"}).json()["id"]
+    member = api.post(f"/api/families/{family_id}/members", json={"first_name": "Marie", "last_name": "Curie", "birthday": "1867-11-07"}).json()
+    event = api.post(f"/api/families/{family_id}/events", json={"event_name": "Nobel Prize", "event_date": "1903-12-10"}).json()
+    base = f"/api/families/{family_id}"
+    reads = [
+        f"{base}/members", f"{base}/members?stream=true", f"{base}/events", f"{base}/events?stream=true",
+        f"{base}/events-calendar", f"{base}/members/{member['id']}/ancestors", f"{base}/relationship?a={member['id']}&b={member['id']}",
+    ]
+    # Cached before the delete
+    assert all(api.get(path).status_code == 200 for path in reads)
+
+    assert api.delete(base).status_code == 202
+    for path in reads:
+        assert api.get(path).status_code == 404, path
+    assert api.put(f"{base}/members/{member['id']}", json={"birthday": "1867-11-08"}).status_code == 404
+    assert api.delete(f"{base}/members/{member['id']}").status_code == 404
+    assert api.delete(f"{base}/events/{event['id']}").status_code == 404
+
+    # The delete job has not run: the rows are still there, untouched
+    assert api.portal.call(server.db.family_members.find_one, {"id": member["id"]})["birthday"] == "1867-11-07"
+    assert api.portal.call(server.db.custom_events.count_documents, {"id": event["id"]}) == 1
+    occurrences = api.portal.call(server.db.occurrences.find({"family_id": family_id}, {"_id": 0, "kind": 1, "source_id": 1}).to_list, None)
+    assert sorted(row["kind"] for row in occurrences) == ["birthday", "custom"]
+    assert family_id not in server.graph_index.graphs
@@ -0,0 +1,130 @@
+"""Relationship labels from the parent graph, and GraphIndex keeping a cached graph up to date."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import family_graph
+
+
+def graph(*members) -> family_graph.FamilyGraph:
+    """members: (id, father_id, mother_id)"""
+    built = family_graph.FamilyGraph()
+    for member_id, father_id, mother_id in members:
+        built.upsert({"id": member_id, "father_id": father_id, "mother_id": mother_id})
+    return built
+
+
+# Two grandparents; their children dad and aunt; dad's children kid (with mum) and half (with other);
+# cousin is aunt's child, and baby is cousin's child
+FAMILY = graph(
+    ("grandpa", None, None), ("grandma", None, None), ("mum", None, None), ("other", None, None), ("uncle", None, None),
+    ("dad", "grandpa", "grandma"), ("aunt", "grandpa", "grandma"),
+    ("kid", "dad", "mum"), ("brother", "dad", "mum"), ("half", "dad", "other"),
+    ("cousin", "uncle", "aunt"), ("baby", "cousin", None),
+)
+
+
+@pytest.mark.parametrize("a, b, label", [
+    ("kid", "brother", "sibling"),
+    ("kid", "half", "half-sibling"),
+    ("dad", "aunt", "sibling"),
+    ("kid", "cousin", "first cousin"),
+    ("kid", "baby", "first cousin once removed"),
+    ("kid", "aunt", "niece/nephew"),
+    ("aunt", "kid", "aunt/uncle"),
+    ("grandpa", "kid", "grandparent"),
+    ("grandma", "baby", "great-grandparent"),
+    ("kid", "grandpa", "grandchild"),
+    ("dad", "kid", "parent"),
+    ("mum", "dad", "co-parent"),
+    ("mum", "uncle", None),
+])
+def test_relationship_labels(a, b, label):
+    assert FAMILY.relationship(a, b)["label"] == label
+
+
+def test_cousin_degree_and_removal():
+    result = FAMILY.relationship("baby", "kid")
+    assert (result["cousin_degree"], result["removal"], result["lowest_common_ancestors"]) == (1, 1, ["grandma", "grandpa"])
+
+
+def test_half_sibling_needs_both_parents_known_on_both_sides():
+    family = graph(("dad", None, None), ("mum", None, None), ("a", "dad", "mum"), ("b", "dad", None), ("c", None, "mum"))
+    # b's mother is not recorded, so she may well be mum
+    assert family.relationship("a", "b")["label"] == "sibling"
+    assert family.relationship("a", "c")["label"] == "sibling"
+    family.upsert({"id": "b", "father_id": "dad", "mother_id": "stepmum"})
+    assert family.relationship("a", "b")["label"] == "half-sibling"
+
+
+def test_graph_index_applies_member_writes_to_the_cached_graph():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def check():
+        db = mongomock_motor.AsyncMongoMockClient()["onefam_test"]
+        await db.family_members.insert_many([
+            {"id": "dad", "family_id": "f1"}, {"id": "mum", "family_id": "f1"},
+            {"id": "a", "family_id": "f1", "father_id": "dad", "mother_id": "mum"},
+            {"id": "b", "family_id": "f1", "father_id": "dad"},
+        ])
+        index = family_graph.GraphIndex(db)
+        cached = await index.get("f1")
+        assert cached.relationship("a", "b")["label"] == "sibling"
+
+        # The database is not read again: the writes reach the cached graph
+        index.upsert_member("f1", {"id": "b", "father_id": "dad", "mother_id": "stepmum", "first_name": "B"})
+        index.upsert_member("f1", {"id": "stepmum"})
+        index.upsert_member("f1", {"id": "c", "father_id": "b"})
+        graph = await index.get("f1")
+        assert graph is cached
+        assert graph.relationship("a", "b")["label"] == "half-sibling"
+        assert graph.relationship("c", "a")["label"] == "niece/nephew"
+        assert graph.relationship("stepmum", "c")["label"] == "grandparent"
+
+        index.remove_member("f1", "b")
+        assert "b" not in graph and graph.relationship("c", "a")["label"] is None
+        index.drop("f1")
+        assert (await index.get("f1")).relationship("a", "b")["label"] == "sibling"
+
+    asyncio.run(check())
+
+
+class SlowMembers:
+    """family_members whose find() waits for release before returning docs"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.reads = 0
+        self.reading = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def _read(self):
+        self.reads += 1
+        self.reading.set()
+        await self.release.wait()
+        for doc in self.docs:
+            yield doc
+
+    def find(self, query, projection):
+        return self._read()
+
+
+def test_a_drop_during_a_build_is_not_lost():
+    async def check():
+        members = SlowMembers([{"id": "dad"}, {"id": "a", "father_id": "dad"}])
+        index = family_graph.GraphIndex(SimpleNamespace(family_members=members))
+        building = asyncio.create_task(index.get("f1"))
+        await members.reading.wait()
+        # e.g. a batch wrote members after the build read them
+        index.drop("f1")
+        members.release.set()
+        assert "a" in await building
+        assert "f1" not in index.graphs and not index.dropped
+
+        # The next read builds again, and that graph is cached
+        await index.get("f1")
+        await index.get("f1")
+        assert members.reads == 2
+
+    asyncio.run(check())
@@ -0,0 +1,55 @@
+"""build_tree: generations, sibling order and couples, with parent cycles and dangling parents reported."""
+import family_tree
+import server
+
+
+def member(member_id: str, birthday: str = None, father_id: str = None, mother_id: str = None) -> dict:
+    return {"id": member_id, "first_name": member_id.title(), "last_name": "Test", "birthday": birthday,
+            "father_id": father_id, "mother_id": mother_id}
+
+
+def test_generations_sibling_order_and_couples():
+    tree = family_tree.build_tree([
+        member("younger", "1990-01-01", "dad", "mum"),
+        member("older", "1985-06-01", "dad", "mum"),
+        member("dad", "1960-01-01"),
+        member("mum", "1962-01-01"),
+        member("grandchild", None, "older"),
+    ])
+    assert tree["roots"] == ["dad", "mum"]
+    assert tree["generations"] == [["dad", "mum"], ["older", "younger"], ["grandchild"]]
+    assert tree["nodes"]["dad"]["children"] == ["older", "younger"]
+    assert tree["couples"] == [{"father_id": "dad", "mother_id": "mum", "children": ["older", "younger"]}]
+    assert (tree["cycles"], tree["dangling"]) == ([], [])
+
+
+def test_parent_cycles_and_dangling_parents_are_reported():
+    tree = family_tree.build_tree([
+        # a and b are each other's father; c sits below the cycle
+        member("a", father_id="b"),
+        member("b", father_id="a"),
+        member("c", father_id="a"),
+        # d's father is not in the family
+        member("d", "1950-01-01", father_id="ghost"),
+        member("e", "1975-01-01", father_id="d"),
+    ])
+    assert tree["member_count"] == 5
+    assert tree["cycles"] == ["a", "b", "c"]
+    assert tree["dangling"] == [{"member_id": "d", "field": "father_id", "parent_id": "ghost"}]
+    # The cycle is left out of the layout; the dangling parent is treated as missing
+    assert tree["roots"] == ["d"]
+    assert tree["generations"] == [["d"], ["e"]]
+    assert set(tree["nodes"]) == {"d", "e"}
+    assert tree["nodes"]["d"] == {"generation": 0, "parents": [], "children": ["e"]}
+
+
+def test_tree_endpoint_reports_cycles_and_dangling_parents(api):
+    family_id = api.post("/api/families", json={"name": "Loop"}).json()["id"]
+    api.portal.call(server.db.family_members.insert_many, [
+        {"family_id": family_id, **member("a", father_id="b")},
+        {"family_id": family_id, **member("b", father_id="a")},
+        {"family_id": family_id, **member("d", father_id="ghost")},
+    ])
+    tree = api.get(f"/api/families/{family_id}/tree").json()
+    assert (tree["family_id"], tree["cycles"], tree["roots"]) == (family_id, ["a", "b"], ["d"])
+    assert tree["dangling"] == [{"member_id": "d", "field": "father_id", "parent_id": "ghost"}]
@@ -0,0 +1,178 @@
+"""The job queue and reminder delivery against mongomock: claims, retries with backoff, dead letters and
+reminders that are never sent twice."""
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import indexes
+import jobs
+import mailer
+import reminders
+
+
+def run(test):
+    async def main():
+        db = mongomock_motor.AsyncMongoMockClient()["onefam_test"]
+        await indexes.ensure_indexes(db)
+        await test(db)
+    asyncio.run(main())
+
+
+async def make_due(db):
+    await db.jobs.update_many({"status": jobs.QUEUED}, {"$set": {"run_at": jobs.utcnow() - timedelta(seconds=1)}})
+
+
+def test_a_claimed_job_is_not_claimed_again_until_its_lease_runs_out():
+    async def test(db):
+        queued = await jobs.enqueue(db, "noop", {})
+        first = await jobs.claim(db, "w1", lease_seconds=60)
+        assert (first["id"], first["status"], first["attempts"], first["locked_by"]) == (queued["id"], jobs.RUNNING, 1, "w1")
+        assert await jobs.claim(db, "w2") is None
+        assert await jobs.heartbeat(db, first, {"progress": 1})
+
+        # w1 died: once the lease has run out w2 takes the job over, and w1 can no longer finish it
+        await db.jobs.update_one({"id": queued["id"]}, {"$set": {"locked_until": jobs.utcnow() - timedelta(seconds=1)}})
+        second = await jobs.claim(db, "w2")
+        assert (second["id"], second["attempts"], second["locked_by"]) == (queued["id"], 2, "w2")
+        assert not await jobs.heartbeat(db, first)
+        await jobs.complete(db, first, {"by": "w1"})
+        assert (await db.jobs.find_one({"id": queued["id"]}))["status"] == jobs.RUNNING
+        await jobs.complete(db, second, {"by": "w2"})
+        assert (await db.jobs.find_one({"id": queued["id"]}))["result"] == {"by": "w2"}
+
+    run(test)
+
+
+def test_a_job_whose_last_attempt_lost_its_lease_is_dead_lettered():
+    async def test(db):
+        job = await jobs.enqueue(db, "crashes", {}, max_attempts=2)
+        later = await jobs.enqueue(db, "noop", {})
+        expire = {"$set": {"locked_until": jobs.utcnow() - timedelta(seconds=1)}}
+        # Both workers die while running it, e.g. killed for running out of memory
+        claimed = await jobs.claim(db, "w1")
+        assert (claimed["id"], claimed["attempts"]) == (job["id"], 1)
+        await db.jobs.update_one({"id": job["id"]}, expire)
+        claimed = await jobs.claim(db, "w2")
+        assert (claimed["id"], claimed["attempts"]) == (job["id"], 2)
+        await db.jobs.update_one({"id": job["id"]}, expire)
+
+        # w3 dead-letters it instead of running it a third time, and claims the next job
+        assert (await jobs.claim(db, "w3"))["id"] == later["id"]
+        dead = await db.jobs.find_one({"id": job["id"]})
+        assert (dead["status"], dead["attempts"], dead["last_error"]) == (jobs.DEAD, 2, "Lease expired on the last attempt")
+        assert dead["locked_until"] is None
+        assert await jobs.claim(db, "w4") is None
+
+    run(test)
+
+
+def test_failures_back_off_then_dead_letter():
+    async def fails(job):
+        raise RuntimeError(f"attempt {job['attempts']} failed")
+
+    async def test(db):
+        job = await jobs.enqueue(db, "flaky", {}, max_attempts=3)
+        worker = jobs.Worker(db, {"flaky": fails})
+        for attempt in (1, 2):
+            before = jobs.utcnow()
+            assert await worker.run_once()
+            retried = await db.jobs.find_one({"id": job["id"]})
+            assert (retried["status"], retried["attempts"], retried["last_error"]) == (jobs.QUEUED, attempt, f"attempt {attempt} failed")
+            delay = (jobs.as_utc(retried["run_at"]) - before).total_seconds()
+            base = jobs.BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)
+            assert base / 2 - 1 <= delay <= base + 1
+            # Not runnable again until the backoff is over
+            assert not await worker.run_once()
+            await make_due(db)
+        assert await worker.run_once()
+        dead = await db.jobs.find_one({"id": job["id"]})
+        assert (dead["status"], dead["attempts"], dead["last_error"]) == (jobs.DEAD, 3, "attempt 3 failed")
+        assert worker.stats == {"completed": 0, "retried": 2, "dead": 1}
+        assert not await worker.run_once()
+
+    run(test)
+
+
+def test_permanent_errors_and_the_backoff_cap():
+    async def rejected(job):
+        raise jobs.PermanentJobError("bad payload", {"checked": 1})
+
+    async def test(db):
+        job = await jobs.enqueue(db, "rejected", {})
+        assert await jobs.Worker(db, {"rejected": rejected}).run_once()
+        dead = await db.jobs.find_one({"id": job["id"]})
+        assert (dead["status"], dead["attempts"], dead["result"]) == (jobs.DEAD, 1, {"checked": 1})
+
+    run(test)
+    assert jobs.BACKOFF_MAX_SECONDS / 2 <= jobs.backoff_seconds(50) <= jobs.BACKOFF_MAX_SECONDS
+
+
+class FakeSender:
+    """Records who each digest went to; the addresses in failing get a 500 once"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def send(self, recipients, subject, html_content):
+        results = []
+        for recipient in recipients:
+            if recipient in self.failing:
+                self.failing.discard(recipient)
+                results.append({"recipients": [recipient], "status": mailer.FAILED, "status_code": 500, "error": "server error"})
+            else:
+                self.sent.append(recipient)
+                results.append({"recipients": [recipient], "status": mailer.SENT, "status_code": 202, "error": None})
+        return results
+
+
+def test_a_retried_reminder_is_not_sent_twice():
+    alerts = [{"key": "birthday:m1", "type": "Birthday", "name": "Ada", "date": "December 10, 2024"},
+              {"key": "custom:e1", "type": "Event", "name": "Notes", "date": "December 10, 2024"}]
+    recipients = ["ada@example.com", "anne@example.com"]
+
+    async def test(db):
+        sender = FakeSender(failing=["anne@example.com"])
+        worker = jobs.Worker(db, {reminders.KIND: lambda job: reminders.deliver(db, sender, job)})
+        job = await reminders.enqueue(db, "f1", date(2024, 12, 10), alerts, recipients)
+        assert await worker.run_once()
+        first = await db.jobs.find_one({"id": job["id"]})
+        assert (first["status"], first["result"]["sent"], first["result"]["failed"]) == (jobs.QUEUED, 1, 1)
+        assert sender.sent == ["ada@example.com"]
+        # The failed recipient's rows are released for the retry; the sent ones stay
+        log = await db.reminder_log.find({}, {"_id": 0, "recipient": 1, "status": 1}).to_list(None)
+        assert sorted((row["recipient"], row["status"]) for row in log) == [("ada@example.com", reminders.SENT)] * 2
+
+        # The same digest queued a second time, e.g. by a scheduler run that was repeated
+        await reminders.enqueue(db, "f1", date(2024, 12, 10), alerts, recipients)
+        await make_due(db)
+        while await worker.run_once():
+            pass
+        assert sender.sent == ["ada@example.com", "anne@example.com"]
+        assert await db.reminder_log.count_documents({"status": reminders.SENT}) == 4
+        done = await db.jobs.find({"kind": reminders.KIND}, {"_id": 0, "status": 1, "result": 1}).to_list(None)
+        assert [job["status"] for job in done] == [jobs.DONE, jobs.DONE]
+        assert sorted(job["result"]["duplicates"] for job in done) == [2, 4]
+
+    run(test)
+
+
+def test_rows_reserved_by_an_attempt_that_died_are_sent_on_the_retry():
+    alerts = [{"key": "birthday:m1", "type": "Birthday", "name": "Ada", "date": "December 10, 2024"}]
+
+    async def test(db):
+        job = await reminders.enqueue(db, "f1", date(2024, 12, 10), alerts, ["ada@example.com"])
+        # An attempt reserved the row, then its worker died before sending
+        assert await reminders._reserve(db, job, ["birthday:m1"], ["ada@example.com"]) == {("birthday:m1", "ada@example.com")}
+        sender = FakeSender()
+        summary = await reminders.deliver(db, sender, job)
+        assert (summary["sent"], summary["duplicates"], sender.sent) == (1, 0, ["ada@example.com"])
+
+        other = await reminders.enqueue(db, "f1", date(2024, 12, 10), alerts, ["ada@example.com"])
+        assert (await reminders.deliver(db, sender, other))["duplicates"] == 1
+        assert sender.sent == ["ada@example.com"]
+
+    run(test)
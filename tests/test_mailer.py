@@ -0,0 +1,108 @@
+"""The SendGrid mailer against benchmarks/fake_sendgrid.py: personalization batches, retries and the rate limit."""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+from fake_sendgrid import FakeSendGrid  # noqa: E402
+
+import mailer  # noqa: E402
+
+SUBJECT = "OneFam - Upcoming Events Reminder"
+CONTENT = "<p>Birthday: Ada Lovelace</p>"
+
+
+@pytest.fixture(scope="module")
+def sendgrid():
+    server = FakeSendGrid().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def fake(sendgrid, monkeypatch):
+    # 5xx answers carry no Retry-After, so the backoff would otherwise be half a second and more
+    monkeypatch.setattr(mailer, "RETRY_BASE_SECONDS", 0.01)
+    sendgrid.requests.clear()
+    sendgrid.failures.clear()
+    return sendgrid
+
+
+def send(fake, recipients, **options) -> list:
+    async def run():
+        sender = mailer.Mailer(api_key="fake", api_url=fake.url, **options)
+        try:
+            return await sender.send(recipients, SUBJECT, CONTENT)
+        finally:
+            await sender.close()
+    return asyncio.run(run())
+
+
+def test_recipients_are_batched_into_personalizations(fake):
+    recipients = [f"member{i}@example.com" for i in range(7)]
+    results = send(fake, recipients + ["member0@example.com", "", None], batch_size=3)
+    assert [(result["status"], len(result["recipients"])) for result in results] == [(mailer.SENT, 3), (mailer.SENT, 3), (mailer.SENT, 1)]
+    assert all(result["message_id"] for result in results)
+    # One personalization per address, so recipients do not see each other
+    sent = sorted(([p["to"] for p in body["personalizations"]] for body in fake.requests), key=len, reverse=True)
+    assert [len(batch) for batch in sent] == [3, 3, 1]
+    assert sorted(to[0]["email"] for batch in sent for to in batch) == recipients
+    assert all(len(to) == 1 for batch in sent for to in batch)
+    assert {body["subject"] for body in fake.requests} == {SUBJECT}
+
+
+def test_throttled_and_server_errors_are_retried(fake):
+    fake.fail(429, 503)
+    [result] = send(fake, ["ada@example.com", "anne@example.com"])
+    assert (result["status"], result["status_code"], result["attempts"]) == (mailer.SENT, 202, 3)
+    assert fake.recipients == 2
+
+    fake.fail(*[500] * mailer.MAX_ATTEMPTS)
+    [result] = send(fake, ["ada@example.com"])
+    assert (result["status"], result["status_code"], result["attempts"]) == (mailer.FAILED, 500, mailer.MAX_ATTEMPTS)
+    assert "injected failure" in result["error"]
+
+
+def test_client_errors_are_not_retried(fake):
+    fake.fail(400)
+    [result] = send(fake, ["ada@example.com"])
+    assert (result["status"], result["status_code"], result["attempts"]) == (mailer.FAILED, 400, 1)
+    assert fake.requests == []
+
+
+def test_without_an_api_key_nothing_is_sent(fake, monkeypatch):
+    monkeypatch.delenv("SENDGRID_API_KEY", raising=False)
+
+    async def run():
+        return await mailer.Mailer(api_url=fake.url).send(["ada@example.com"], SUBJECT, CONTENT)
+    [result] = asyncio.run(run())
+    assert (result["status"], result["attempts"]) == (mailer.SKIPPED, 0)
+    assert fake.requests == []
+
+
+def test_token_bucket_paces_acquisitions_after_the_burst():
+    async def run():
+        bucket = mailer.TokenBucket(rate=50, burst=2)
+        start = time.monotonic()
+        for _ in range(2):
+            await bucket.acquire()
+        burst = time.monotonic() - start
+        for _ in range(5):
+            await bucket.acquire()
+        return burst, time.monotonic() - start
+    burst, total = asyncio.run(run())
+    assert burst < 0.02
+    # 5 more tokens at 50 per second
+    assert total >= 0.095
+
+
+def test_api_calls_are_rate_limited(fake):
+    start = time.monotonic()
+    results = send(fake, [f"member{i}@example.com" for i in range(6)], batch_size=1, rate=4)
+    elapsed = time.monotonic() - start
+    assert [result["status"] for result in results] == [mailer.SENT] * 6
+    # A burst of 4 calls, then the other 2 at 4 per second
+    assert len(fake.requests) == 6 and elapsed >= 0.45
@@ -0,0 +1,68 @@
+"""CSV and GEDCOM parsing for member imports, fed in small chunks the way uploads arrive."""
+import asyncio
+
+import pytest
+
+import member_import
+
+
+def chunked(text: str, size: int = 7):
+    async def chunks():
+        data = text.encode()
+        for start in range(0, len(data), size):
+            yield data[start:start + size]
+    return chunks()
+
+
+def parse(parser, text: str, size: int = 7) -> list:
+    async def collect():
+        return [record async for record in parser(chunked(text, size))]
+    return asyncio.run(collect())
+
+
+def test_csv_rows_links_and_quoted_newlines():
+    records = parse(member_import.parse_csv, (
+        "﻿Ref,First_Name,Last_Name,Comments,Father_Id\r\n"
+        'k1,Kid,Smith,"two\nlines, and a comma",d1\r\n'
+        "\r\n"
+        "d1,Dad,Smith,,\r\n"
+        ",No,Ref,,\r\n"
+    ))
+    assert records == [
+        ("member", 2, "k1", {"first_name": "Kid", "last_name": "Smith", "comments": "two\nlines, and a comma"}),
+        ("link", 2, "k1", {"father": "d1", "mother": None}),
+        ("member", 5, "d1", {"first_name": "Dad", "last_name": "Smith"}),
+        ("member", 6, "6", {"first_name": "No", "last_name": "Ref"}),
+    ]
+
+
+def test_csv_reports_bad_rows_and_rejects_a_bad_header():
+    records = parse(member_import.parse_csv, 'first_name,last_name\na,b,c\nd,"unterminated\n')
+    assert [(kind, row) for kind, row, _, _ in records] == [("error", 2), ("error", 3)]
+    with pytest.raises(member_import.InvalidImport):
+        parse(member_import.parse_csv, "name,surname\na,b\n")
+
+
+def test_gedcom_individuals_families_and_dates():
+    records = parse(member_import.parse_gedcom, (
+        "0 HEAD\n1 CHAR UTF-8\n"
+        "0 @F1@ FAM\n1 HUSB @I1@\n1 WIFE @I2@\n1 CHIL @I3@\n1 MARR\n2 DATE 10 JUN 1965\n"
+        "0 @I1@ INDI\n1 NAME John /Doe/\n1 BIRT\n2 DATE 1 JAN 1940\n1 NOTE first\n2 CONT second\n"
+        "0 @I2@ INDI\n1 NAME Jane /Roe/\n2 GIVN Janet\n1 BIRT\n2 DATE ABT 1942\n"
+        "0 TRLR\n"
+    ), size=5)
+    assert records == [
+        ("link", 3, "@I3@", {"father": "@I1@", "mother": "@I2@"}),
+        ("link", 3, "@I1@", {"anniversary": "1965-06-10"}),
+        ("link", 3, "@I2@", {"anniversary": "1965-06-10"}),
+        ("member", 9, "@I1@", {"first_name": "John", "last_name": "Doe", "birthday": "1940-01-01", "comments": "first\nsecond"}),
+        ("error", 15, "@I2@", "Date 'ABT 1942' is not a full day/month/year date and was left out"),
+        ("member", 15, "@I2@", {"first_name": "Janet", "last_name": "Roe"}),
+    ]
+
+
+def test_detect_format():
+    assert member_import.detect_format("text/csv; charset=utf-8") == "csv"
+    assert member_import.detect_format("application/x-gedcom") == "gedcom"
+    assert member_import.detect_format("application/octet-stream", b"\xef\xbb\xbf0 HEAD\r\n") == "gedcom"
+    assert member_import.detect_format(None, b"first_name,last_name\n") == "csv"
@@ -0,0 +1,83 @@
+"""PUT /families/{id}/members/{id}: partial updates, cleared fields and version checks.
+
+Runs against mongomock like test_export_roundtrip, with find_one_and_update made to
+return the document it updated (see updated_by_id).
+"""
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+
+from mongomock.collection import Collection
+from pymongo import ReturnDocument
+
+
+@pytest.fixture(autouse=True)
+def updated_by_id(monkeypatch):
+    """mongomock finds the updated document again with the original filter unless the projection
+    includes _id, so an update under a version condition would come back as None; MongoDB returns
+    the document it updated"""
+    find_and_modify = Collection._find_and_modify
+
+    def by_id(self, query, projection=None, update=None, upsert=False, sort=None, return_document=ReturnDocument.BEFORE, **kwargs):
+        if update and return_document is ReturnDocument.AFTER:
+            found = self.find_one(query, {"_id": 1}, sort=sort)
+            if found:
+                query = {"_id": found["_id"]}
+        return find_and_modify(self, query, projection, update, upsert, sort, return_document, **kwargs)
+    monkeypatch.setattr(Collection, "_find_and_modify", by_id)
+
+
+@pytest.fixture
+def member(api):
+    family_id = api.post("/api/families", json={"name": "Curie"}).json()["id"]
+    pierre = api.post(f"/api/families/{family_id}/members", json={"first_name": "Pierre", "last_name": "Curie"}).json()
+    irene = api.post(f"/api/families/{family_id}/members", json={
+        "first_name": "Irène", "last_name": "Curie", "birthday": "1897-09-12", "father_id": pierre["id"], "comments": "Chemist",
+    }).json()
+    return f"/api/families/{family_id}/members/{irene['id']}"
+
+
+def test_null_clears_and_omitted_fields_are_kept(api, member):
+    response = api.put(member, json={"father_id": None, "last_name": "Joliot-Curie"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["father_id"] is None
+    assert body["last_name"] == "Joliot-Curie"
+    assert body["comments"] == "Chemist"
+    assert body["version"] == 1
+    assert response.headers["ETag"] == '"1"'
+
+
+def test_required_fields_cannot_be_cleared(api, member):
+    assert api.put(member, json={"first_name": None}).status_code == 422
+
+
+def test_changed_only_returns_the_changed_fields(api, member):
+    response = api.put(member, json={"comments": None, "email": "irene@example.com"}, params={"changed_only": True})
+    assert response.json() == {"id": member.rsplit("/", 1)[1], "version": 1, "email": "irene@example.com", "comments": None}
+
+
+def test_stale_versions_are_refused(api, member):
+    api.put(member, json={"comments": "Nobel Prize 1935"})
+    stale = api.put(member, json={"comments": "Overwritten", "version": 0})
+    assert stale.status_code == 409
+    assert stale.headers["ETag"] == '"1"'
+    assert api.put(member, json={"comments": "Overwritten"}, headers={"If-Match": '"0"'}).status_code == 412
+    assert api.put(member, json={"comments": "Overwritten", "version": 0}, headers={"If-Match": '"1"'}).status_code == 412
+
+
+def test_a_matching_version_is_applied(api, member):
+    api.put(member, json={"comments": "Nobel Prize 1935"})
+    response = api.put(member, json={"comments": "Nobel Prize in Chemistry, 1935", "version": 1})
+    assert response.status_code == 200
+    assert (response.json()["comments"], response.json()["version"]) == ("Nobel Prize in Chemistry, 1935", 2)
+    assert response.headers["ETag"] == '"2"'
+    response = api.put(member, json={"address": "Paris"}, headers={"If-Match": '"2"'})
+    assert (response.status_code, response.json()["version"]) == (200, 3)
+
+
+def test_members_of_other_families_are_not_found(api, member):
+    other = api.post("/api/families", json={"name": "Other"}).json()["id"]
+    member_id = member.rsplit("/", 1)[1]
+    assert api.put(f"/api/families/{other}/members/{member_id}", json={"first_name": "X"}).status_code == 404
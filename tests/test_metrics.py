@@ -0,0 +1,80 @@
+"""Prometheus metrics: route labels, handler phases, the MongoDB listener and GET /metrics."""
+from types import SimpleNamespace
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+import metrics
+
+REGISTRY = metrics.REGISTRY
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_requests_are_labelled_by_route_template():
+    router = APIRouter(route_class=metrics.InstrumentedRoute)
+
+    @router.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        assert sample("onefam_http_requests_in_flight", method="GET", route="/items/{item_id}") == 1
+        with metrics.phase("db"):
+            pass
+        return {"id": item_id}
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(metrics.MetricsMiddleware)
+    route = {"method": "GET", "route": "/items/{item_id}"}
+    before = sample("onefam_http_requests_total", status="200", **route)
+    phases = sample("onefam_handler_phase_duration_seconds_count", route="/items/{item_id}", phase="db")
+    unmatched = sample("onefam_http_requests_total", method="GET", route=metrics.UNMATCHED, status="404")
+
+    client = TestClient(app)
+    assert client.get("/items/1").status_code == 200
+    assert client.get("/items/2").status_code == 200
+    assert client.get("/nothing/here").status_code == 404
+
+    assert sample("onefam_http_requests_total", status="200", **route) == before + 2
+    assert sample("onefam_http_request_duration_seconds_count", **route) >= 2
+    assert sample("onefam_handler_phase_duration_seconds_count", route="/items/{item_id}", phase="db") == phases + 2
+    assert sample("onefam_http_requests_total", method="GET", route=metrics.UNMATCHED, status="404") == unmatched + 1
+    assert sample("onefam_http_requests_in_flight", **route) == 0
+
+
+def test_mongo_listener_labels_commands_with_their_collection():
+    listener = metrics.MongoCommandListener()
+    before = sample("onefam_mongo_commands_total", command="getMore", collection="family_members", outcome="ok")
+    failed = sample("onefam_mongo_commands_total", command="find", collection="jobs", outcome="failed")
+
+    def event(request_id, name, command=None, micros=1500):
+        return SimpleNamespace(connection_id=("db", 27017), request_id=request_id, command_name=name,
+                               command=command or {}, reply={"ok": 1}, duration_micros=micros)
+
+    listener.started(event(1, "getMore", {"getMore": 12345, "collection": "family_members"}))
+    listener.succeeded(event(1, "getMore"))
+    listener.started(event(2, "find", {"find": "jobs", "filter": {}}))
+    listener.failed(event(2, "find"))
+
+    assert sample("onefam_mongo_commands_total", command="getMore", collection="family_members", outcome="ok") == before + 1
+    assert sample("onefam_mongo_commands_total", command="find", collection="jobs", outcome="failed") == failed + 1
+    assert listener.collections == {}
+
+
+def test_metrics_endpoint_reports_the_job_queue(api, monkeypatch):
+    import jobs
+    import server
+
+    api.portal.call(jobs.enqueue, server.db, "reminder_email", {})
+    assert api.get("/api/families", headers={"Authorization": ""}).status_code == 401
+    response = api.get("/metrics")
+    assert response.status_code == 200
+    assert 'onefam_jobs{kind="reminder_email",status="queued"} 1.0' in response.text
+    assert 'onefam_http_requests_total{method="GET",route="/api/families",status="401"}' in response.text
+    assert "onefam_rate_limited_total" in response.text
+
+    # The scrape token, not a user's access token
+    monkeypatch.setattr(server, "METRICS_TOKEN", "scrape-me")
+    assert api.get("/metrics").status_code == 401
+    assert api.get("/metrics", headers={"Authorization": "Bearer scrape-me"}).status_code == 200
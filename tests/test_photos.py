@@ -0,0 +1,48 @@
+"""Member photo uploads: only images are stored, typed by what they are, and served with nosniff."""
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("mongomock_motor")
+
+
+def png_bytes() -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (64, 48), "teal").save(out, "PNG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def family(api):
+    return f"/api/families/{api.post('/api/families', json={'name': 'Curie'}).json()['id']}"
+
+
+def add_member(api, family: str, photo_base64: str):
+    return api.post(f"{family}/members", json={"first_name": "Marie", "last_name": "Curie", "photo_base64": photo_base64})
+
+
+def test_only_image_types_are_accepted(api, family):
+    html = base64.b64encode(b"<script>alert(1)</script>").decode()
+    response = add_member(api, family, f"data:text/html;base64,{html}")
+    assert response.status_code == 400
+    assert "text/html" in response.json()["detail"]
+    assert api.get(f"{family}/members").json() == []
+
+
+def test_photos_are_served_as_the_type_they_are(api, family):
+    # Declared as JPEG, but the bytes are a PNG
+    member = add_member(api, family, f"data:image/jpeg;base64,{base64.b64encode(png_bytes()).decode()}").json()
+    response = api.get(member["photo_url"])
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["x-content-type-options"] == "nosniff"
+    assert response.content == png_bytes()
+
+
+def test_bytes_that_are_not_an_image_are_rejected(api, family):
+    response = add_member(api, family, f"data:image/png;base64,{base64.b64encode(b'GIF89a but not really').decode()}")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "photo is not an image"
+    assert api.get(f"{family}/members").json() == []
@@ -0,0 +1,77 @@
+"""Request traces, the slow-request log and header-triggered profiles."""
+import asyncio
+import logging
+import marshal
+from types import SimpleNamespace
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from motor.frameworks.asyncio import run_on_executor
+
+import metrics
+import profiling
+
+
+def traced_app(**settings):
+    saved = []
+
+    async def save(document):
+        saved.append(document)
+
+    listener = metrics.MongoCommandListener()
+    router = APIRouter(route_class=metrics.InstrumentedRoute)
+
+    @router.get("/api/families/{family_id}/tree")
+    async def tree(family_id: str):
+        # Motor runs pymongo, and so the listener, on its executor with a copy of the request's context
+        with metrics.phase("db"):
+            event = SimpleNamespace(connection_id=1, request_id=7, command_name="find", duration_micros=2500,
+                                    command={"find": "family_members"}, reply={"cursor": {"firstBatch": [{}, {}, {}]}})
+            listener.started(event)
+            await run_on_executor(asyncio.get_running_loop(), listener.succeeded, event)
+        return {"family_id": family_id}
+
+    app = FastAPI()
+    app.include_router(router)
+    request_profiler = profiling.RequestProfiler(save, **settings)
+    app.add_middleware(profiling.ProfilingMiddleware, request_profiler=request_profiler)
+    return TestClient(app), request_profiler, saved
+
+
+def test_reply_documents():
+    assert profiling.reply_documents({"cursor": {"nextBatch": [{}, {}]}}) == 2
+    assert profiling.reply_documents({"n": 4, "ok": 1}) == 4
+    assert profiling.reply_documents({"value": None}) == 0
+    assert profiling.reply_documents({"ok": 1}) is None
+
+
+def test_slow_requests_are_logged_with_their_breakdown(caplog):
+    client, request_profiler, saved = traced_app(slow_ms=0)
+    with caplog.at_level(logging.WARNING, logger="profiling"):
+        assert client.get("/api/families/f1/tree").status_code == 200
+    assert request_profiler.stats["slow"] == 1
+    assert saved == []
+    line = caplog.records[-1].getMessage()
+    assert '"route": "/api/families/{family_id}/tree"' in line
+    assert '"commands": 1' in line and '"documents": 3' in line
+    assert '"db":' in line
+
+
+def test_header_profiles_the_request():
+    client, request_profiler, saved = traced_app(token="let-me-see", slow_ms=10000)
+    assert "x-profile-id" not in client.get("/api/families/f1/tree", headers={"X-Profile": "guess"}).headers
+    response = client.get("/api/families/f1/tree", headers={"X-Profile": "let-me-see"})
+    assert response.status_code == 200
+    [profile] = saved
+    assert profile["id"] == response.headers["x-profile-id"]
+    assert profile["reason"] == "header"
+    assert profile["commands"] == [{"command": "find", "collection": "family_members", "ms": 2.5, "documents": 3, "ok": True}]
+    assert "cumulative" in profile["report"]
+    assert any(name == "tree" for _, _, name in marshal.loads(profile["data"]))
+
+
+def test_only_one_request_is_profiled_at_a_time():
+    client, request_profiler, saved = traced_app(sample_rate=1.0)
+    request_profiler.busy = True
+    client.get("/api/families/f1/tree")
+    assert saved == [] and request_profiler.stats["skipped_busy"] == 1
@@ -0,0 +1,111 @@
+"""Token buckets, the concurrency gate, and the 429/503 answers of AdmissionMiddleware."""
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import ratelimit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_allows_a_burst_then_refills(clock):
+    store = ratelimit.MemoryStore()
+    take = lambda: asyncio.run(store.take("k", rate=0.5, burst=2))
+    assert take() == (True, 0.0)
+    assert take() == (True, 0.0)
+    allowed, wait = take()
+    assert not allowed and wait == pytest.approx(2.0)
+    clock.now += 2
+    assert take()[0]
+    assert not take()[0]
+
+
+def test_bucket_store_is_bounded(clock):
+    store = ratelimit.MemoryStore(max_buckets=2)
+    for key in ("a", "b", "c"):
+        asyncio.run(store.take(key, 1, 1))
+    assert list(store.buckets) == ["b", "c"]
+
+
+def test_first_matching_rule_wins():
+    limiter = ratelimit.RateLimiter()
+    assert limiter.match("POST", "/api/families/f1/send-alerts")["name"] == "send_alerts"
+    assert limiter.match("GET", "/api/families/f1/alerts")["name"] == "reads"
+    assert limiter.match("PUT", "/api/families/f1/members/m1")["name"] == "writes"
+    assert limiter.match("GET", "/health") is None
+
+
+def test_gate_rejects_when_the_queue_is_full():
+    async def scenario():
+        gate = ratelimit.ConcurrencyGate(limit=1, max_queued=1, timeout=0.05)
+        assert await gate.acquire()
+        waiting = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert gate.queued == 1
+        assert not await gate.acquire()
+        assert not await waiting
+        gate.release()
+        assert await gate.acquire()
+        return gate.info()
+
+    info = asyncio.run(scenario())
+    assert info["queue_full"] == 1
+    assert info["queue_timeouts"] == 1
+    assert info["max_queued_seen"] == 1
+
+
+def admission_app(rules, gate=None):
+    app = FastAPI()
+
+    @app.get("/api/ping")
+    async def ping():
+        return {}
+
+    @app.get("/health")
+    async def health():
+        return {}
+
+    limiter = ratelimit.RateLimiter(rules)
+    app.add_middleware(
+        ratelimit.AdmissionMiddleware, limiter=limiter, gate=gate or ratelimit.ConcurrencyGate(),
+        client_key=lambda scope: scope["client"][0],
+    )
+    return app, limiter
+
+
+def test_middleware_answers_429_with_retry_after(clock):
+    app, limiter = admission_app([{"name": "ping", "method": "GET", "path": "/api/*", "rate": 1, "per": 30, "burst": 2}])
+    client = TestClient(app)
+    assert [client.get("/api/ping").status_code for _ in range(3)] == [200, 200, 429]
+    limited = client.get("/api/ping")
+    assert limited.headers["Retry-After"] == "30"
+    assert limited.json() == {"detail": "Too many requests"}
+    assert client.get("/health").status_code == 200
+    assert limiter.info()["limited"] == {"ping": 2}
+
+
+def test_middleware_answers_503_when_no_slot_frees_up():
+    gate = ratelimit.ConcurrencyGate(limit=1, max_queued=0)
+    app, _ = admission_app([], gate)
+    client = TestClient(app)
+    asyncio.run(gate.acquire())
+    busy = client.get("/api/ping")
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == "1"
+    gate.release()
+    assert client.get("/api/ping").status_code == 200
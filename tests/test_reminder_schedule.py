@@ -0,0 +1,134 @@
+"""Reminder timing with the clock pinned: local days, DST transitions and Feb 29 birthdays."""
+import asyncio
+from datetime import date, datetime, timezone
+
+import pytest
+
+import occurrences
+import scheduler
+import timezones
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def matches(query: dict, row: dict) -> bool:
+    """Evaluate an occurrences.window_filter query against a row"""
+    if "$or" in query:
+        return any(matches(clause, row) for clause in query["$or"])
+    if row["month"] != query["month"]:
+        return False
+    day = query.get("day")
+    return day is None or day["$gte"] <= row["day"] <= day["$lte"]
+
+
+def birthday_row(value: str) -> dict:
+    return occurrences.member_rows({"id": "m1", "family_id": "f1", "first_name": "Ada", "last_name": "L", "birthday": value})["birthday"]
+
+
+def test_resolve_prefers_member_then_family_then_utc():
+    assert timezones.resolve("Asia/Tokyo", "Europe/Paris") == "Asia/Tokyo"
+    assert timezones.resolve(None, "Europe/Paris") == "Europe/Paris"
+    assert timezones.resolve("Not/AZone", "") == "UTC"
+
+
+def test_validate_rejects_unknown_timezones():
+    assert timezones.validate("") is None
+    with pytest.raises(ValueError):
+        timezones.validate("Mars/Olympus_Mons")
+
+
+def test_local_today_near_midnight():
+    now = utc(2026, 10, 17, 23, 30)
+    assert timezones.local_today("UTC", now) == date(2026, 10, 17)
+    assert timezones.local_today("America/Los_Angeles", now) == date(2026, 10, 17)
+    assert timezones.local_today("Asia/Tokyo", now) == date(2026, 10, 18)
+
+
+@pytest.mark.parametrize("now, due", [
+    # The day before spring forward New York is UTC-5, so 08:00 local is 13:00 UTC
+    (utc(2026, 3, 7, 12, 59), {}),
+    (utc(2026, 3, 7, 13, 0), {date(2026, 3, 8): {"America/New_York"}}),
+    # On 2026-03-08 clocks jump to UTC-4, so 08:00 local comes an hour earlier in UTC
+    (utc(2026, 3, 8, 11, 59), {}),
+    (utc(2026, 3, 8, 12, 0), {date(2026, 3, 9): {"America/New_York"}}),
+])
+def test_due_buckets_across_spring_forward(now, due):
+    assert scheduler.due_buckets(now, {"America/New_York"}, hour=8) == due
+
+
+@pytest.mark.parametrize("now, due", [
+    # London is on BST (UTC+1) until 01:00 UTC on 2026-10-25
+    (utc(2026, 10, 24, 6, 59), {}),
+    (utc(2026, 10, 24, 7, 0), {date(2026, 10, 25): {"Europe/London"}}),
+    # After falling back, 08:00 local is 08:00 UTC
+    (utc(2026, 10, 25, 7, 30), {}),
+    (utc(2026, 10, 25, 8, 0), {date(2026, 10, 26): {"Europe/London"}}),
+])
+def test_due_buckets_across_fall_back(now, due):
+    assert scheduler.due_buckets(now, {"Europe/London"}, hour=8) == due
+
+
+def test_due_buckets_group_zones_by_local_tomorrow():
+    zones = {"UTC", "Europe/Paris", "Pacific/Kiritimati", "Pacific/Pago_Pago"}
+    # 18:00 UTC: 20:00 in Paris, 08:00 the next day at UTC+14, 07:00 at UTC-11
+    assert scheduler.due_buckets(utc(2026, 10, 17, 18, 0), zones, hour=8) == {
+        date(2026, 10, 18): {"UTC", "Europe/Paris"},
+        date(2026, 10, 19): {"Pacific/Kiritimati"},
+    }
+
+
+def test_feb_29_birthday_is_reminded_on_feb_28_in_common_years():
+    row = birthday_row("1992-02-29")
+    day = date(2027, 2, 28)
+    assert matches(occurrences.window_filter(day, 0), row)
+    assert occurrences.next_occurrence(row, day) == day
+
+
+def test_feb_29_birthday_waits_for_feb_29_in_leap_years():
+    row = birthday_row("1992-02-29")
+    assert occurrences.next_occurrence(row, date(2028, 2, 28)) == date(2028, 2, 29)
+    assert not matches(occurrences.window_filter(date(2028, 2, 28), 0), row)
+    assert matches(occurrences.window_filter(date(2028, 2, 29), 0), row)
+
+
+def test_feb_29_reminder_follows_the_recipients_local_day():
+    row = birthday_row("1992-02-29")
+    # 23:30 UTC on Feb 27 is already 08:30 on Feb 28 in Tokyo, so Tokyo's tomorrow is the birthday
+    due = scheduler.due_buckets(utc(2028, 2, 27, 23, 30), {"UTC", "Asia/Tokyo"}, hour=8)
+    assert due == {date(2028, 2, 28): {"UTC"}, date(2028, 2, 29): {"Asia/Tokyo"}}
+    assert occurrences.next_occurrence(row, date(2028, 2, 29)) == date(2028, 2, 29)
+    assert occurrences.next_occurrence(row, date(2028, 2, 28)) != date(2028, 2, 28)
+
+
+def test_days_until_counts_from_the_local_day():
+    row = birthday_row("1990-10-18")
+    now = utc(2026, 10, 17, 23, 30)
+    for zone, days_until in (("America/Los_Angeles", 1), ("Asia/Tokyo", 0)):
+        today = timezones.local_today(zone, now)
+        assert (occurrences.next_occurrence(row, today) - today).days == days_until
+
+
+def test_only_live_families_get_reminders():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def queue():
+        db = mongomock_motor.AsyncMongoMockClient()["onefam_test"]
+        await db.families.insert_many([
+            {"id": "live", "name": "Live", "timezone": "Europe/Paris"},
+            {"id": "deleted", "name": "Deleted", "timezone": "Europe/Paris", "deleted_at": utc(2026, 10, 1)},
+        ])
+        # "gone" has rows but no family document: its delete job has not reached them yet
+        for family_id in ("live", "deleted", "gone"):
+            member = {"id": f"{family_id}-m1", "family_id": family_id, "first_name": "Ada", "last_name": "L",
+                      "birthday": "1990-10-18", "email": f"{family_id}@example.com", "timezone": "Europe/Paris"}
+            await db.family_members.insert_one(member)
+            await db.occurrences.insert_one(occurrences.member_rows(member)["birthday"])
+        summary = await scheduler.queue_reminders(db, date(2026, 10, 18), {"Europe/Paris"})
+        queued = await db.jobs.find({}, {"_id": 0, "family_id": 1, "payload": 1}).to_list(None)
+        return summary, queued
+
+    summary, queued = asyncio.run(queue())
+    assert (summary["families"], summary["events"], summary["jobs"]) == (1, 1, 1)
+    assert [(job["family_id"], job["payload"]["recipients"]) for job in queued] == [("live", ["live@example.com"])]
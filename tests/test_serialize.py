@@ -0,0 +1,45 @@
+"""Read endpoints encode documents without validating them: same JSON as the response model, created_at stored as a date."""
+import json
+from datetime import datetime
+from typing import List
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+from pydantic import TypeAdapter
+
+import server
+
+
+def test_created_at_is_stored_as_a_date(api):
+    family_id = api.post("/api/families", json={"name": "Curie"}).json()["id"]
+    api.post(f"/api/families/{family_id}/members", json={"first_name": "Marie", "last_name": "Curie"})
+    api.post(f"/api/families/{family_id}/events", json={"event_name": "Nobel Prize", "event_date": "1911-12-10"})
+    for collection in ("families", "family_members", "custom_events"):
+        doc = api.portal.call(server.db[collection].find_one, {})
+        assert isinstance(doc["created_at"], datetime)
+
+
+def test_lists_match_the_response_model(api):
+    family_id = api.post("/api/families", json={"name": "Curie"}).json()["id"]
+    api.post(f"/api/families/{family_id}/members", json={"first_name": "Marie", "last_name": "Curie", "birthday": "1867-11-07"})
+    # A legacy document: missing defaulted fields, an inline photo, a string created_at
+    api.portal.call(server.db.family_members.insert_one, {
+        "id": "legacy", "family_id": family_id, "first_name": "Pierre", "last_name": "Curie",
+        "photo_base64": "aGVsbG8=", "created_at": "2020-01-01T00:00:00Z",
+    })
+
+    members = api.get(f"/api/families/{family_id}/members").json()
+    docs = api.portal.call(lambda: server.db.family_members.find({}, {"_id": 0}).sort("id", 1).to_list(None))
+    adapter = TypeAdapter(List[server.FamilyMember])
+    # mongomock hands back naive datetimes, which the model would write without a Z
+    expected = json.loads(adapter.dump_json(adapter.validate_python(docs), exclude={"__all__": {"created_at"}}))
+    assert [{k: v for k, v in member.items() if k != "created_at"} for member in members] == expected
+    legacy = next(member for member in members if member["id"] == "legacy")
+    assert "photo_base64" not in legacy
+    assert legacy["photo_sizes"] == [] and legacy["version"] == 0 and legacy["email"] is None
+    assert all(member["created_at"].endswith("Z") for member in members)
+
+    snapshot = api.get(f"/api/families/{family_id}/snapshot").json()
+    assert snapshot == json.loads(server.FamilySnapshot(**snapshot).model_dump_json())
+    assert {member["first_name"] for member in snapshot["members"]} == {"Marie", "Pierre"}